@@ -1,19 +1,109 @@
 import base64
 from datetime import datetime
 import json
+import threading
 import uuid
 
+from cachetools import TTLCache
 from cryptography.fernet import Fernet
-from flask import flash, session
+from flask import current_app, flash, session
 from flask_login import login_user as _login_user, logout_user as _logout_user, current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app import login_manager
-from app.models import User, LoginToken
+from app import db, login_manager
+from app.models import User, LoginToken, GithubIntegration, TrelloIntegration
+
+
+def init_principal_cache(app):
+    """
+    Sets up this worker's cache of logged-in users, so most requests authenticate without querying the database.
+
+    Entries are keyed by user ID and hold the session version they were loaded at; a hit must match the version in the
+    signed session, and is served without a query. Changes to the user/integration rows (including the session version
+    bump on logout, logging in again or deleting the account, and deactivation) evict the entry from the worker making
+    them straight away. Other workers can't be told without shared state, so they go on serving the old rows, and
+    sessions, until their entry expires: a lag of up to `SESSION_PRINCIPAL_CACHE_TTL` seconds.
+    """
+    app.extensions["principal_cache"] = TTLCache(
+        maxsize=app.config["SESSION_PRINCIPAL_CACHE_SIZE"], ttl=app.config["SESSION_PRINCIPAL_CACHE_TTL"]
+    )
+    app.extensions["principal_cache_lock"] = threading.Lock()
+
+
+def _detached_copy(instance):
+    """A copy of an instance's loaded columns that isn't attached to any session, suitable for `merge(load=False)`."""
+    mapper = inspect(instance).mapper
+    copy = mapper.class_manager.new_instance()
+
+    for column_attr in mapper.column_attrs:
+        set_committed_value(copy, column_attr.key, getattr(instance, column_attr.key))
+
+    make_transient_to_detached(copy)
+
+    return copy
+
+
+def _get_cached_principal(user_id, session_version):
+    with current_app.extensions["principal_cache_lock"]:
+        cached = current_app.extensions["principal_cache"].get(user_id)
+
+    if cached and cached[0] == session_version:
+        return db.session.merge(cached[1], load=False)
+
+    return None
+
+
+def _cache_principal(user):
+    principal = _detached_copy(user)
+    for integration_key in ("github_integration", "trello_integration"):
+        integration = getattr(user, integration_key)
+        set_committed_value(principal, integration_key, _detached_copy(integration) if integration else None)
+
+    with current_app.extensions["principal_cache_lock"]:
+        current_app.extensions["principal_cache"][user.id] = (user.session_version, principal)
+
+
+def evict_principal(user_id):
+    if current_app and "principal_cache" in current_app.extensions:
+        with current_app.extensions["principal_cache_lock"]:
+            current_app.extensions["principal_cache"].pop(user_id, None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _evict_changed_user(mapper, connection, target):
+    evict_principal(target.id)
+
+
+@event.listens_for(GithubIntegration, "after_insert")
+@event.listens_for(GithubIntegration, "after_update")
+@event.listens_for(GithubIntegration, "after_delete")
+@event.listens_for(TrelloIntegration, "after_insert")
+@event.listens_for(TrelloIntegration, "after_update")
+@event.listens_for(TrelloIntegration, "after_delete")
+def _evict_changed_integration(mapper, connection, target):
+    evict_principal(target.user_id)
+
+
+def _bump_session_version(user):
+    """Invalidates every existing session (and cached principal) for the user."""
+    user.session_version = (user.session_version or 0) + 1
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    user = User.query.get(user_id)
+    user_id = int(user_id)
+    session_version = session.get("session_version", 0)
+
+    user = _get_cached_principal(user_id, session_version)
+    if not user:
+        # Nearly every page checks the user's integrations, so fetch them alongside the user rather than lazily.
+        user = User.query.options(joinedload(User.github_integration), joinedload(User.trello_integration)).get(user_id)
+
+        if user and user.active and "token_guid" in session and user.session_version == session_version:
+            _cache_principal(user)
 
     if not user:
         return None
@@ -26,11 +116,10 @@ def load_user(user_id):
         flash("Logged out because token not in session")
         return None
 
-    # TODO: RE-ENABLE ME LATER
-    # elif user.login_tokens[-1].guid != session["token_guid"]:
-    #     flash("You have been logged out of the session.", "warning")
-    #     del session["token_guid"]
-    #     return None
+    elif user.session_version != session_version:
+        flash("You have been logged out of the session.", "warning")
+        del session["token_guid"]
+        return None
 
     return user
 
@@ -44,8 +133,7 @@ def create_login_token(app, db, email):
             db.session.add(token)
 
         token = LoginToken(guid=str(uuid.uuid4()), user=user)
-        db.session.add(token)
-        db.session.commit()
+        db.session.add(token)  # Committed by the caller, along with the email containing the login link.
 
         payload_data = {"user_id": user.id, "token_guid": token.guid}
 
@@ -59,9 +147,20 @@ def create_login_token(app, db, email):
     return payload
 
 
+def end_all_sessions(db, user):
+    """
+    Logs the user out of every session: from their next request on this worker, and on other workers once the principal
+    they've cached expires (see `init_principal_cache`).
+    """
+    _bump_session_version(user)
+    db.session.add(user)
+    db.session.commit()
+
+
 def logout_user(db):
     if current_user.is_authenticated:
         current_user.active = False
+        _bump_session_version(current_user)
         db.session.add(current_user)
         db.session.commit()
 
@@ -87,6 +186,7 @@ def login_user(app, db, payload):
 
         _login_user(token.user)
         session["token_guid"] = token.guid
+        session["session_version"] = user.session_version
 
         return user
 
@@ -111,13 +211,15 @@ def login_user(app, db, payload):
         else:
             token.consumed_at = datetime.utcnow()
             token.user.active = True
+            _bump_session_version(token.user)
 
             db.session.add(token)
             db.session.add(token.user)
             db.session.commit()
 
             _login_user(token.user)
-            session["token_guid"] = token.user.login_tokens[-1].guid
+            session["token_guid"] = token.guid
+            session["session_version"] = token.user.session_version
 
             return token.user
 
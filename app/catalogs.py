@@ -0,0 +1,138 @@
+import threading
+import time
+
+from cachetools import LRUCache
+from flask import current_app
+
+from app import db
+from app.jobs import start_background_job
+from app.models import GithubRepo, User
+from app.utils import get_github_client, get_trello_client
+
+
+def init_catalog_caches(app):
+    """
+    Sets up this worker's caches of what users can see upstream, so pickers don't re-list everything on each request.
+
+    The repo catalog for a user is reused for `REPO_CATALOG_TTL` seconds, then refreshed with conditional requests:
+    only pages GitHub says have changed are downloaded again.
+
+    The board catalog (boards with their lists) is reused for `BOARD_CATALOG_TTL` seconds. After that it is still
+    served while it's refreshed in the background, up to `BOARD_CATALOG_MAX_STALENESS` seconds old.
+    """
+    app.extensions["repo_catalogs"] = LRUCache(maxsize=app.config["REPO_CATALOG_CACHE_SIZE"])
+    app.extensions["repo_catalogs_lock"] = threading.Lock()
+    app.extensions["board_catalogs"] = LRUCache(maxsize=app.config["BOARD_CATALOG_CACHE_SIZE"])
+    app.extensions["board_catalogs_lock"] = threading.Lock()
+
+
+def get_repo_catalog(user, refresh=False):
+    """
+    The repositories `user` has admin rights on, as `{"id": ..., "full_name": ...}` dicts sorted by name.
+
+    Served from this worker's cache while fresh (unless `refresh` is set), and dropped if the user's GitHub token
+    changes.
+    """
+    # Built first so a user without a GitHub integration gets `GithubUnauthorized` (and is sent to connect one).
+    github_client = get_github_client(current_app, user)
+    token = user.github_integration.oauth_token
+    with current_app.extensions["repo_catalogs_lock"]:
+        cached = current_app.extensions["repo_catalogs"].get(user.id)
+
+    if cached and cached["token"] != token:
+        cached = None
+
+    if cached and not refresh and time.monotonic() - cached["refreshed_at"] < current_app.config["REPO_CATALOG_TTL"]:
+        return cached["repos"]
+
+    repos, pages = github_client.get_repo_catalog(cached_pages=cached["pages"] if cached else None)
+    repos = sorted(repos, key=lambda repo: repo["full_name"].lower())
+
+    with current_app.extensions["repo_catalogs_lock"]:
+        current_app.extensions["repo_catalogs"][user.id] = dict(
+            token=token, pages=pages, repos=repos, refreshed_at=time.monotonic()
+        )
+
+    return repos
+
+
+def get_repo_owners(repo_ids):
+    """Maps each of `repo_ids` that is already connected to the ID of the user who connected it, in a single query."""
+    if not repo_ids:
+        return {}
+
+    return dict(db.session.query(GithubRepo.id, GithubRepo.integration_id).filter(GithubRepo.id.in_(repo_ids)).all())
+
+
+def search_repo_catalog(repos, query, page, page_size):
+    """
+    Filters `repos` to those whose name contains `query` (case-insensitively) and returns one page of them, along with
+    the total number of matches.
+    """
+    if query:
+        repos = [repo for repo in repos if query.lower() in repo["full_name"].lower()]
+
+    start = (page - 1) * page_size
+    return repos[start : start + page_size], len(repos)
+
+
+def _cache_board_catalog(app, user, boards):
+    app.extensions["board_catalogs"][user.id] = dict(
+        token=user.trello_integration.oauth_token, boards=boards, refreshed_at=time.monotonic(), refreshing=False
+    )
+
+
+def _refresh_board_catalog(app, user_id):
+    user = User.query.get(user_id)
+    boards = None
+    try:
+        boards = get_trello_client(app, user).get_boards(with_lists=True, as_json=True)
+
+    finally:
+        with app.extensions["board_catalogs_lock"]:
+            cached = app.extensions["board_catalogs"].get(user_id)
+
+            # If the entry was evicted while we were fetching, what we fetched may predate the change - drop it.
+            if cached and cached["refreshing"]:
+                cached["refreshing"] = False
+                if boards is not None:
+                    _cache_board_catalog(app, user, boards)
+
+
+def get_board_catalog(user):
+    """
+    The Trello boards `user` can see, as API json including each board's lists (open and archived).
+
+    Served from this worker's cache while fresh. Once stale the cached boards are still returned but refreshed in the
+    background; past `BOARD_CATALOG_MAX_STALENESS`, or if the user's Trello token has changed, they're re-fetched first.
+    """
+    # Built first so a user without a Trello integration gets `TrelloUnauthorized` (and is sent to connect one).
+    trello_client = get_trello_client(current_app, user)
+    token = user.trello_integration.oauth_token
+    with current_app.extensions["board_catalogs_lock"]:
+        cached = current_app.extensions["board_catalogs"].get(user.id)
+        age = time.monotonic() - cached["refreshed_at"] if cached else None
+
+        if cached and cached["token"] == token and age < current_app.config["BOARD_CATALOG_MAX_STALENESS"]:
+            if age >= current_app.config["BOARD_CATALOG_TTL"] and not cached["refreshing"]:
+                cached["refreshing"] = True
+                start_background_job(current_app, _refresh_board_catalog, user_id=user.id)
+
+            return cached["boards"]
+
+    boards = trello_client.get_boards(with_lists=True, as_json=True)
+    with current_app.extensions["board_catalogs_lock"]:
+        _cache_board_catalog(current_app, user, boards)
+
+    return boards
+
+
+def get_catalog_board(user, board_id):
+    """The board with `board_id` from the user's board catalog, or None if they can't see it."""
+    return next((board for board in get_board_catalog(user) if board["id"] == board_id), None)
+
+
+def evict_board_catalog(user_id):
+    """Drops a user's cached boards, e.g. after changing one of them, so the next request sees fresh data."""
+    with current_app.extensions["board_catalogs_lock"]:
+        current_app.extensions["board_catalogs"].pop(user_id, None)
@@ -0,0 +1,88 @@
+import time
+
+import click
+
+from app.jobs import backfill_card_boards, backfill_pull_request_closed_at, purge_stale_data, reconcile_repositories
+from app.metrics import serve_worker_metrics
+from app.outbox import (
+    dispatch_commit_statuses,
+    get_commit_status_outbox_metrics,
+    get_email_outbox_metrics,
+    send_queued_emails,
+)
+from app.profiling import make_profile_token
+
+
+def register_commands(app):
+    @app.cli.command()
+    @click.option("--repo-id", "repo_ids", type=int, multiple=True, help="Only reconcile these repositories.")
+    def reconcile(repo_ids):
+        """Re-sync pull requests that changed since each connected repository was last reconciled."""
+        synced_count = reconcile_repositories(app, repo_ids=repo_ids or None)
+        click.echo(f"Reconciled {synced_count} pull requests")
+
+    @app.cli.command()
+    def purge():
+        """Delete expired login tokens, old closed pull requests, orphaned cards and sent outbox rows."""
+        for name, (deleted_count, duration) in purge_stale_data(app).items():
+            click.echo(f"{name}: {deleted_count} rows deleted in {duration:.2f}s")
+
+    @app.cli.command("backfill-card-boards")
+    def backfill_card_boards_command():
+        """Record the board of linked Trello cards stored before their board was tracked."""
+        click.echo(f"Backfilled the board of {backfill_card_boards(app)} cards")
+
+    @app.cli.command("backfill-closed-pull-requests")
+    def backfill_closed_pull_requests_command():
+        """Record when pull requests stored before their closing time was tracked were closed."""
+        click.echo(f"Backfilled when {backfill_pull_request_closed_at(app)} pull requests were closed")
+
+    @app.cli.command("send-emails")
+    def send_emails():
+        """Deliver every email currently due in the outbox."""
+        while any(send_queued_emails(app)):
+            pass
+
+    @app.cli.command("dispatch-statuses")
+    def dispatch_statuses():
+        """Post every commit status currently due in the outbox to GitHub."""
+        while any(dispatch_commit_statuses(app)):
+            pass
+
+    @app.cli.command("outbox-worker")
+    def outbox_worker():
+        """Keep draining the email and commit status outboxes, polling whenever both are empty."""
+        if app.config["WORKER_METRICS_PORT"]:
+            serve_worker_metrics(app.config["WORKER_METRICS_PORT"])
+
+        while True:
+            emails_sent, emails_failed = send_queued_emails(app)
+            statuses_sent, statuses_failed = dispatch_commit_statuses(app)
+
+            if emails_sent or emails_failed or statuses_sent or statuses_failed:
+                app.logger.info(
+                    f"Emails sent: {emails_sent}, failed: {emails_failed}. "
+                    f"Statuses sent: {statuses_sent}, failed: {statuses_failed}."
+                )
+
+            else:
+                time.sleep(app.config["OUTBOX_POLL_INTERVAL"])
+
+    @app.cli.command("outbox-status")
+    def outbox_status():
+        """Show the depth of the email and commit status outboxes."""
+        for outbox, metrics in (
+            ("email", get_email_outbox_metrics()),
+            ("commit_status", get_commit_status_outbox_metrics()),
+        ):
+            for name, value in metrics.items():
+                click.echo(f"{outbox}.{name}: {value}")
+
+    @app.cli.command("profile-token")
+    @click.option("--minutes", type=int, default=15, help="How long the token stays valid.")
+    def profile_token(minutes):
+        """Print a token that has requests carrying it (as an `X-Profile` header or `_profile` param) profiled."""
+        if not app.config["ADMIN_TOKEN"]:
+            raise click.ClickException("ADMIN_TOKEN must be set to sign profile tokens")
+
+        click.echo(make_profile_token(app, minutes * 60))
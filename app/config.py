@@ -1,6 +1,7 @@
 from logging import WARNING as LOGLEVEL_WARNING, DEBUG as LOGLEVEL_DEBUG
 import os
 from datetime import timedelta
+import tempfile
 
 
 class Config:
@@ -9,7 +10,8 @@ class Config:
     DEBUG = False
     TESTING = False
     LOG_LEVEL = os.environ.get("LOG_LEVEL", LOGLEVEL_WARNING)
-    DEBUG_PAYLOADS = os.environ.get("DEBUG_PAYLOADS", False)
+    # "text" or "json" (one object per line, with each record's fields as keys).
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
 
     APP_NAME = "G&T Powerup"
     SECRET_KEY = os.environ["SECRET_KEY"].encode("utf8")
@@ -17,6 +19,24 @@ class Config:
 
     PERMANENT_SESSION_LIFETIME = timedelta(hours=1)
 
+    # Per-worker cache of logged-in users: how many to hold, and for how many seconds to keep each. That's also how
+    # long other workers may go on accepting a session after logout or deactivation (see `init_principal_cache`).
+    SESSION_PRINCIPAL_CACHE_SIZE = int(os.environ.get("SESSION_PRINCIPAL_CACHE_SIZE", 1024))
+    SESSION_PRINCIPAL_CACHE_TTL = int(os.environ.get("SESSION_PRINCIPAL_CACHE_TTL", 30))
+
+    # Per-worker cache of each user's GitHub repo list: how many users to hold, and seconds before re-checking GitHub.
+    REPO_CATALOG_CACHE_SIZE = int(os.environ.get("REPO_CATALOG_CACHE_SIZE", 256))
+    REPO_CATALOG_TTL = int(os.environ.get("REPO_CATALOG_TTL", 300))
+
+    # Per-worker cache of each user's Trello boards and lists: how many users to hold, seconds before refreshing in the
+    # background, and how old an entry may get before requests wait for a fresh copy instead.
+    BOARD_CATALOG_CACHE_SIZE = int(os.environ.get("BOARD_CATALOG_CACHE_SIZE", 256))
+    BOARD_CATALOG_TTL = int(os.environ.get("BOARD_CATALOG_TTL", 60))
+    BOARD_CATALOG_MAX_STALENESS = int(os.environ.get("BOARD_CATALOG_MAX_STALENESS", 600))
+
+    # Repositories shown per page when choosing which to connect.
+    REPO_PICKER_PAGE_SIZE = int(os.environ.get("REPO_PICKER_PAGE_SIZE", 50))
+
     FEATURE_CHECKLIST_NAME = "Pull requests"
 
     PREFERRED_URL_SCHEME = "https"
@@ -31,13 +51,24 @@ class Config:
     MAIL_USERNAME = os.environ["SPARKPOST_SMTP_USERNAME"]
     MAIL_PASSWORD = os.environ["SPARKPOST_SMTP_PASSWORD"]
 
+    # Seconds the outbox worker waits between polls once there is nothing left to send.
+    OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
+
+    # Email outbox settings: emails per batch, how long a sender may hold a batch, and the retry policy for failures.
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 50))
+    EMAIL_OUTBOX_LEASE = int(os.environ.get("EMAIL_OUTBOX_LEASE", 300))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 8))
+    EMAIL_OUTBOX_RETRY_BACKOFF = int(os.environ.get("EMAIL_OUTBOX_RETRY_BACKOFF", 15))
+
     TRELLO_API_KEY = os.environ["TRELLO_API_KEY"]
     TRELLO_API_SECRET = os.environ["TRELLO_API_SECRET"]
     TRELLO_AUTHORIZE_URL = "https://trello.com/1/authorize"
+    TRELLO_API_ROOT = os.environ.get("TRELLO_API_ROOT", "https://api.trello.com/1")
     TRELLO_TOKEN_SETTINGS = dict(expiration="never", scope="read,write", name="github-signoff", key=TRELLO_API_KEY)
 
     GITHUB_CLIENT_ID = os.environ["GITHUB_CLIENT_ID"]
     GITHUB_CLIENT_SECRET = os.environ["GITHUB_CLIENT_SECRET"]
+    GITHUB_API_ROOT = os.environ.get("GITHUB_API_ROOT", "https://api.github.com")
     GITHUB_OAUTH_SETTINGS = dict(client_id=GITHUB_CLIENT_ID, scope="admin:repo_hook, repo")
     GITHUB_OAUTH_URL = (
         "https://github.com/login/oauth/authorize"
@@ -50,6 +81,73 @@ class Config:
     GITHUB_APPLICATION_ID = "2d19768ca3d464d67172"
     GITHUB_APPLICATION_SETTINGS_URL = f"https://github.com/settings/connections/applications/{GITHUB_APPLICATION_ID}"
 
+    # Commit status outbox settings: statuses per batch, how long a dispatcher may hold a batch, and the retry policy.
+    COMMIT_STATUS_OUTBOX_BATCH_SIZE = int(os.environ.get("COMMIT_STATUS_OUTBOX_BATCH_SIZE", 100))
+    COMMIT_STATUS_OUTBOX_LEASE = int(os.environ.get("COMMIT_STATUS_OUTBOX_LEASE", 60))
+    COMMIT_STATUS_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("COMMIT_STATUS_OUTBOX_MAX_ATTEMPTS", 8))
+    COMMIT_STATUS_OUTBOX_RETRY_BACKOFF = int(os.environ.get("COMMIT_STATUS_OUTBOX_RETRY_BACKOFF", 5))
+
+    # Maximum number of concurrent upstream calls made while processing a single event or batch (e.g. card lookups).
+    UPSTREAM_REQUEST_CONCURRENCY = int(os.environ.get("UPSTREAM_REQUEST_CONCURRENCY", 8))
+
+    # Maximum number of concurrent webhook create/delete calls made when syncing a user's chosen repositories.
+    GITHUB_WEBHOOK_CONCURRENCY = int(os.environ.get("GITHUB_WEBHOOK_CONCURRENCY", 8))
+
+    # Number of repositories reconciled at once, and the longest we'll sleep waiting for a GitHub rate limit to reset.
+    RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", 4))
+    RECONCILE_MAX_RATE_LIMIT_WAIT = int(os.environ.get("RECONCILE_MAX_RATE_LIMIT_WAIT", 300))
+
+    # Number of pull requests loaded and reported on at a time when a sign-off check change triggers a status recompute.
+    STATUS_RECOMPUTE_BATCH_SIZE = int(os.environ.get("STATUS_RECOMPUTE_BATCH_SIZE", 50))
+
+    # How long `flask purge` keeps used login tokens, closed pull requests and sent outbox rows, and its batch size.
+    LOGIN_TOKEN_RETENTION_DAYS = int(os.environ.get("LOGIN_TOKEN_RETENTION_DAYS", 7))
+    PULL_REQUEST_RETENTION_DAYS = int(os.environ.get("PULL_REQUEST_RETENTION_DAYS", 30))
+    OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", 14))
+    PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", 1000))
+
+    # Bearer token required to scrape `/metrics`. If unset, production refuses every scrape (and warns at startup);
+    # other environments leave the endpoint open.
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # Port on which `flask outbox-worker` serves its own Prometheus metrics (unset: not served).
+    WORKER_METRICS_PORT = int(os.environ["WORKER_METRICS_PORT"]) if os.environ.get("WORKER_METRICS_PORT") else None
+
+    # Bearer token required for `/admin/*` endpoints; if unset they're disabled.
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+    # Fraction of upstream responses and webhooks kept in each worker's payload sample buffer (0 disables sampling),
+    # optionally only for some endpoint templates or user IDs (comma-separated), plus the buffer and body size limits.
+    PAYLOAD_SAMPLE_RATE = float(os.environ.get("PAYLOAD_SAMPLE_RATE", 0))
+    PAYLOAD_SAMPLE_ENDPOINTS = [
+        endpoint for endpoint in os.environ.get("PAYLOAD_SAMPLE_ENDPOINTS", "").split(",") if endpoint
+    ]
+    PAYLOAD_SAMPLE_USER_IDS = {
+        int(user_id) for user_id in os.environ.get("PAYLOAD_SAMPLE_USER_IDS", "").split(",") if user_id
+    }
+    PAYLOAD_SAMPLE_BUFFER_SIZE = int(os.environ.get("PAYLOAD_SAMPLE_BUFFER_SIZE", 100))
+    PAYLOAD_SAMPLE_MAX_LENGTH = int(os.environ.get("PAYLOAD_SAMPLE_MAX_LENGTH", 64 * 1024))
+
+    # Trace export: "file" or "otlp" (unset disables tracing). Traces slower than TRACE_SLOW_THRESHOLD_MS are always
+    # exported, and TRACE_SAMPLE_RATE of the rest.
+    TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER")
+    TRACE_FILE_PATH = os.environ.get("TRACE_FILE_PATH", "traces.jsonl")
+    TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACE_SLOW_THRESHOLD_MS = int(os.environ.get("TRACE_SLOW_THRESHOLD_MS", 1000))
+    TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+
+    # GitHub/Trello traffic: "record" to append scrubbed request/response pairs to UPSTREAM_CASSETTE_PATH, "replay" (or
+    # "replay-timed", keeping the original response times) to answer requests from it instead; unset sends them as
+    # normal. See `app.transport`.
+    UPSTREAM_CASSETTE_MODE = os.environ.get("UPSTREAM_CASSETTE_MODE")
+    UPSTREAM_CASSETTE_PATH = os.environ.get("UPSTREAM_CASSETTE_PATH", "upstream-{pid}.jsonl.gz")
+
+    # Where profiles of requests sent with a profile token are kept (see `app.profiling`), how many are kept, and how
+    # often the sampling profiler takes a sample.
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "github-signoff-profiles"))
+    PROFILE_RETAIN = int(os.environ.get("PROFILE_RETAIN", 20))
+    PROFILE_SAMPLE_INTERVAL_MS = int(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5))
+
 
 class DevConfig(Config):
     FLASK_ENV = "development"
@@ -6,6 +6,8 @@ TICKET_APPROVED_BY = "Product signoff has been received"
 TICKETS_REMOVED_FROM_CARD = "Trello card links removed from PR"
 TICKET_SIGNOFF_NOT_REQUIRED = "Product signoff not required"
 
+GITHUB_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
 
 class StatusEnum(enum.Enum):
     """
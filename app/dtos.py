@@ -0,0 +1,67 @@
+"""
+Read-only value objects for GitHub/Trello API results that are only displayed or inspected, never persisted as-is.
+
+They're much cheaper to build than ORM instances (no instrumentation state, no `__dict__`), which matters when listing
+every board and list a user can see. The matching model's `from_data` turns one into an ORM instance when it needs
+saving.
+"""
+
+
+class _ValueObject:
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for key in self.__slots__:
+            object.__setattr__(self, key, kwargs[key])
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def _values(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash((type(self), self._values()))
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(id={self.id}, name={self._name()})>"
+
+    def _name(self):
+        return getattr(self, "name", None)
+
+
+class TrelloListData(_ValueObject):
+    __slots__ = ("id", "name", "board_id", "closed")
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(id=data["id"], name=data["name"], board_id=data["idBoard"], closed=data.get("closed", False))
+
+
+class TrelloBoardData(_ValueObject):
+    __slots__ = ("id", "name", "lists")
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            id=data["id"],
+            name=data["name"],
+            lists=tuple(TrelloListData.from_json(list_data) for list_data in data.get("lists", [])),
+        )
+
+
+class GithubRepoData(_ValueObject):
+    __slots__ = ("id", "fullname")
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(id=data["id"], fullname=data["full_name"])
+
+    def _name(self):
+        return self.fullname
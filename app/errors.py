@@ -27,5 +27,11 @@ class GithubResourceMissing(Exception):
     pass
 
 
+class GithubRateLimited(Exception):
+    def __init__(self, reset_at=None, *args, **kwargs):
+        self.reset_at = reset_at
+        super().__init__(*args, **kwargs)
+
+
 class HookAlreadyExists(Exception):
     pass
@@ -1,9 +1,15 @@
-from logging import WARNING as LOGLEVEL_WARNING
 import os
 
 from flask import Flask
 
 from app import db, login_manager, migrate, mail, breadcrumbs
+from app.auth import init_principal_cache
+from app.catalogs import init_catalog_caches
+from app.commands import register_commands
+from app.logs import get_logger, init_logging
+from app.payload_samples import init_payload_samples
+from app.profiling import init_profiling
+from app.transport import init_upstream_transport
 from app.views import main_blueprint
 from app.config import config_map
 
@@ -19,10 +25,17 @@ def create_app():
     login_manager.init_app(app)
     login_manager.login_message = None
     login_manager.login_view = ".start_page"
+    init_principal_cache(app)
+    init_catalog_caches(app)
+    init_payload_samples(app)
+    init_upstream_transport(app)
+    init_profiling(app)
 
     app.register_blueprint(main_blueprint)
+    register_commands(app)
 
-    app.logger.setLevel(app.config.get("LOG_LEVEL", LOGLEVEL_WARNING))
-    print(app.logger)
+    init_logging(app)
+    if app.config["FLASK_ENV"] == "production" and not app.config["METRICS_TOKEN"]:
+        get_logger(app).warning("METRICS_TOKEN is unset, so /metrics will refuse every scrape")
 
     return app
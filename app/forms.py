@@ -31,6 +31,8 @@ class ToggleChecklistFeatureForm(FlaskForm):
 
 class ChooseGithubRepoForm(FlaskForm):
     repo_choice = DSCheckboxField(label="Choose the repositories to connect with", coerce=int)
+    # The repositories the form was shown with, as comma-separated IDs, so a submission only changes those.
+    displayed_repo_ids = HiddenField()
 
     def __init__(self, repos=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -39,6 +41,13 @@ class ChooseGithubRepoForm(FlaskForm):
 
         self.repo_choice.choices = [(r.id, r.fullname) for r in repos]
 
+    def get_displayed_repo_ids(self):
+        try:
+            return {int(repo_id) for repo_id in (self.displayed_repo_ids.data or "").split(",") if repo_id}
+
+        except ValueError:
+            return set()
+
 
 class TransferGithubRepoForm(FlaskForm):
     repo_choice = DSRadioField(label="Transfer repositories to your account", coerce=int)
@@ -1,21 +1,32 @@
+from datetime import datetime
+
 from flask import current_app
-import requests
 from urllib.parse import urlparse
 
-from app.errors import GithubUnauthorized
+from app.constants import GITHUB_DATETIME_FORMAT
+from app.errors import GithubUnauthorized, GithubRateLimited
+from app.dtos import GithubRepoData
+from app.logs import get_logger
+from app.metrics import upstream_request
+from app.payload_samples import sample_payload
 from app.models import PullRequest, GithubRepo
+from app.transport import HttpTransport
 
 
 class GithubClient:
     GITHUB_API_ROOT = "https://api.github.com"
 
-    def __init__(self, client_id, client_secret, user):
+    def __init__(self, client_id, client_secret, user, api_root=GITHUB_API_ROOT, transport=None):
         if user.github_integration is None or user.github_integration.oauth_token is None:
             raise GithubUnauthorized("User has not completed OAuth process")
 
+        self.api_root = api_root
+        self.transport = transport or HttpTransport()
         self.client_id = client_id
         self.client_secret = client_secret
         self.user = user
+        # Kept apart from `user`, which may be the `current_user` proxy, so calls on other threads can still label it.
+        self._user_id = user.id
         self._token = self.user.github_integration.oauth_token
 
     def _default_params(self):
@@ -32,31 +43,44 @@ class GithubClient:
     def _default_auth(self, use_basic_auth=False):
         return (self.client_id, self.client_secret) if use_basic_auth else tuple()
 
-    def _request(self, method, path, params=None, json=None, use_basic_auth=False):
+    def _request(self, method, path, params=None, json=None, headers=None, use_basic_auth=False):
         if params is None:
             params = {}
 
         params = {**self._default_params(), **params}
 
-        if not path.startswith(self.GITHUB_API_ROOT):
-            path = self.GITHUB_API_ROOT + path
-
-        current_app.logger.debug(
-            f"Request settings: {method}, {path}, {params}".replace(self._token, "<TOKEN REDACTED>")
-        )
-        response = requests.request(
-            method=method,
-            url=path,
-            params=params,
-            json=json,
-            headers=self._default_headers(use_basic_auth=use_basic_auth),
-            auth=self._default_auth(use_basic_auth=use_basic_auth),
+        if not path.startswith(self.api_root):
+            path = self.api_root + path
+
+        logger = get_logger(current_app, secrets=[self._token, self.client_secret])
+        logger.debug("GitHub request", method=method, path=path, params=params)
+        with upstream_request("github", method, path) as outcome:
+            response = self.transport.request(
+                method=method,
+                url=path,
+                secrets=[self._token, self.client_id, self.client_secret],
+                params=params,
+                json=json,
+                headers={**self._default_headers(use_basic_auth=use_basic_auth), **(headers or {})},
+                auth=self._default_auth(use_basic_auth=use_basic_auth),
+            )
+            outcome["status"] = response.status_code
+
+        sample_payload(
+            current_app,
+            "github",
+            "response",
+            outcome["endpoint"],
+            lambda: response.text,
+            status=response.status_code,
+            user_id=self._user_id,
+            secrets=[self._token, self.client_secret],
         )
-        if current_app.config["DEBUG_PAYLOADS"]:
-            current_app.logger.debug(f"Response: {response.status_code}, {response.text}")
 
         if response.status_code == 401:
             raise GithubUnauthorized(response.text)
+        elif response.status_code == 403 and response.headers.get("X-RateLimit-Remaining") == "0":
+            raise GithubRateLimited(int(response.headers.get("X-RateLimit-Reset", 0)), response.text)
 
         return response
 
@@ -71,15 +95,46 @@ class GithubClient:
 
     def get_repos(self):
         response = self._get(f"/user/repos")
-        all_repos = [GithubRepo.from_json(data=repo) for repo in response.json() if repo["permissions"]["admin"]]
+        all_repos = [repo for repo in response.json() if repo["permissions"]["admin"]]
 
         while response.links.get("next"):
             response = self._get(response.links["next"]["url"])
-            all_repos.extend(
-                [GithubRepo.from_json(data=repo) for repo in response.json() if repo["permissions"]["admin"]]
-            )
+            all_repos.extend([repo for repo in response.json() if repo["permissions"]["admin"]])
+
+        return [GithubRepoData.from_json(repo) for repo in all_repos]
+
+    def get_repo_catalog(self, cached_pages=None):
+        """
+        Lists the repositories the user has admin rights on, as `{"id": ..., "full_name": ...}` dicts.
+
+        `cached_pages` maps each page's URL to `(etag, repos, next_url)` from a previous call. Pages GitHub reports as
+        unchanged (a 304, which doesn't count against the rate limit) are reused from it instead of re-downloaded.
+
+        Returns `(repos, pages)`, where `pages` can be passed back in next time.
+        """
+        cached_pages = cached_pages or {}
+        repos, pages = [], {}
+
+        url = "/user/repos"
+        while url:
+            etag, cached_repos, cached_next_url = cached_pages.get(url, (None, None, None))
+            response = self._get(url, headers={"If-None-Match": etag} if etag else None)
+
+            if response.status_code == 304:
+                pages[url] = (etag, cached_repos, cached_next_url)
 
-        return all_repos
+            else:
+                page_repos = [
+                    {"id": repo["id"], "full_name": repo["full_name"]}
+                    for repo in response.json()
+                    if repo["permissions"]["admin"]
+                ]
+                pages[url] = (response.headers.get("ETag"), page_repos, response.links.get("next", {}).get("url"))
+
+            repos.extend(pages[url][1])
+            url = pages[url][2]
+
+        return repos, pages
 
     def get_repo(self, repo_id, as_json=False):
         data = self._get(f"/repositories/{repo_id}").json()
@@ -89,16 +144,40 @@ class GithubClient:
 
         return GithubRepo.from_json(data=data)
 
-    def get_pull_request(self, repo_id, pull_request_id, as_json=False):
-        # TODO: Fix this crap proxy lookup
-        data = self._get(f"/repositories/{repo_id}").json()
-        data = self._get(f"/repos/{data['full_name']}/pulls/{pull_request_id}").json()
+    def get_pull_request(self, repo_id, pull_request_id, as_json=False, repo_fullname=None):
+        if not repo_fullname:
+            # TODO: Fix this crap proxy lookup
+            repo_fullname = self._get(f"/repositories/{repo_id}").json()["full_name"]
+
+        data = self._get(f"/repos/{repo_fullname}/pulls/{pull_request_id}").json()
 
         if as_json:
             return data
 
         return PullRequest.from_json(data=data)
 
+    def get_pull_requests(self, repo_id, updated_since=None):
+        """
+        Yields the json for a repository's pull requests, most recently updated first.
+
+        With `updated_since`, pagination stops at the first pull request (open or closed) not updated after that time.
+        Without it, every open pull request is returned.
+        """
+        params = {"state": "all" if updated_since else "open", "sort": "updated", "direction": "desc"}
+        response = self._get(f"/repositories/{repo_id}/pulls", params=params)
+
+        while True:
+            for data in response.json():
+                if updated_since and datetime.strptime(data["updated_at"], GITHUB_DATETIME_FORMAT) <= updated_since:
+                    return
+
+                yield data
+
+            if not response.links.get("next"):
+                return
+
+            response = self._get(response.links["next"]["url"])
+
     def create_webhook(self, repo_id, callback_url, secret, events=["pull_request"], active=True):
         response = self._post(
             f"/repositories/{repo_id}/hooks",
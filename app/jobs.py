@@ -0,0 +1,349 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import exists, or_
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import db
+from app.constants import GITHUB_DATETIME_FORMAT
+from app.errors import GithubRateLimited, TrelloResourceMissing, TrelloUnauthorized
+from app.metrics import event_context
+from app.models import (
+    GithubIntegration,
+    GithubRepo,
+    LoginToken,
+    OutboundCommitStatus,
+    OutboundEmail,
+    PullRequest,
+    PullRequestTrelloCard,
+    TrelloCard,
+)
+from app.tracing import trace
+from app.updater import Updater
+from app.utils import get_github_client, get_trello_client, map_concurrently
+
+
+def start_background_job(app, func, *args, **kwargs):
+    """Runs `func(app, *args, **kwargs)` on a daemon thread with its own app context, so the request isn't held up."""
+    app = getattr(app, "_get_current_object", lambda: app)()
+
+    def _run():
+        with app.app_context(), event_context(func.__name__), trace(app, func.__name__):
+            try:
+                func(app, *args, **kwargs)
+
+            except Exception:
+                app.logger.exception(f"Background job {func.__name__} failed")
+
+    thread = threading.Thread(target=_run, name=f"job-{func.__name__}", daemon=True)
+    thread.start()
+
+    return thread
+
+
+def _reconcile_repository(repo_id):
+    github_repo = GithubRepo.get_with_owner(repo_id)
+    if not github_repo:
+        return 0
+
+    updater = Updater(current_app, db, github_repo.integration.user)
+
+    while True:
+        try:
+            return updater.reconcile_repository(github_repo)
+
+        except GithubRateLimited as e:
+            wait = (e.reset_at or 0) - time.time()
+            if wait > current_app.config["RECONCILE_MAX_RATE_LIMIT_WAIT"]:
+                raise
+
+            current_app.logger.warn(f"Rate limited reconciling {github_repo}; retrying in {max(wait, 0):.0f}s")
+            time.sleep(max(wait, 0) + 1)
+
+
+def reconcile_repositories(app, repo_ids=None):
+    """Reconciles pull requests on the given (or all) connected repositories, a few repositories at a time."""
+    query = db.session.query(GithubRepo.id)
+    if repo_ids is not None:
+        query = query.filter(GithubRepo.id.in_(repo_ids))
+
+    repo_ids = [repo_id for repo_id, in query.all()]
+    app.logger.info(f"Reconciling {len(repo_ids)} repositories")
+
+    total_synced_count = 0
+    for repo_id, synced_count, error in map_concurrently(
+        app, _reconcile_repository, repo_ids, app.config["RECONCILE_CONCURRENCY"]
+    ):
+        if error:
+            app.logger.error(f"Unable to reconcile repository {repo_id}: {error}")
+            continue
+
+        app.logger.info(f"Reconciled {synced_count} pull requests on repository {repo_id}")
+        total_synced_count += synced_count
+
+    return total_synced_count
+
+
+def _backfill_card_board(card_id):
+    trello_card = TrelloCard.query.get(card_id)
+    owners = [pull_request.repo.integration.user for pull_request in trello_card.pull_requests]
+    owner = next((user for user in owners if user.trello_integration), None)
+    if not owner:
+        raise TrelloUnauthorized("No linked pull request's owner has a Trello token")
+
+    board_id = get_trello_client(current_app, owner).get_card(card_id, as_json=True)["board"]["id"]
+    TrelloCard.query.filter(TrelloCard.id == card_id).update({"board_id": board_id}, synchronize_session=False)
+    db.session.commit()
+
+    return board_id
+
+
+def backfill_card_boards(app):
+    """
+    Records the board of linked cards stored before `trello_card.board_id` existed, a batch at a time, by looking each
+    card up on Trello with the token of a user whose pull request links it. Cards that can't be looked up are logged;
+    those Trello won't give us (deleted, or no linked pull request's owner can see them) are marked and skipped by later
+    runs, while other failures are left for the next run. Returns the number of cards backfilled.
+    """
+    batch_size = app.config["STATUS_RECOMPUTE_BATCH_SIZE"]
+    backfilled_count, last_card_id = 0, ""
+
+    while True:
+        card_ids = [
+            card_id
+            for card_id, in db.session.query(TrelloCard.id)
+            .filter(
+                TrelloCard.board_id == None,  # noqa
+                TrelloCard.board_backfill_failed_at == None,  # noqa
+                TrelloCard.id > last_card_id,
+                exists().where(PullRequestTrelloCard.card_id == TrelloCard.id),
+            )
+            .order_by(TrelloCard.id)
+            .limit(batch_size)
+            .all()
+        ]
+        db.session.commit()
+        if not card_ids:
+            break
+
+        failed_card_ids = []
+        for card_id, board_id, error in map_concurrently(
+            app, _backfill_card_board, card_ids, app.config["UPSTREAM_REQUEST_CONCURRENCY"]
+        ):
+            if error:
+                app.logger.warn(f"Unable to backfill the board of card {card_id}: {error}")
+                if isinstance(error, (TrelloResourceMissing, TrelloUnauthorized)):
+                    failed_card_ids.append(card_id)
+
+            else:
+                backfilled_count += 1
+
+        if failed_card_ids:
+            TrelloCard.query.filter(TrelloCard.id.in_(failed_card_ids)).update(
+                {"board_backfill_failed_at": datetime.utcnow()}, synchronize_session=False
+            )
+            db.session.commit()
+
+        last_card_id = card_ids[-1]
+
+    if backfilled_count:
+        app.logger.info(f"Backfilled the board of {backfilled_count} cards")
+
+    return backfilled_count
+
+
+def _backfill_pull_request_closed_at(pull_request_id):
+    pull_request = PullRequest.query.options(
+        joinedload(PullRequest.repo).joinedload(GithubRepo.integration).joinedload(GithubIntegration.user)
+    ).get(pull_request_id)
+    data = get_github_client(current_app, pull_request.repo.integration.user).get_pull_request(
+        pull_request.repo_id, pull_request.number, as_json=True, repo_fullname=pull_request.repo.fullname
+    )
+    if not data["closed_at"]:
+        return None
+
+    closed_at = datetime.strptime(data["closed_at"], GITHUB_DATETIME_FORMAT)
+    PullRequest.query.filter(PullRequest.id == pull_request_id).update(
+        {"closed_at": closed_at}, synchronize_session=False
+    )
+    db.session.commit()
+
+    return closed_at
+
+
+def backfill_pull_request_closed_at(app):
+    """
+    Records when pull requests stored before `pull_request.closed_at` existed were closed, a batch at a time, by
+    looking each one without it up on GitHub with its repository owner's token. Until then they can't be purged:
+    closed pull requests get no more webhooks, and reconciling only re-syncs those updated since. Open pull requests,
+    and those that can't be looked up (which are logged), are left as they are. Returns the number backfilled.
+    """
+    batch_size = app.config["STATUS_RECOMPUTE_BATCH_SIZE"]
+    backfilled_count, last_pull_request_id = 0, 0
+
+    while True:
+        pull_request_ids = [
+            pull_request_id
+            for pull_request_id, in db.session.query(PullRequest.id)
+            .filter(PullRequest.closed_at == None, PullRequest.id > last_pull_request_id)  # noqa
+            .order_by(PullRequest.id)
+            .limit(batch_size)
+            .all()
+        ]
+        db.session.commit()
+        if not pull_request_ids:
+            break
+
+        for pull_request_id, closed_at, error in map_concurrently(
+            app, _backfill_pull_request_closed_at, pull_request_ids, app.config["UPSTREAM_REQUEST_CONCURRENCY"]
+        ):
+            if error:
+                app.logger.warn(f"Unable to backfill when pull request {pull_request_id} was closed: {error}")
+
+            elif closed_at:
+                backfilled_count += 1
+
+        last_pull_request_id = pull_request_ids[-1]
+
+    if backfilled_count:
+        app.logger.info(f"Backfilled when {backfilled_count} pull requests were closed")
+
+    return backfilled_count
+
+
+def recompute_board_statuses(app, board_id):
+    """
+    Reposts the status of every open pull request linked to a card on `board_id`, for when the board's sign-off check
+    is added or removed. Pull requests are processed in batches, grouped by the user whose tokens can update them.
+
+    Cards are found by their stored board, so those stored before it was recorded are only found once
+    `backfill_card_boards` has run (see `flask backfill-card-boards`).
+    """
+    pull_request_ids = [
+        pull_request_id
+        for pull_request_id, in db.session.query(PullRequestTrelloCard.pull_request_id)
+        .join(TrelloCard, TrelloCard.id == PullRequestTrelloCard.card_id)
+        .filter(TrelloCard.board_id == board_id)
+        .distinct()
+        .all()
+    ]
+    app.logger.info(f"Recomputing statuses for {len(pull_request_ids)} pull requests linked to board {board_id}")
+
+    batch_size = app.config["STATUS_RECOMPUTE_BATCH_SIZE"]
+    updaters = {}
+    processed_count, posted_count = 0, 0
+
+    for offset in range(0, len(pull_request_ids), batch_size):
+        pull_requests = (
+            PullRequest.query.options(
+                joinedload(PullRequest.repo).joinedload(GithubRepo.integration).joinedload(GithubIntegration.user),
+                selectinload(PullRequest.trello_cards),
+            )
+            .filter(PullRequest.id.in_(pull_request_ids[offset : offset + batch_size]))
+            .all()
+        )
+
+        pull_requests_by_user = defaultdict(list)
+        for pull_request in pull_requests:
+            pull_requests_by_user[pull_request.repo.integration.user].append(pull_request)
+
+        for user, user_pull_requests in pull_requests_by_user.items():
+            try:
+                if user.id not in updaters:
+                    updaters[user.id] = Updater(app, db, user)
+
+                posted_count += updaters[user.id].recompute_pull_request_statuses(user_pull_requests)
+
+            except Exception:
+                app.logger.exception(f"Unable to recompute statuses for pull requests owned by {user}")
+
+        processed_count += len(pull_requests)
+        app.logger.info(
+            f"Recomputed statuses for {processed_count}/{len(pull_request_ids)} pull requests linked to board "
+            f"{board_id} ({posted_count} open)"
+        )
+
+    return posted_count
+
+
+def _purge_in_batches(app, name, select_ids, delete_ids):
+    """
+    Deletes rows a batch at a time, committing after each batch so no transaction holds row locks for long.
+    `delete_ids` returns how many rows it deleted, which can be fewer than it was given if some stopped qualifying after
+    they were selected.
+    """
+    started_at = time.monotonic()
+    deleted_count = 0
+
+    while True:
+        ids = [id_ for id_, in select_ids().limit(app.config["PURGE_BATCH_SIZE"]).all()]
+        if not ids:
+            break
+
+        deleted_count += delete_ids(ids)
+        db.session.commit()
+
+    duration = time.monotonic() - started_at
+    app.logger.info(f"Purged {deleted_count} {name} rows in {duration:.2f}s")
+
+    return deleted_count, duration
+
+
+def _delete_closed_pull_requests(ids):
+    # pull_request_trello_card has no ON DELETE CASCADE, so the links must go first.
+    PullRequestTrelloCard.query.filter(PullRequestTrelloCard.pull_request_id.in_(ids)).delete(synchronize_session=False)
+    return PullRequest.query.filter(PullRequest.id.in_(ids)).delete(synchronize_session=False)
+
+
+def _delete_unlinked_cards(ids):
+    # Re-checked as part of the delete: a card linked since it was selected must stay, or its new link would violate
+    # the foreign key.
+    return TrelloCard.query.filter(
+        TrelloCard.id.in_(ids), ~exists().where(PullRequestTrelloCard.card_id == TrelloCard.id)
+    ).delete(synchronize_session=False)
+
+
+def purge_stale_data(app):
+    """
+    Deletes used/expired login tokens, long-closed pull requests, cards no longer linked to any pull request and sent
+    outbox rows, each according to its configured retention. Returns `{name: (rows_deleted, seconds_taken)}`.
+    """
+    now = datetime.utcnow()
+    login_token_cutoff = now - timedelta(days=app.config["LOGIN_TOKEN_RETENTION_DAYS"])
+    pull_request_cutoff = now - timedelta(days=app.config["PULL_REQUEST_RETENTION_DAYS"])
+    outbox_cutoff = now - timedelta(days=app.config["OUTBOX_RETENTION_DAYS"])
+
+    results = {}
+    results["login_token"] = _purge_in_batches(
+        app,
+        "login_token",
+        lambda: db.session.query(LoginToken.guid).filter(
+            or_(LoginToken.consumed_at < login_token_cutoff, LoginToken.expires_at < login_token_cutoff)
+        ),
+        lambda ids: LoginToken.query.filter(LoginToken.guid.in_(ids)).delete(synchronize_session=False),
+    )
+    results["pull_request"] = _purge_in_batches(
+        app,
+        "pull_request",
+        lambda: db.session.query(PullRequest.id).filter(PullRequest.closed_at < pull_request_cutoff),
+        _delete_closed_pull_requests,
+    )
+    results["trello_card"] = _purge_in_batches(
+        app,
+        "trello_card",
+        lambda: db.session.query(TrelloCard.id).filter(~exists().where(PullRequestTrelloCard.card_id == TrelloCard.id)),
+        _delete_unlinked_cards,
+    )
+
+    for model in (OutboundEmail, OutboundCommitStatus):
+        results[model.__tablename__] = _purge_in_batches(
+            app,
+            model.__tablename__,
+            lambda: db.session.query(model.id).filter(model.sent_at < outbox_cutoff),
+            lambda ids: model.query.filter(model.id.in_(ids)).delete(synchronize_session=False),
+        )
+
+    return results
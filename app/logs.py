@@ -0,0 +1,99 @@
+"""
+Structured logging: a message plus key/value fields, rendered as text or JSON only when a record is actually emitted.
+
+    logger = get_logger(current_app, secrets=[token])
+    logger.debug("Incoming pull request", pull_request_id=data["id"], data=data)
+
+Fields are passed as-is, so nothing is formatted (no `repr` of a whole payload) unless the level is enabled. Values
+under sensitive keys (tokens, secrets, ...) and any bound `secrets` are redacted from the rendered record.
+"""
+from datetime import datetime
+import json
+import logging
+
+from flask.logging import default_handler
+
+
+REDACTED = "<REDACTED>"
+
+# Field (or nested dict) keys whose values are never written out.
+SENSITIVE_KEYS = {"authorization", "client_secret", "key", "oauth_token", "password", "secret", "token"}
+
+# Keyword arguments that mean something to `logging.Logger._log`; everything else becomes a field.
+_LOGGING_KWARGS = {"exc_info", "stack_info", "extra"}
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Wraps a stdlib logger so keyword arguments become fields. `bind` returns a logger with fields preset."""
+
+    def __init__(self, logger, fields=None, secrets=()):
+        super().__init__(logger, fields or {})
+        self.secrets = tuple(secret for secret in secrets if secret)
+
+    def bind(self, **fields):
+        return StructuredLogger(self.logger, {**self.extra, **fields}, self.secrets)
+
+    def process(self, msg, kwargs):
+        fields = {**self.extra, **{key: kwargs.pop(key) for key in list(kwargs) if key not in _LOGGING_KWARGS}}
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields, "secrets": self.secrets}
+
+        return msg, kwargs
+
+
+def get_logger(app, secrets=(), **fields):
+    return StructuredLogger(app.logger, fields, secrets)
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {key: REDACTED if str(key).lower() in SENSITIVE_KEYS else redact(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+
+    return value
+
+
+class StructuredFormatter(logging.Formatter):
+    """Renders records as `[time] LEVEL in module: message key=value ...`, or one JSON object per line."""
+
+    def __init__(self, json_output=False):
+        super().__init__("[%(asctime)s] %(levelname)s in %(module)s: %(message)s")
+        self.json_output = json_output
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        fields = redact(getattr(record, "fields", {}))
+        if fields:
+            text += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+
+        return text
+
+    def format(self, record):
+        if self.json_output:
+            output = {
+                **redact(getattr(record, "fields", {})),
+                "time": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+                "level": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "message": record.getMessage(),
+            }
+            if record.exc_info:
+                output["exception"] = self.formatException(record.exc_info)
+
+            text = json.dumps(output, default=repr)
+
+        else:
+            text = super().format(record)
+
+        for secret in getattr(record, "secrets", ()):
+            text = text.replace(secret, REDACTED)
+
+        return text
+
+
+def init_logging(app):
+    """Sets the app's log level and renders its log records as text or JSON, according to `LOG_FORMAT`."""
+    app.logger.setLevel(app.config["LOG_LEVEL"])
+    default_handler.setFormatter(StructuredFormatter(json_output=app.config["LOG_FORMAT"] == "json"))
@@ -0,0 +1,213 @@
+"""
+Prometheus metrics for upstream API calls, Updater work and the outboxes, served at `/metrics`.
+
+When the `prometheus_multiproc_dir` environment variable is set (see `gunicorn_config.py`), each gunicorn worker
+writes its samples there and `/metrics` aggregates them across all workers. Outbox queue depths are read from the
+database on each scrape instead.
+"""
+from contextlib import contextmanager
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from flask import has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from app.tracing import span
+
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "upstream_request_seconds",
+    "Latency of calls to GitHub, Trello and SparkPost.",
+    ["upstream", "method", "endpoint", "status", "event"],
+)
+UPDATER_STAGE_SECONDS = Histogram(
+    "updater_stage_seconds", "Time spent in each stage of processing an event, including upstream calls.", ["stage"]
+)
+UNIT_OF_WORK_DB_STATEMENTS = Histogram(
+    "unit_of_work_db_statements",
+    "DB statements run in each Updater transaction.",
+    ["stage"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+UNIT_OF_WORK_DB_SECONDS = Histogram(
+    "unit_of_work_db_seconds", "Time spent in the database (statements and commit) per Updater transaction.", ["stage"]
+)
+WEBHOOK_TO_STATUS_SECONDS = Histogram(
+    "webhook_to_status_seconds",
+    "Time from a webhook reaching us to its commit status being posted: total, and split into processing (until the "
+    "status is queued), queueing (until the dispatcher posts it) and upstream (the POST itself). Posts of a status "
+    "that was superseded while in flight have outcome=superseded.",
+    ["event", "phase", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800),
+)
+
+# Rewrites that collapse IDs (and tokens) in API paths, so calls to the same endpoint share one `endpoint` label.
+ENDPOINT_TEMPLATES = {
+    "github": [
+        (re.compile(r"^/repos/[^/]+/[^/]+"), "/repos/{owner}/{repo}"),
+        (re.compile(r"^/applications/[^/]+/tokens/[^/]+"), "/applications/{client_id}/tokens/{token}"),
+        (re.compile(r"/[0-9a-f]{40}(?=/|$)"), "/{sha}"),
+        (re.compile(r"/\d+(?=/|$)"), "/{id}"),
+    ],
+    "trello": [
+        (re.compile(r"^/tokens/[^/]+"), "/tokens/{token}"),
+        (re.compile(r"^/(boards|lists|cards|checklists|webhooks)/(?!me(?:/|$))[^/]+"), r"/\1/{id}"),
+        (re.compile(r"/(checkItem|checkItems)/[^/]+"), r"/\1/{id}"),
+    ],
+}
+API_ROOTS = {"github": "/", "trello": "/1/"}
+
+_events = threading.local()
+
+
+def current_event():
+    """What triggered the current upstream calls: an explicit `event_context`, else the Flask endpoint being served."""
+    event = getattr(_events, "name", None)
+    if event:
+        return event
+
+    return (request.endpoint or "unknown") if has_request_context() else "background"
+
+
+def current_trigger():
+    """`(event, received_at)` for the webhook being handled, or `(None, None)` outside one."""
+    received_at = getattr(_events, "received_at", None)
+    return (current_event(), received_at) if received_at else (None, None)
+
+
+@contextmanager
+def event_context(name, received_at=None):
+    """
+    Labels upstream calls made inside the block (or decorated function) with event `name`. Blocks may be nested.
+    For webhooks, `received_at` is when the delivery reached us; commit statuses queued in the block carry it.
+    """
+    previous = getattr(_events, "name", None), getattr(_events, "received_at", None)
+    _events.name, _events.received_at = name, received_at
+    try:
+        yield
+
+    finally:
+        _events.name, _events.received_at = previous
+
+
+def endpoint_template(upstream, url):
+    path = urlparse(url).path
+    api_root = API_ROOTS.get(upstream, "/")
+    if path.startswith(api_root):
+        path = "/" + path[len(api_root) :]
+
+    for pattern, replacement in ENDPOINT_TEMPLATES.get(upstream, []):
+        path = pattern.sub(replacement, path)
+
+    return path
+
+
+@contextmanager
+def upstream_request(upstream, method, url):
+    """
+    Times the upstream call made inside the block. Set `outcome["status"]` to the response's status code; calls that
+    raise before doing so are recorded with status "error". `outcome["endpoint"]` is the call's endpoint template.
+    """
+    outcome = {"status": "error", "endpoint": endpoint_template(upstream, url)}
+    started_at = time.monotonic()
+    try:
+        with span(f"{upstream} {method.upper()} {outcome['endpoint']}", upstream=upstream) as call_span:
+            yield outcome
+            call_span.set(status=outcome["status"])
+
+    finally:
+        UPSTREAM_REQUEST_SECONDS.labels(
+            upstream, method.upper(), outcome["endpoint"], str(outcome["status"]), current_event()
+        ).observe(time.monotonic() - started_at)
+
+
+@contextmanager
+def updater_stage(stage):
+    """Times an Updater stage, recording it as a trace span too. Yields the span."""
+    started_at = time.monotonic()
+    try:
+        with span(stage) as stage_span:
+            yield stage_span
+
+    finally:
+        UPDATER_STAGE_SECONDS.labels(stage).observe(time.monotonic() - started_at)
+
+
+def record_unit_of_work(stage, statements, seconds):
+    UNIT_OF_WORK_DB_STATEMENTS.labels(stage).observe(statements)
+    UNIT_OF_WORK_DB_SECONDS.labels(stage).observe(seconds)
+
+
+def record_webhook_to_status(event, triggered_at, queued_at, post_started_at, posted_at, superseded=False):
+    outcome = "superseded" if superseded else "current"
+    for phase, started_at, finished_at in (
+        ("total", triggered_at, posted_at),
+        ("processing", triggered_at, queued_at),
+        ("queueing", queued_at, post_started_at),
+        ("upstream", post_started_at, posted_at),
+    ):
+        WEBHOOK_TO_STATUS_SECONDS.labels(event, phase, outcome).observe(
+            max((finished_at - started_at).total_seconds(), 0)
+        )
+
+
+def _registry():
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+
+    return REGISTRY
+
+
+def serve_worker_metrics(port):
+    """Serves this (non-web) process's metrics on `port`, e.g. for the outbox worker, which `/metrics` can't see."""
+    start_http_server(port, registry=_registry())
+
+
+class _Families:
+    """A collector for metric families that were read at scrape time, rather than recorded by any one worker."""
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def outbox_metric_families(outbox_metrics):
+    """Gauges of each outbox's queue depth, from `{outbox: metrics}` as returned by `get_email_outbox_metrics` etc."""
+    messages = GaugeMetricFamily(
+        "outbox_messages",
+        "Messages waiting in each outbox (pending) or given up on (abandoned).",
+        labels=["outbox", "state"],
+    )
+    oldest_pending_age = GaugeMetricFamily(
+        "outbox_oldest_pending_age_seconds", "Age of the oldest message waiting in each outbox.", labels=["outbox"]
+    )
+    for outbox, metrics in outbox_metrics.items():
+        messages.add_metric([outbox, "pending"], metrics["pending"])
+        messages.add_metric([outbox, "abandoned"], metrics["abandoned"])
+        oldest_pending_age.add_metric([outbox], metrics["oldest_pending_age_seconds"])
+
+    return [messages, oldest_pending_age]
+
+
+def generate_metrics(families=()):
+    """
+    Returns `(body, content_type)` for a scrape, aggregated across workers when running multi-process. `families` are
+    reported as they are: they're the same whichever worker is scraped (e.g. read from the database).
+    """
+    return generate_latest(_registry()) + generate_latest(_Families(families)), CONTENT_TYPE_LATEST
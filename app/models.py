@@ -2,16 +2,103 @@ from datetime import datetime, timedelta
 import random
 
 from flask import current_app
-from sqlalchemy.orm import backref
+from sqlalchemy import false
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import operators
+from sqlalchemy.types import LargeBinary, TypeDecorator
+from sqlalchemy.orm import backref, joinedload, make_transient_to_detached
 
 from app import db
-from app.constants import StatusEnum
+from app.constants import GITHUB_DATETIME_FORMAT, StatusEnum
+from app.dtos import TrelloBoardData, TrelloListData
+from app.logs import get_logger
 
 
 def random_external_id():
     return random.SystemRandom().randint(10 ** 14, (10 ** 15) - 1)
 
 
+class TrelloObjectId(TypeDecorator):
+    """
+    A Trello object ID (board, list, ...), which is always 24 hex characters, stored as 12 raw bytes. Halves the size of
+    the keys and their indexes. Values are still plain hex strings on the Python side.
+
+    Writing a malformed ID fails, but comparing against one (`==` or `in_`) matches nothing, so a bad ID from a request
+    or payload finds no rows rather than erroring.
+    """
+
+    impl = LargeBinary(12)
+
+    class Comparator(TypeDecorator.Comparator):
+        def operate(self, op, *other, **kwargs):
+            if op is operators.eq and TrelloObjectId.is_malformed(other[0]):
+                return false()
+
+            if op is operators.in_op and isinstance(other[0], (list, tuple, set, frozenset)):
+                values = [value for value in other[0] if not TrelloObjectId.is_malformed(value)]
+                if not values:
+                    return false()
+
+                other = (values,) + other[1:]
+
+            return super().operate(op, *other, **kwargs)
+
+    comparator_factory = Comparator
+
+    @staticmethod
+    def is_valid(value):
+        """Whether `value` looks like a Trello object ID, for checking IDs from users before they reach a query."""
+        try:
+            return len(bytes.fromhex(value)) == 12
+
+        except (TypeError, ValueError):
+            return False
+
+    @classmethod
+    def is_malformed(cls, value):
+        """Whether `value` is a string that can't be a Trello object ID (SQL expressions and `None` aren't)."""
+        return isinstance(value, str) and not cls.is_valid(value)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+
+        if not self.is_valid(value):
+            # Surfaces as a `StatementError` naming the bad value, rather than a bare `fromhex` failure.
+            raise ValueError(f"{value!r} is not a Trello object ID")
+
+        return bytes.fromhex(value)
+
+    def process_result_value(self, value, dialect):
+        return bytes(value).hex() if value is not None else None
+
+
+def upsert_statement(model, instances, update_columns=None):
+    """
+    Builds a single `INSERT ... ON CONFLICT` writing the column values of all `instances`.
+
+    Rows that already exist have `update_columns` overwritten with the new values; without `update_columns` any
+    conflicting row (on any unique constraint, not just the PK) is left alone. Either way a concurrent writer of the
+    same rows can't make the statement fail. Instances sharing a PK are written once, with the last one's values, as
+    Postgres won't let one `ON CONFLICT DO UPDATE` affect a row twice.
+    """
+    table = model.__table__
+    rows = {}
+    for instance in instances:
+        row = {column.key: getattr(instance, column.key) for column in table.columns}
+        rows[tuple(row[column.key] for column in table.primary_key.columns)] = row
+
+    statement = insert(table).values(list(rows.values()))
+
+    if update_columns:
+        return statement.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={column: getattr(statement.excluded, column) for column in update_columns},
+        )
+
+    return statement.on_conflict_do_nothing()
+
+
 class LoginToken(db.Model):
     __tablename__ = "login_token"
     guid = db.Column(db.Text, primary_key=True)  # TODO:  should change this to a binary/native uuid type
@@ -34,13 +121,22 @@ class User(db.Model):
     # Whether the user's account is active. True on login, False on logout. Used for session invalidation.
     active = db.Column(db.Boolean, default=False, nullable=False, index=False)
 
+    # Bumped on logout and on each login; sessions (and cached principals) from an older version are no longer valid.
+    session_version = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+
     # Whether the user wants their connected repos to attach pull requests to checklists on Trello cards.
     # Probably wants moving off the user table?
     checklist_feature_enabled = db.Column(db.Boolean, default=False, nullable=False)
 
     # MATERIALIZE RELATIONSHIPS
+    # Never eager-load these: login tokens accumulate and the user is loaded on every authenticated request.
     login_tokens = db.relationship(
-        LoginToken, primaryjoin=id == LoginToken.user_id, lazy="joined", backref="user", cascade="all, delete-orphan"
+        LoginToken,
+        primaryjoin=id == LoginToken.user_id,
+        lazy="select",
+        backref="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     @classmethod
@@ -78,7 +174,7 @@ class GithubIntegration(db.Model):
 
     # MATERIALIZE RELATIONSHIPS
     user = db.relationship(
-        User, lazy="joined", backref=backref("github_integration", cascade="all, delete-orphan", uselist=False)
+        User, lazy="select", backref=backref("github_integration", cascade="all, delete-orphan", uselist=False)
     )
 
 
@@ -92,7 +188,7 @@ class TrelloIntegration(db.Model):
 
     # MATERIALIZE RELATIONSHIPS
     trello_integration = db.relationship(
-        User, lazy="joined", backref=backref("trello_integration", cascade="all, delete-orphan", uselist=False)
+        User, lazy="select", backref=backref("trello_integration", cascade="all, delete-orphan", uselist=False)
     )
 
 
@@ -114,32 +210,42 @@ class GithubRepo(db.Model):
     # Used to validate that the payload is coming from GitHub (or at least, an admin of the repo)
     hook_secret = db.Column(db.Text, index=True, unique=False, nullable=True)
 
+    # Cursor for the reconciliation job: pull requests updated after this time have not been re-synced yet.
+    reconciled_at = db.Column(db.DateTime, nullable=True)
+
     # DECLARE RELATIONSHIPS
     # Which github integration connected the repository (i.e. which user). Gives references to oauth token and hook id.
     integration_id = db.Column(
         db.Integer,
         db.ForeignKey(GithubIntegration.user_id, name="fk_github_repo_github_integration_user_id"),
-        index=False,
+        index=True,
         nullable=False,
     )
 
     # MATERIALIZE RELATIONSHIPS
     integration = db.relationship(
-        GithubIntegration, lazy="joined", backref=backref("github_repos", cascade="all, delete-orphan")
+        GithubIntegration, lazy="select", backref=backref("github_repos", cascade="all, delete-orphan")
     )
 
     def __repr__(self):
         return f"<GitHubRepo(id={self.id}, fullname={self.fullname})>"
 
     @classmethod
-    def from_json(cls, data):
-        github_repo = cls.query.get(data["id"])
-        if not github_repo:
-            github_repo = cls()
-            github_repo.hydrate(data=data)
+    def get_with_owner(cls, repo_id):
+        """Fetches a repo along with its integration and owning user in one query, for routing incoming webhooks."""
+        return cls.query.options(joinedload(cls.integration).joinedload(GithubIntegration.user)).get(repo_id)
 
+    @classmethod
+    def from_json(cls, data):
+        github_repo = cls()
+        github_repo.hydrate(data=data)
         return github_repo
 
+    @classmethod
+    def from_data(cls, repo_data):
+        """Turns a `GithubRepoData` into a new, unsaved row."""
+        return cls(id=repo_data.id, fullname=repo_data.fullname)
+
     def hydrate(self, github_client=None, data=None):
         """Pulls in the latest variable data from GitHub's API, or restores from existing GitHub API json data"""
         if not github_client and not data:
@@ -150,7 +256,7 @@ class GithubRepo(db.Model):
 
         self.id = data["id"]
         self.fullname = data["full_name"]
-        current_app.logger.debug(f"Created new repo {self}")
+        get_logger(current_app).debug("Created new repo", repo=self)
 
         return self
 
@@ -164,6 +270,9 @@ class PullRequest(db.Model):
     # The number of the pull request (sequential per repository - determined by GitHub)
     number = db.Column(db.Integer, nullable=False)
 
+    # When the pull request was closed or merged, if it has been. Closed pull requests are eventually purged.
+    closed_at = db.Column(db.DateTime, index=True, nullable=True)
+
     # DECLARE RELATIONSHIPS
     repo_id = db.Column(
         db.Integer,
@@ -172,38 +281,53 @@ class PullRequest(db.Model):
     )
 
     # MATERIALIZE RELATIONSHIPS
-    repo = db.relationship(GithubRepo, lazy="joined", backref=backref("pull_requests", cascade="all, delete-orphan"))
+    repo = db.relationship(GithubRepo, lazy="select", backref=backref("pull_requests", cascade="all, delete-orphan"))
 
     @classmethod
     def from_json(cls, data):
-        pull_request = cls.query.get(data["id"])
-        if not pull_request:
-            pull_request = cls()
-
+        pull_request = cls()
         pull_request.hydrate(data=data)
-
         return pull_request
 
+    @classmethod
+    def upsert_from_json(cls, data):
+        """
+        Inserts or updates the row for a pull request in one statement, returning a hydrated instance attached to the
+        session without SELECTing it back.
+        """
+        pull_request = cls.from_json(data)
+        db.session.execute(upsert_statement(cls, [pull_request], update_columns=["number", "closed_at", "repo_id"]))
+
+        make_transient_to_detached(pull_request)
+        return db.session.merge(pull_request, load=False).hydrate(data=data)
+
     def hydrate(self, github_client=None, data=None):
         """Pulls in the latest variable data from GitHub's API, or restores from existing GitHub API json data"""
         if not github_client and not data:
             raise ValueError("Must provide either a GitHub client or an existing json data blob")
 
         if not data:
-            data = github_client.get_pull_request(repo_id=self.repo_id, pull_request_id=self.number, as_json=True)
+            data = github_client.get_pull_request(
+                repo_id=self.repo_id,
+                pull_request_id=self.number,
+                repo_fullname=self.repo.fullname if self.repo else None,
+                as_json=True,
+            )
 
         # Core model fields
         self.id = data["id"]
         self.number = data["number"]
         self.repo_id = data["head"]["repo"]["id"]
+        self.closed_at = datetime.strptime(data["closed_at"], GITHUB_DATETIME_FORMAT) if data["closed_at"] else None
 
         # Additional fields hydrated from the GitHub API - not persisted or available otherwise.
         self.html_url = data["html_url"]
         self.statuses_url = data["statuses_url"]
-        self.body = data["body"]
+        self.head_sha = data["head"]["sha"]
+        self.body = data["body"] or ""
         self.state = data["state"]  # TODO: fix this conflcit with enum
 
-        current_app.logger.debug(f"Created new pull request {self}")
+        get_logger(current_app).debug("Created new pull request", pull_request=self)
 
         return self
 
@@ -213,7 +337,7 @@ class TrelloBoard(db.Model):
     Converts a JSON data blob from the Trello API in a Python object representing a Trello Board.
     """
 
-    id = db.Column(db.Text, primary_key=True)
+    id = db.Column(TrelloObjectId, primary_key=True)
 
     @classmethod
     def from_json(cls, data):
@@ -222,6 +346,13 @@ class TrelloBoard(db.Model):
         trello_board.hydrate(data=data)
         return trello_board
 
+    @classmethod
+    def from_data(cls, board_data):
+        """Turns a `TrelloBoardData` into a new, unsaved row."""
+        trello_board = cls(id=board_data.id)
+        trello_board.name = board_data.name
+        return trello_board
+
     def hydrate(self, trello_client=None, data=None):
         """Populate the object either from an existing Trello JSON data blob or by fetching one"""
         if not trello_client and not data:
@@ -237,7 +368,7 @@ class TrelloBoard(db.Model):
         self.name = data["name"]
 
         if "lists" in data:
-            self.lists = [TrelloList.from_json(list_data) for list_data in data["lists"]]
+            self.lists = [TrelloListData.from_json(list_data) for list_data in data["lists"]]
             self.lists_by_id = {list_.id: list_ for list_ in self.lists}
 
         return self
@@ -246,9 +377,8 @@ class TrelloBoard(db.Model):
 class TrelloList(db.Model):
     __tablename__ = "trello_list"
 
-    # Non-sequential text-based PK matching Trello's internal ID for the list.
-    # Performance issues at scale?
-    id = db.Column(db.Text, primary_key=True)
+    # Non-sequential PK matching Trello's internal ID for the list.
+    id = db.Column(TrelloObjectId, primary_key=True)
 
     # Records the Trello ID associated with the hook we create.
     hook_id = db.Column(db.Text, nullable=True)
@@ -259,6 +389,14 @@ class TrelloList(db.Model):
         trello_list.hydrate(data=data)
         return trello_list
 
+    @classmethod
+    def from_data(cls, list_data):
+        """Turns a `TrelloListData` into a new, unsaved row."""
+        trello_list = cls(id=list_data.id)
+        trello_list.name = list_data.name
+        trello_list.board_id = list_data.board_id
+        return trello_list
+
     def hydrate(self, trello_client=None, data=None):
         """Pulls in the latest variable data from Trello's API, or restores from existing Trello API json data"""
         if not trello_client and not data:
@@ -287,21 +425,21 @@ class ProductSignoff(db.Model):
     )
 
     trello_board_id = db.Column(
-        db.Text,
+        TrelloObjectId,
         db.ForeignKey(TrelloBoard.id, name="fk_product_signoff_trello_board_id", ondelete="cascade"),
         index=True,
         nullable=False,
         unique=True,
     )
     trello_list_id = db.Column(
-        db.Text,
+        TrelloObjectId,
         db.ForeignKey(TrelloList.id, name="fk_product_signoff_trello_list_id", ondelete="cascade"),
         index=True,
         nullable=False,
         unique=True,
     )
 
-    user = db.relationship(User, lazy="joined", backref=backref("product_signoffs", cascade="all, delete-orphan"))
+    user = db.relationship(User, lazy="select", backref=backref("product_signoffs", cascade="all, delete-orphan"))
     trello_board = db.relationship(
         TrelloBoard,
         lazy="joined",
@@ -340,10 +478,32 @@ class PullRequestTrelloCard(db.Model):
     card_id = db.Column(
         db.Text, db.ForeignKey("trello_card.id", name="fk_pull_request_trello_card_card_id"), primary_key=True
     )
+    # The PK only serves lookups by card, so finding a pull request's cards needs its own index.
     pull_request_id = db.Column(
-        db.Integer, db.ForeignKey(PullRequest.id, name="fk_pull_request_trello_card_pull_request_id"), primary_key=True
+        db.Integer,
+        db.ForeignKey(PullRequest.id, name="fk_pull_request_trello_card_pull_request_id"),
+        primary_key=True,
+        index=True,
     )
 
+    @classmethod
+    def get_card_ids(cls, pull_request_id):
+        return {card_id for card_id, in db.session.query(cls.card_id).filter(cls.pull_request_id == pull_request_id)}
+
+    @classmethod
+    def replace_links(cls, pull_request_id, card_ids):
+        """Links a pull request to exactly `card_ids` (which must already exist), in at most two statements."""
+        stale_links = cls.__table__.delete().where(cls.pull_request_id == pull_request_id)
+        if card_ids:
+            stale_links = stale_links.where(~cls.card_id.in_(card_ids))
+
+        db.session.execute(stale_links)
+
+        if card_ids:
+            db.session.execute(
+                upsert_statement(cls, [cls(card_id=card_id, pull_request_id=pull_request_id) for card_id in card_ids])
+            )
+
 
 class TrelloCard(db.Model):
     __tablename__ = "trello_card"
@@ -351,23 +511,25 @@ class TrelloCard(db.Model):
     # Non-sequential text-based PK matching Trello's internal ID for the card.
     id = db.Column(db.Text, primary_key=True)
 
+    # The board the card was on when last hydrated. Not a foreign key: most boards have no sign-off check/row.
+    board_id = db.Column(TrelloObjectId, index=True, nullable=True)
+    # When `backfill_card_boards` gave up on the card because Trello won't give it us, so later runs skip it. Hydrating
+    # the card on a later event still records its board.
+    board_backfill_failed_at = db.Column(db.DateTime, nullable=True)
+
     # MATERIALIZE RELATIONSHIPS
     pull_requests = db.relationship(
         PullRequest,
         secondary="pull_request_trello_card",
-        lazy="joined",
+        lazy="select",
         backref=backref("trello_cards", cascade="all"),
         uselist=True,
     )
 
     @classmethod
     def from_json(cls, data):
-        trello_card = cls.query.filter(cls.id == data["shortLink"]).one_or_none()
-        if not trello_card:
-            trello_card = cls()
-
+        trello_card = cls()
         trello_card.hydrate(data=data)
-
         return trello_card
 
     def hydrate(self, trello_client=None, data=None):
@@ -380,11 +542,13 @@ class TrelloCard(db.Model):
         self.id = data["shortLink"]
         self.real_id = data["id"]
 
+        # Only ever inspected, so kept as lightweight value objects rather than ORM instances.
         if "list" in data:
-            self.list = TrelloList.from_json(data["list"])
+            self.list = TrelloListData.from_json(data["list"])
 
         if "board" in data:
-            self.board = TrelloBoard.from_json(data["board"])
+            self.board = TrelloBoardData.from_json(data["board"])
+            self.board_id = self.board.id
 
         return self
 
@@ -392,8 +556,8 @@ class TrelloCard(db.Model):
 class TrelloChecklist(db.Model):
     __tablename__ = "trello_checklist"
 
-    # Non-sequential text-based PK matching Trello's internal ID for the checklist.
-    id = db.Column(db.Text, primary_key=True)
+    # Trello's internal ID for the checklist.
+    id = db.Column(TrelloObjectId, primary_key=True)
 
     # DECLARE RELATIONSHIPS
     card_id = db.Column(
@@ -431,12 +595,12 @@ class TrelloChecklist(db.Model):
 class TrelloCheckitem(db.Model):
     __tablename__ = "trello_checkitem"
 
-    # Non-sequential text-based PK matching Trello's internal ID for the checkitem.
-    id = db.Column(db.Text, primary_key=True)
+    # Trello's internal ID for the checkitem.
+    id = db.Column(TrelloObjectId, primary_key=True)
 
     # DECLARE RELATIONSHIPS
     checklist_id = db.Column(
-        db.Text,
+        TrelloObjectId,
         db.ForeignKey(TrelloChecklist.id, name="fk_trello_checkitem_trello_checklist_id", ondelete="cascade"),
         db.UniqueConstraint(name="uix_id"),
         nullable=False,
@@ -444,6 +608,7 @@ class TrelloCheckitem(db.Model):
     pull_request_id = db.Column(
         db.Integer,
         db.ForeignKey(PullRequest.id, name="fk_trello_checkitem_pull_request_id", ondelete="cascade"),
+        index=True,
         nullable=False,
     )
 
@@ -477,3 +642,88 @@ class TrelloCheckitem(db.Model):
         self.state = data["state"]
 
         return self
+
+
+class OutboundEmail(db.Model):
+    """
+    A transactional email waiting to be sent by the outbox sender (`flask send-emails`). Rows are written in the same
+    transaction as whatever caused the email, so an email is never sent for work that was rolled back.
+    """
+
+    __tablename__ = "outbound_email"
+
+    # Sequential PK - also gives us the send order.
+    id = db.Column(db.Integer, primary_key=True)
+
+    recipient = db.Column(db.Text, nullable=False)
+    from_email = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+
+    # Rendered at enqueue time, while we still have the request context needed to build external URLs.
+    html = db.Column(db.Text, nullable=False)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # The earliest time the sender should (re)try this email. Pushed back after each failed attempt.
+    send_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    # Keeps the sender's "what's due?" query cheap however many sent emails pile up.
+    __table_args__ = (db.Index("ix_outbound_email_unsent_send_after", send_after, postgresql_where=sent_at.is_(None)),)
+
+    def __repr__(self):
+        return f"<OutboundEmail(id={self.id}, subject={self.subject}, attempts={self.attempts})>"
+
+
+class OutboundCommitStatus(db.Model):
+    """
+    A commit status waiting to be posted to GitHub by the outbox dispatcher. There is one row per (repo, sha, context):
+    a newer write for the same commit replaces the older one, so only the latest status is ever sent.
+    """
+
+    __tablename__ = "outbound_commit_status"
+
+    # Sequential PK
+    id = db.Column(db.Integer, primary_key=True)
+
+    # DECLARE RELATIONSHIPS
+    repo_id = db.Column(
+        db.Integer,
+        db.ForeignKey(GithubRepo.id, name="fk_outbound_commit_status_github_repo_id", ondelete="cascade"),
+        nullable=False,
+    )
+
+    sha = db.Column(db.Text, nullable=False)
+    context = db.Column(db.Text, nullable=False)
+    statuses_url = db.Column(db.Text, nullable=False)
+    state = db.Column(db.Text, nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    target_url = db.Column(db.Text, nullable=False, default="")
+
+    # Bumped whenever the status is superseded, so the dispatcher can tell if what it sent is still the latest write.
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # The webhook that led to this write and when it reached us, for measuring webhook-to-status latency.
+    triggered_by = db.Column(db.Text, nullable=True)
+    triggered_at = db.Column(db.DateTime, nullable=True)
+
+    # The earliest time the dispatcher should (re)try this status.
+    send_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    # Set while a dispatcher is posting the row, whatever version of it. Superseding the status leaves it alone, so
+    # no other dispatcher posts the newer version until the older post has returned (or the lease has expired).
+    leased_until = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint(repo_id, sha, context, name="uix_outbound_commit_status_repo_id_sha_context"),
+        db.Index("ix_outbound_commit_status_unsent_send_after", send_after, postgresql_where=sent_at.is_(None)),
+    )
+
+    def __repr__(self):
+        return f"<OutboundCommitStatus(id={self.id}, sha={self.sha}, state={self.state}, attempts={self.attempts})>"
@@ -0,0 +1,320 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+import requests
+from sparkpost.exceptions import SparkPostAPIException
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db, sparkpost
+from app.errors import GithubRateLimited, GithubUnauthorized
+from app.metrics import current_trigger, event_context, record_webhook_to_status, upstream_request
+from app.models import GithubRepo, OutboundCommitStatus, OutboundEmail, User
+from app.tracing import traced
+from app.utils import get_github_client, map_concurrently
+
+
+def _unsent(model, max_attempts):
+    return model.query.filter(model.sent_at == None, model.attempts < max_attempts)  # noqa
+
+
+def _outbox_metrics(model, max_attempts, queued_at):
+    pending_count, oldest_queued_at = (
+        _unsent(model, max_attempts).with_entities(func.count(model.id), func.min(queued_at)).one()
+    )
+    abandoned_count = model.query.filter(model.sent_at == None, model.attempts >= max_attempts).count()  # noqa
+
+    return {
+        "pending": pending_count,
+        "abandoned": abandoned_count,
+        "oldest_pending_age_seconds": (datetime.utcnow() - oldest_queued_at).total_seconds() if oldest_queued_at else 0,
+    }
+
+
+def _retry_at(now, attempts, backoff):
+    return now + timedelta(seconds=backoff * 2 ** attempts)
+
+
+def enqueue_email(recipient, subject, html, from_email=None):
+    """Adds an email to the outbox. Nothing is sent until the caller commits; a rollback discards it too."""
+    email = OutboundEmail(
+        recipient=recipient,
+        subject=subject,
+        html=html,
+        from_email=from_email or current_app.config["MAIL_DEFAULT_SENDER"],
+    )
+    db.session.add(email)
+
+    return email
+
+
+@event_context("send_emails")
+@traced("send_emails")
+def send_queued_emails(app):
+    """
+    Sends one batch of due emails, returning `(sent_count, failed_count)`.
+
+    Like `dispatch_commit_statuses`, due rows are leased and committed before anything is sent, here by pushing back
+    `send_after` (emails are never superseded, so need no separate lease). No locks are held while waiting on
+    SparkPost, and each email is marked sent as soon as it goes out. All sends go through the shared SparkPost client,
+    which keeps its HTTP connection alive between calls. Failed sends are retried with exponential backoff.
+    """
+    now = datetime.utcnow()
+    emails = (
+        _unsent(OutboundEmail, app.config["EMAIL_OUTBOX_MAX_ATTEMPTS"])
+        .filter(OutboundEmail.send_after <= now)
+        .order_by(OutboundEmail.id)
+        .limit(app.config["EMAIL_OUTBOX_BATCH_SIZE"])
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    sends = []
+    for email in emails:
+        email.send_after = now + timedelta(seconds=app.config["EMAIL_OUTBOX_LEASE"])
+        sends.append(
+            dict(
+                id=email.id,
+                attempts=email.attempts,
+                recipient=email.recipient,
+                html=email.html,
+                from_email=email.from_email,
+                subject=email.subject,
+            )
+        )
+
+    db.session.commit()
+
+    sent_count, failed_count = 0, 0
+    for send in sends:
+        try:
+            with upstream_request("sparkpost", "post", "/transmissions") as outcome:
+                try:
+                    sparkpost.transmissions.send(
+                        recipients=[send["recipient"]],
+                        html=send["html"],
+                        from_email=send["from_email"],
+                        subject=send["subject"],
+                    )
+                    outcome["status"] = 200
+
+                except SparkPostAPIException as e:
+                    outcome["status"] = e.status
+                    raise
+
+        # Anything may go wrong with one email; it mustn't stop the rest of the batch (or undo marking the sent ones).
+        except Exception as e:
+            app.logger.warn(f"Unable to send email {send['id']} (attempt {send['attempts'] + 1}): {e}")
+            changes = {
+                "attempts": send["attempts"] + 1,
+                "last_error": str(e) or e.__class__.__name__,
+                "send_after": _retry_at(now, send["attempts"] + 1, app.config["EMAIL_OUTBOX_RETRY_BACKOFF"]),
+            }
+            failed_count += 1
+
+        else:
+            changes = {"sent_at": datetime.utcnow()}
+            sent_count += 1
+
+        OutboundEmail.query.filter(OutboundEmail.id == send["id"]).update(changes, synchronize_session=False)
+        db.session.commit()
+
+    return sent_count, failed_count
+
+
+def get_email_outbox_metrics():
+    """Queue depth for the email outbox: emails awaiting delivery, emails given up on, and the age of the oldest."""
+    return _outbox_metrics(OutboundEmail, current_app.config["EMAIL_OUTBOX_MAX_ATTEMPTS"], OutboundEmail.created_at)
+
+
+def enqueue_commit_status(repo_id, sha, statuses_url, context, state, description, target_url=""):
+    """
+    Records the latest status for a commit, to be posted once the caller commits.
+
+    Replaces any earlier status for the same (repo, sha, context) that hasn't been sent yet. Writing the status that
+    was last sent again is a no-op, so repeated syncs of an unchanged pull request don't cost a GitHub call.
+    """
+    now = datetime.utcnow()
+    table = OutboundCommitStatus.__table__
+    triggered_by, triggered_at = current_trigger()
+    latest = dict(
+        statuses_url=statuses_url,
+        state=state,
+        description=description,
+        target_url=target_url,
+        updated_at=now,
+        send_after=now,
+        attempts=0,
+        last_error=None,
+        sent_at=None,
+        triggered_by=triggered_by,
+        triggered_at=triggered_at,
+    )
+
+    statement = insert(table).values(repo_id=repo_id, sha=sha, context=context, version=1, **latest)
+    statement = statement.on_conflict_do_update(
+        constraint="uix_outbound_commit_status_repo_id_sha_context",
+        set_={**latest, "version": table.c.version + 1},
+        where=(
+            (table.c.sent_at == None)  # noqa
+            | (table.c.state != statement.excluded.state)
+            | (table.c.description != statement.excluded.description)
+            | (table.c.target_url != statement.excluded.target_url)
+        ),
+    )
+    db.session.execute(statement)
+
+
+def _release_commit_status(commit_status_id):
+    """Ends the lease on a status superseded while it was posted, so its newer version can go out."""
+    OutboundCommitStatus.query.filter(OutboundCommitStatus.id == commit_status_id).update(
+        {"leased_until": None}, synchronize_session=False
+    )
+
+
+@event_context("dispatch_commit_statuses")
+@traced("dispatch_commit_statuses")
+def dispatch_commit_statuses(app):
+    """
+    Posts one batch of due commit statuses to GitHub, returning `(sent_count, failed_count)`.
+
+    Due rows are leased (with `leased_until`) and committed before any upstream call, so no locks are held while
+    waiting on GitHub. Statuses are batched per repository owner so each batch goes out over one token, with owners
+    handled concurrently. A status superseded while in flight is left for the next batch rather than marked sent; the
+    lease outlives the superseding write, so even with several dispatchers running the newer version is only posted
+    once the older post has returned, and lands on GitHub after it.
+    """
+    now = datetime.utcnow()
+    commit_statuses = (
+        _unsent(OutboundCommitStatus, app.config["COMMIT_STATUS_OUTBOX_MAX_ATTEMPTS"])
+        .filter(OutboundCommitStatus.send_after <= now)
+        .filter(or_(OutboundCommitStatus.leased_until == None, OutboundCommitStatus.leased_until <= now))  # noqa
+        .order_by(OutboundCommitStatus.updated_at)
+        .limit(app.config["COMMIT_STATUS_OUTBOX_BATCH_SIZE"])
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not commit_statuses:
+        db.session.commit()
+        return 0, 0
+
+    owner_ids = dict(
+        db.session.query(GithubRepo.id, GithubRepo.integration_id)
+        .filter(GithubRepo.id.in_({commit_status.repo_id for commit_status in commit_statuses}))
+        .all()
+    )
+
+    writes_by_owner = defaultdict(list)
+    for commit_status in commit_statuses:
+        commit_status.leased_until = now + timedelta(seconds=app.config["COMMIT_STATUS_OUTBOX_LEASE"])
+        writes_by_owner[owner_ids[commit_status.repo_id]].append(
+            dict(
+                id=commit_status.id,
+                version=commit_status.version,
+                attempts=commit_status.attempts,
+                statuses_url=commit_status.statuses_url,
+                status=commit_status.state,
+                description=commit_status.description,
+                context=commit_status.context,
+                target_url=commit_status.target_url,
+                triggered_by=commit_status.triggered_by,
+                triggered_at=commit_status.triggered_at,
+                queued_at=commit_status.updated_at,
+            )
+        )
+
+    github_clients = {}
+    for user in User.query.filter(User.id.in_(writes_by_owner.keys())).all():
+        try:
+            github_clients[user.id] = get_github_client(app, user)
+
+        except GithubUnauthorized:
+            pass
+
+    db.session.commit()
+
+    def _post_statuses(owner_id):
+        results = []
+        for write in writes_by_owner[owner_id]:
+            try:
+                if owner_id not in github_clients:
+                    raise GithubUnauthorized("Repository owner has no GitHub token")
+
+                post_started_at = datetime.utcnow()
+                response = github_clients[owner_id].set_pull_request_status(
+                    statuses_url=write["statuses_url"],
+                    status=write["status"],
+                    description=write["description"],
+                    context=write["context"],
+                    target_url=write["target_url"],
+                )
+                posted_at = datetime.utcnow()
+                error = None if response.status_code == 201 else f"{response.status_code}: {response.text}"
+
+            except (GithubUnauthorized, GithubRateLimited, requests.exceptions.RequestException) as e:
+                post_started_at = posted_at = None
+                error = str(e) or e.__class__.__name__
+
+            results.append((write, error, post_started_at, posted_at))
+
+        return results
+
+    sent_count, failed_count = 0, 0
+    for owner_id, results, error in map_concurrently(
+        app, _post_statuses, writes_by_owner.keys(), app.config["UPSTREAM_REQUEST_CONCURRENCY"]
+    ):
+        if error:
+            results = [(write, str(error), None, None) for write in writes_by_owner[owner_id]]
+
+        for write, write_error, post_started_at, posted_at in results:
+            current_write = OutboundCommitStatus.query.filter(
+                OutboundCommitStatus.id == write["id"], OutboundCommitStatus.version == write["version"]
+            )
+
+            if write_error is None:
+                # A status superseded in flight is posted again with its new version. This post's latency is recorded
+                # apart from the current versions', rather than dropped, which would hide the latency under churn.
+                marked_sent = current_write.update(
+                    {"sent_at": datetime.utcnow(), "leased_until": None}, synchronize_session=False
+                )
+                if not marked_sent:
+                    _release_commit_status(write["id"])
+                if write["triggered_at"]:
+                    record_webhook_to_status(
+                        write["triggered_by"],
+                        write["triggered_at"],
+                        write["queued_at"],
+                        post_started_at,
+                        posted_at,
+                        superseded=not marked_sent,
+                    )
+                sent_count += 1
+
+            else:
+                app.logger.error(f"Unable to post status to {write['statuses_url']}: {write_error}")
+                marked_failed = current_write.update(
+                    {
+                        "attempts": write["attempts"] + 1,
+                        "last_error": write_error,
+                        "send_after": _retry_at(
+                            now, write["attempts"] + 1, app.config["COMMIT_STATUS_OUTBOX_RETRY_BACKOFF"]
+                        ),
+                        "leased_until": None,
+                    },
+                    synchronize_session=False,
+                )
+                if not marked_failed:
+                    _release_commit_status(write["id"])
+                failed_count += 1
+
+    db.session.commit()
+
+    return sent_count, failed_count
+
+
+def get_commit_status_outbox_metrics():
+    """Queue depth for the commit status outbox, in the same shape as `get_email_outbox_metrics`."""
+    return _outbox_metrics(
+        OutboundCommitStatus, current_app.config["COMMIT_STATUS_OUTBOX_MAX_ATTEMPTS"], OutboundCommitStatus.updated_at
+    )
@@ -0,0 +1,81 @@
+"""
+A bounded, per-worker ring buffer of sampled upstream payloads, for debugging without logging every response.
+
+Sampling is off unless `PAYLOAD_SAMPLE_RATE` is set. Only a fraction of calls are kept, optionally restricted to some
+endpoint templates (see `app.metrics.endpoint_template`) or users. Bodies are truncated and the buffer holds at most
+`PAYLOAD_SAMPLE_BUFFER_SIZE` samples, so memory stays bounded. Fetch them from `/admin/payload-samples`.
+"""
+from collections import deque
+from datetime import datetime
+import random
+import threading
+
+from app.logs import REDACTED
+from app.metrics import current_event
+
+
+def init_payload_samples(app):
+    app.extensions["payload_samples"] = deque(maxlen=app.config["PAYLOAD_SAMPLE_BUFFER_SIZE"])
+    app.extensions["payload_samples_lock"] = threading.Lock()
+
+
+def _should_sample(app, endpoint, user_id):
+    rate = app.config["PAYLOAD_SAMPLE_RATE"]
+    if not rate:
+        return False
+
+    endpoints = app.config["PAYLOAD_SAMPLE_ENDPOINTS"]
+    if endpoints and not any(endpoint.startswith(prefix) for prefix in endpoints):
+        return False
+
+    user_ids = app.config["PAYLOAD_SAMPLE_USER_IDS"]
+    if user_ids and user_id not in user_ids:
+        return False
+
+    return random.random() < rate
+
+
+def sample_payload(app, upstream, direction, endpoint, load_body, status=None, user_id=None, secrets=()):
+    """
+    Maybe keeps a payload in the buffer. `load_body` is only called if this one is sampled, so an unsampled call
+    doesn't pay for decoding the body. `secrets` are redacted from the stored body.
+    """
+    if not _should_sample(app, endpoint, user_id):
+        return
+
+    body = load_body()
+    if isinstance(body, bytes):
+        body = body.decode("utf8", errors="replace")
+
+    for secret in secrets:
+        if secret:
+            body = body.replace(secret, REDACTED)
+
+    max_length = app.config["PAYLOAD_SAMPLE_MAX_LENGTH"]
+    sample = dict(
+        sampled_at=datetime.utcnow().isoformat() + "Z",
+        upstream=upstream,
+        direction=direction,
+        endpoint=endpoint,
+        status=status,
+        user_id=user_id,
+        event=current_event(),
+        truncated=len(body) > max_length,
+        body=body[:max_length],
+    )
+    with app.extensions["payload_samples_lock"]:
+        app.extensions["payload_samples"].append(sample)
+
+
+def get_payload_samples(app, upstream=None, endpoint=None, user_id=None):
+    """This worker's samples, newest first, optionally filtered by upstream, endpoint prefix and user."""
+    with app.extensions["payload_samples_lock"]:
+        samples = list(app.extensions["payload_samples"])
+
+    return [
+        sample
+        for sample in reversed(samples)
+        if (upstream is None or sample["upstream"] == upstream)
+        and (endpoint is None or sample["endpoint"].startswith(endpoint))
+        and (user_id is None or sample["user_id"] == user_id)
+    ]
@@ -0,0 +1,247 @@
+"""
+On-demand profiling of single requests, for chasing a slow endpoint in production without a redeploy.
+
+A request is profiled when it carries a valid profile token in the `X-Profile` header or `_profile` query parameter.
+Tokens are signed with `ADMIN_TOKEN` and expire (mint one with `flask profile-token`); without `ADMIN_TOKEN` nothing is
+ever profiled. `X-Profile-Mode` (or `_profile_mode`) picks the profiler:
+* "sampling" (the default): samples every thread's stack each `PROFILE_SAMPLE_INTERVAL_MS`, including
+  `map_concurrently` threads, saved as folded stacks for flame graph tools (flamegraph.pl, speedscope).
+* "deterministic": cProfile of the request's own thread, saved as a pstats file (e.g. for snakeviz).
+Either way tracemalloc records the request's peak memory and the lines whose allocations grew the most.
+
+Results are kept in `PROFILE_DIR` (the newest `PROFILE_RETAIN` of them) and the response's `X-Profile-Id` header says
+which one to fetch from `/admin/profiles/<id>`. A worker profiles one request at a time; others run as normal meanwhile.
+"""
+from collections import Counter
+import cProfile
+from datetime import datetime
+import glob
+import hashlib
+import hmac
+import json
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from flask import current_app, g, request
+
+from app.logs import get_logger
+
+
+PROFILE_MODES = {"sampling": "folded", "deterministic": "prof"}
+TOP_ALLOCATIONS = 25
+
+_profile_lock = threading.Lock()
+
+
+def _signature(app, expires_at):
+    return hmac.new(
+        app.config["ADMIN_TOKEN"].encode("utf8"), f"profile:{expires_at}".encode("utf8"), hashlib.sha256
+    ).hexdigest()
+
+
+def make_profile_token(app, ttl_seconds):
+    expires_at = int(time.time()) + ttl_seconds
+    return f"{expires_at}.{_signature(app, expires_at)}"
+
+
+def _is_valid_token(app, token):
+    if not app.config["ADMIN_TOKEN"]:
+        return False
+
+    expires_at, _, signature = token.partition(".")
+    if not expires_at.isdigit() or int(expires_at) < time.time():
+        return False
+
+    return hmac.compare_digest(signature, _signature(app, int(expires_at)))
+
+
+class _SamplingProfiler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+
+                self.stacks[";".join([thread_names.get(thread_id, str(thread_id))] + stack[::-1])] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class _Profile:
+    def __init__(self, mode, sample_interval):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.started_at = datetime.utcnow()
+        self._started = time.monotonic()
+
+        # Leave tracemalloc alone if something else is already using it.
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        self._memory_before = tracemalloc.take_snapshot()
+
+        if mode == "deterministic":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        else:
+            self._profiler = _SamplingProfiler(sample_interval)
+            self._profiler.start()
+
+    def finish(self):
+        """Stops profiling, returning `(summary, data)`."""
+        if self.mode == "deterministic":
+            self._profiler.disable()
+            self._profiler.create_stats()
+            data = marshal.dumps(self._profiler.stats)
+
+        else:
+            self._profiler.stop()
+            data = self._profiler.folded().encode("utf8")
+
+        duration = time.monotonic() - self._started
+        memory_after = tracemalloc.take_snapshot()
+        peak_memory = tracemalloc.get_traced_memory()[1] if self._owns_tracemalloc else None
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+        summary = dict(
+            id=self.id,
+            mode=self.mode,
+            started_at=self.started_at.isoformat() + "Z",
+            duration_ms=round(duration * 1000, 1),
+            peak_memory_bytes=peak_memory,
+            top_allocations=[
+                dict(line=str(stat.traceback[0]), size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+                for stat in memory_after.compare_to(self._memory_before, "lineno")[:TOP_ALLOCATIONS]
+            ],
+        )
+
+        return summary, data
+
+
+def _start_profile():
+    token = request.headers.get("X-Profile") or request.args.get("_profile")
+    if not token:
+        return
+
+    logger = get_logger(current_app, path=request.path)
+    mode = request.headers.get("X-Profile-Mode") or request.args.get("_profile_mode") or "sampling"
+    if not _is_valid_token(current_app, token) or mode not in PROFILE_MODES:
+        logger.warning("Ignoring invalid profile request", mode=mode)
+        return
+
+    if not _profile_lock.acquire(blocking=False):
+        logger.info("Already profiling a request, so not this one")
+        return
+
+    g.profile = _Profile(mode, current_app.config["PROFILE_SAMPLE_INTERVAL_MS"] / 1000)
+    logger.info("Profiling request", profile_id=g.profile.id, mode=mode)
+
+
+def _finish_profile(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+
+    try:
+        summary, data = profile.finish()
+
+    finally:
+        _profile_lock.release()
+
+    summary.update(method=request.method, path=request.path, endpoint=request.endpoint, status=response.status_code)
+    _save_profile(current_app, summary, data)
+    response.headers["X-Profile-Id"] = profile.id
+
+    return response
+
+
+def _abandon_profile(error):
+    """Makes sure the profilers stop (and the worker can profile again) if a request fails before `_finish_profile`."""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        try:
+            profile.finish()
+
+        finally:
+            _profile_lock.release()
+
+
+def _save_profile(app, summary, data):
+    directory = app.config["PROFILE_DIR"]
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{summary['id']}.{PROFILE_MODES[summary['mode']]}"), "wb") as data_file:
+            data_file.write(data)
+        with open(os.path.join(directory, f"{summary['id']}.json"), "w") as summary_file:
+            json.dump(summary, summary_file)
+
+        for summary_path in _summary_paths(app)[app.config["PROFILE_RETAIN"] :]:
+            for path in glob.glob(summary_path[: -len(".json")] + ".*"):
+                os.remove(path)
+
+    except OSError as e:
+        get_logger(app).warning("Unable to save profile", directory=directory, error=e)
+
+
+def _summary_paths(app):
+    """Saved profiles' summary files, newest first."""
+    return sorted(glob.glob(os.path.join(app.config["PROFILE_DIR"], "*.json")), key=os.path.getmtime, reverse=True)
+
+
+def get_profiles(app):
+    """Summaries of the profiles saved on this machine, newest first."""
+    profiles = []
+    for summary_path in _summary_paths(app):
+        try:
+            with open(summary_path) as summary_file:
+                profiles.append(json.load(summary_file))
+
+        except (OSError, ValueError):
+            continue  # Pruned, or still being written, by another worker.
+
+    return profiles
+
+
+def get_profile_path(app, profile_id):
+    """The profiler output file for `profile_id`, or None if there isn't one."""
+    if not re.fullmatch(r"[0-9a-f]{32}", profile_id):
+        return None
+
+    for extension in PROFILE_MODES.values():
+        path = os.path.join(app.config["PROFILE_DIR"], f"{profile_id}.{extension}")
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+def init_profiling(app):
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_abandon_profile)
@@ -0,0 +1,284 @@
+"""
+Lightweight trace spans for webhook deliveries and background work.
+
+A trace is started with `trace` (a webhook, a background job, an outbox batch); inside it `span` records nested stages,
+upstream calls (via `app.metrics.upstream_request`) and DB flushes. Spans are only kept in memory while the trace runs.
+When it finishes, the trace is exported if it took longer than `TRACE_SLOW_THRESHOLD_MS`, or with probability
+`TRACE_SAMPLE_RATE` otherwise. With no `TRACE_EXPORTER` configured, `trace` and `span` do nothing.
+
+Exporters:
+* "file": appends one JSON object per trace to `TRACE_FILE_PATH`.
+* "otlp": POSTs OTLP/HTTP JSON to `TRACE_OTLP_ENDPOINT` (e.g. a local OpenTelemetry collector) from a daemon thread.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import requests
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.logs import get_logger
+
+
+_local = threading.local()
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None, start_ns=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start_ns = start_ns or _now_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, end_ns=None):
+        self.end_ns = end_ns or _now_ns()
+        self.trace.spans.append(self)
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_json(self):
+        return dict(
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            start_ns=self.start_ns,
+            duration_ms=round(self.duration_ms, 3),
+            attributes=self.attributes,
+            error=self.error,
+        )
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _now_ns():
+    return int(time.time() * 1e9)
+
+
+def _trace_id(delivery_id):
+    """A 32-hex-digit trace ID: a webhook's delivery UUID as-is, a hash of any other delivery ID, else random."""
+    if not delivery_id:
+        return uuid.uuid4().hex
+
+    try:
+        return uuid.UUID(delivery_id).hex
+
+    except ValueError:
+        return hashlib.md5(delivery_id.encode("utf8")).hexdigest()
+
+
+def current_span():
+    return getattr(_local, "span", None)
+
+
+@contextmanager
+def _activate(span):
+    previous, _local.span = current_span(), span
+    try:
+        yield span
+
+    except Exception as e:
+        span.error = repr(e)
+        raise
+
+    finally:
+        span.end()
+        _local.span = previous
+
+
+@contextmanager
+def span(name, **attributes):
+    """Records the block as a child of the current span. Does nothing outside a trace."""
+    parent = current_span()
+    if parent is None:
+        yield _NOOP_SPAN
+        return
+
+    with _activate(Span(parent.trace, name, parent_id=parent.span_id, attributes=attributes)) as child:
+        yield child
+
+
+@contextmanager
+def continue_trace(parent):
+    """Makes `parent` (from `current_span` on another thread) the current span, so work done here joins its trace."""
+    previous, _local.span = current_span(), parent
+    try:
+        yield
+
+    finally:
+        _local.span = previous
+
+
+@contextmanager
+def trace(app, name, delivery_id=None, **attributes):
+    """
+    Starts a trace for the block, with its ID taken from `delivery_id` (e.g. `X-GitHub-Delivery`) when there is one.
+    Inside an existing trace this is just a span.
+    """
+    if current_span() is not None:
+        with span(name, **attributes) as child:
+            yield child
+        return
+
+    if not app.config["TRACE_EXPORTER"]:
+        yield _NOOP_SPAN
+        return
+
+    if delivery_id:
+        attributes["delivery_id"] = delivery_id
+
+    root = Span(_Trace(_trace_id(delivery_id)), name, attributes=attributes)
+    try:
+        with _activate(root):
+            yield root
+
+    finally:
+        _export(app, root)
+
+
+def traced(name):
+    """Decorates `func(app, ...)` so each call runs in its own trace."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(app, *args, **kwargs):
+            with trace(app, name):
+                return func(app, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _export(app, root):
+    if root.duration_ms < app.config["TRACE_SLOW_THRESHOLD_MS"] and random.random() >= app.config["TRACE_SAMPLE_RATE"]:
+        return
+
+    exporter = app.config["TRACE_EXPORTER"]
+    if exporter == "file":
+        record = dict(
+            trace_id=root.trace.trace_id,
+            name=root.name,
+            duration_ms=round(root.duration_ms, 3),
+            spans=[recorded.to_json() for recorded in root.trace.spans],
+        )
+        try:
+            with _file_lock, open(app.config["TRACE_FILE_PATH"], "a") as trace_file:
+                trace_file.write(json.dumps(record, default=str) + "\n")
+
+        except OSError as e:
+            get_logger(app).warning("Unable to export trace", path=app.config["TRACE_FILE_PATH"], error=e)
+
+    elif exporter == "otlp":
+        threading.Thread(
+            target=_post_otlp,
+            args=(get_logger(app), app.config["TRACE_OTLP_ENDPOINT"], _to_otlp(root.trace)),
+            name="trace-export",
+            daemon=True,
+        ).start()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+
+    if isinstance(value, float):
+        return {"doubleValue": value}
+
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(finished_trace):
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "github-signoff"}}]},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "app.tracing"},
+                        "spans": [
+                            {
+                                "traceId": finished_trace.trace_id,
+                                "spanId": recorded.span_id,
+                                "parentSpanId": recorded.parent_id or "",
+                                "name": recorded.name,
+                                "kind": 1,
+                                "startTimeUnixNano": str(recorded.start_ns),
+                                "endTimeUnixNano": str(recorded.end_ns),
+                                "attributes": [
+                                    {"key": key, "value": _otlp_value(value)}
+                                    for key, value in recorded.attributes.items()
+                                ],
+                                "status": {"code": 2, "message": recorded.error} if recorded.error else {"code": 1},
+                            }
+                            for recorded in finished_trace.spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _post_otlp(logger, endpoint, payload):
+    try:
+        requests.post(endpoint, json=payload, timeout=5).raise_for_status()
+
+    except requests.exceptions.RequestException as e:
+        logger.warning("Unable to export trace", endpoint=endpoint, error=e)
+
+
+@event.listens_for(Session, "before_flush")
+def _start_flush_span(session, flush_context, instances):
+    if current_span() is not None:
+        session.info["flush_started_ns"] = _now_ns()
+        session.info["flush_objects"] = len(session.new) + len(session.dirty) + len(session.deleted)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _end_flush_span(session, flush_context):
+    parent, started_ns = current_span(), session.info.pop("flush_started_ns", None)
+    if parent is not None and started_ns is not None:
+        flush_span = Span(
+            parent.trace,
+            "db.flush",
+            parent_id=parent.span_id,
+            attributes=dict(objects=session.info.pop("flush_objects", 0)),
+            start_ns=started_ns,
+        )
+        flush_span.end()
@@ -0,0 +1,150 @@
+"""
+How the GitHub and Trello clients send their requests: straight to the API, or through a cassette.
+
+With `UPSTREAM_CASSETTE_MODE=record`, requests go out as normal and each request/response pair is appended to
+`UPSTREAM_CASSETTE_PATH`: one JSON object per line, gzipped if the path ends in `.gz`, with `{pid}` replaced by the
+process ID so gunicorn workers don't interleave. Tokens, keys and secrets (including sensitive fields in request
+bodies) are scrubbed before anything is written.
+
+With `UPSTREAM_CASSETTE_MODE=replay` (or `replay-timed`, which also waits as long as each original response took), the
+network is never used. Every cassette matching `UPSTREAM_CASSETTE_PATH` is loaded (it's a glob, with `{pid}` matching
+any process), and each request gets the responses recorded for the same method, path, query and body, in recorded
+order, starting over once they run out. A request with nothing recorded fails as a connection error would.
+"""
+from collections import Counter, defaultdict
+import glob
+import gzip
+from http.client import responses as HTTP_REASONS
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from app.logs import REDACTED, SENSITIVE_KEYS, redact
+
+
+# Response headers the clients read, so worth keeping in a cassette.
+RECORDED_HEADERS = {"content-type", "link", "x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset"}
+
+
+def _scrub(text, secrets):
+    for secret in secrets:
+        if secret:
+            text = text.replace(secret, REDACTED)
+
+    return text
+
+
+def _open(path, mode):
+    return gzip.open(path, mode, encoding="utf8") if path.endswith(".gz") else open(path, mode, encoding="utf8")
+
+
+def _request_key(method, url, params, json_body, secrets):
+    """`(method, path, query, body)` identifying a request, scrubbed so it's the same for any user's credentials."""
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query) + [(key, str(value)) for key, value in (params or {}).items()]
+    query = sorted((key, _scrub(value, secrets)) for key, value in query if key.lower() not in SENSITIVE_KEYS)
+    # Sensitive fields (e.g. a webhook's `config.secret`) are redacted by name, as they aren't among `secrets`.
+    body = _scrub(json.dumps(redact(json_body), sort_keys=True), secrets) if json_body is not None else None
+
+    return method.upper(), _scrub(parsed.path, secrets), urlencode(query), body
+
+
+class HttpTransport:
+    """
+    Sends requests straight to the API. `secrets` are the credentials in the request, for transports that store it.
+    """
+
+    def request(self, method, url, secrets=(), **kwargs):
+        return requests.request(method=method, url=url, **kwargs)
+
+
+class RecordingTransport(HttpTransport):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def request(self, method, url, secrets=(), **kwargs):
+        started_at = time.monotonic()
+        response = super().request(method, url, secrets=secrets, **kwargs)
+        elapsed = time.monotonic() - started_at
+
+        method, path, query, body = _request_key(method, url, kwargs.get("params"), kwargs.get("json"), secrets)
+        interaction = dict(
+            method=method,
+            path=path,
+            query=query,
+            body=body,
+            status=response.status_code,
+            headers={
+                name: _scrub(value, secrets)
+                for name, value in response.headers.items()
+                if name.lower() in RECORDED_HEADERS
+            },
+            response=_scrub(response.text, secrets),
+            elapsed_ms=round(elapsed * 1000, 1),
+        )
+        line = json.dumps(interaction, separators=(",", ":")) + "\n"
+        with self._lock, _open(self.path.format(pid=os.getpid()), "at") as cassette:
+            cassette.write(line)
+
+        return response
+
+
+class ReplayingTransport:
+    def __init__(self, path, replay_timing=False):
+        self.replay_timing = replay_timing
+        self._interactions = defaultdict(list)
+        self._replayed = Counter()
+        self._lock = threading.Lock()
+
+        for cassette_path in sorted(glob.glob(path.replace("{pid}", "*"))):
+            with _open(cassette_path, "rt") as cassette:
+                for line in cassette:
+                    interaction = json.loads(line)
+                    key = (interaction["method"], interaction["path"], interaction["query"], interaction["body"])
+                    self._interactions[key].append(interaction)
+
+    def request(self, method, url, secrets=(), **kwargs):
+        key = _request_key(method, url, kwargs.get("params"), kwargs.get("json"), secrets)
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key[0]} {key[1]}?{key[2]}")
+
+            interaction = recorded[self._replayed[key] % len(recorded)]
+            self._replayed[key] += 1
+
+        if self.replay_timing:
+            time.sleep(interaction["elapsed_ms"] / 1000)
+
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = HTTP_REASONS.get(interaction["status"], "")
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response.encoding = "utf8"
+        response.url = url
+        response._content = interaction["response"].encode("utf8")
+
+        return response
+
+
+def init_upstream_transport(app):
+    mode, path = app.config["UPSTREAM_CASSETTE_MODE"], app.config["UPSTREAM_CASSETTE_PATH"]
+    if mode == "record":
+        transport = RecordingTransport(path)
+
+    elif mode in ("replay", "replay-timed"):
+        transport = ReplayingTransport(path, replay_timing=mode == "replay-timed")
+
+    elif not mode:
+        transport = HttpTransport()
+
+    else:
+        raise ValueError("UPSTREAM_CASSETTE_MODE must be record, replay or replay-timed")
+
+    app.extensions["upstream_transport"] = transport
@@ -2,7 +2,12 @@ import requests
 
 from flask import current_app
 
-from app.models import TrelloBoard, TrelloList, TrelloCard, TrelloChecklist, TrelloCheckitem
+from app.dtos import TrelloBoardData, TrelloListData
+from app.logs import get_logger
+from app.metrics import upstream_request
+from app.payload_samples import sample_payload
+from app.models import TrelloCard, TrelloChecklist, TrelloCheckitem
+from app.transport import HttpTransport
 from app.errors import TrelloUnauthorized, HookAlreadyExists, TrelloInvalidRequest, TrelloResourceMissing
 
 
@@ -14,12 +19,16 @@ CARD_FIELD_PARAMS = {"card": "true", "card_fields": "shortLink,name"}
 class TrelloClient:
     TRELLO_API_ROOT = "https://api.trello.com/1"
 
-    def __init__(self, key, user):
+    def __init__(self, key, user, api_root=TRELLO_API_ROOT, transport=None):
         if user.trello_integration is None or user.trello_integration.oauth_token is None:
             raise TrelloUnauthorized("User has not completed OAuth process")
 
+        self.api_root = api_root
+        self.transport = transport or HttpTransport()
         self.key = key
         self.user = user
+        # Kept apart from `user`, which may be the `current_user` proxy, so calls on other threads can still label it.
+        self._user_id = user.id
         self._token = self.user.trello_integration.oauth_token
 
     def _default_params(self):
@@ -31,12 +40,25 @@ class TrelloClient:
 
         all_params = {**self._default_params(), **params}
 
-        current_app.logger.debug(
-            f"Request settings: {method}, {path}, {params}".replace(self._token, "<TOKEN REDACTED>")
+        logger = get_logger(current_app, secrets=[self._token, self.key])
+        logger.debug("Trello request", method=method, path=path, params=params)
+        url = f"{self.api_root}{path}"
+        with upstream_request("trello", method, url) as outcome:
+            response = self.transport.request(
+                method=method, url=url, secrets=[self._token, self.key], params=all_params
+            )
+            outcome["status"] = response.status_code
+
+        sample_payload(
+            current_app,
+            "trello",
+            "response",
+            outcome["endpoint"],
+            lambda: response.text,
+            status=response.status_code,
+            user_id=self._user_id,
+            secrets=[self._token, self.key],
         )
-        response = requests.request(method=method, url=f"{TrelloClient.TRELLO_API_ROOT}{path}", params=all_params)
-        if current_app.config["DEBUG_PAYLOADS"]:
-            current_app.logger.debug(f"Response: {response.status_code}, {response.text}")
 
         if response.status_code == 401:
             raise TrelloUnauthorized(response.text)
@@ -47,7 +69,9 @@ class TrelloClient:
                 response.raise_for_status()
 
             except requests.exceptions.HTTPError as e:
-                current_app.logger.error(f"{method}, {path}, {params}")
+                logger.error(
+                    "Trello rejected request", method=method, path=path, params=params, status=response.status_code
+                )
                 raise TrelloInvalidRequest(source=e)
 
         return response
@@ -73,7 +97,7 @@ class TrelloClient:
         if as_json:
             return data
 
-        return TrelloBoard.from_json(data)
+        return TrelloBoardData.from_json(data)
 
     def get_boards(self, with_lists=False, as_json=False):
         params = {"lists": "all"} if with_lists else {}
@@ -82,7 +106,7 @@ class TrelloClient:
         if as_json:
             return boards
 
-        return [TrelloBoard.from_json(board_data) for board_data in boards]
+        return [TrelloBoardData.from_json(board_data) for board_data in boards]
 
     def get_list(self, list_id, as_json=False):
         data = self._get(f"/lists/{list_id}").json()
@@ -90,7 +114,7 @@ class TrelloClient:
         if as_json:
             return data
 
-        return TrelloList.from_json(data)
+        return TrelloListData.from_json(data)
 
     def get_card(self, card_id, as_json=False):
         data = self._get(
@@ -104,7 +128,7 @@ class TrelloClient:
 
     def get_lists(self, board_id):
         lists = self._get(f"/boards/{board_id}/lists", params={**BOARD_FIELD_PARAMS}).json()
-        return [TrelloList.from_json(data) for data in lists]
+        return [TrelloListData.from_json(data) for data in lists]
 
     def get_webhook(self, object_id):
         webhooks = self._get(f"/tokens/{self._token}/webhooks").json()
@@ -1,10 +1,13 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import time
 import uuid
 from secrets import token_urlsafe
 from typing import Union
 
 from flask import flash, url_for, render_template
 
-from app import db, sparkpost
+from app import db
 from app.constants import (
     AWAITING_PRODUCT_REVIEW,
     TICKET_APPROVED_BY,
@@ -13,17 +16,31 @@ from app.constants import (
     StatusEnum,
 )
 from app.errors import TrelloInvalidRequest, TrelloResourceMissing, GithubResourceMissing, GithubUnauthorized
+from app.logs import get_logger
+from app.metrics import record_unit_of_work, updater_stage
 from app.models import (
     GithubRepo,
     TrelloCard,
-    TrelloList,
     TrelloChecklist,
     TrelloCheckitem,
     PullRequest,
+    PullRequestTrelloCard,
     ProductSignoff,
-    TrelloBoard,
+    upsert_statement,
 )
-from app.utils import get_github_client, get_trello_client, get_trello_cards_from_text
+from app.outbox import enqueue_commit_status, enqueue_email
+from app.tracing import span
+from app.utils import (
+    get_github_client,
+    get_trello_client,
+    get_trello_card_ids_from_text,
+    map_concurrently,
+    time_db_statements,
+)
+
+
+# Re-checks a little before the last run's start time, in case GitHub's clock and ours disagree.
+RECONCILE_CURSOR_OVERLAP = timedelta(minutes=5)
 
 
 class Updater:
@@ -31,13 +48,46 @@ class Updater:
         self.app = app
         self.db = db
         self.user = user
+        self.logger = get_logger(app, user_id=user.id)
         self.github_client = get_github_client(app, user)
         self.trello_client = get_trello_client(app, user)
+        self._trello_card_data = {}
+
+    @contextmanager
+    def _unit_of_work(self, stage, subject):
+        """
+        Runs the DB work for one event as a single transaction, committed at the end of the block or rolled back on
+        error, and logs how much of the event was spent in the database. The DB statement count and time are also
+        recorded in the metrics under `stage`, which (unlike `subject`) must not include IDs.
+        """
+        with updater_stage(stage) as stage_span, time_db_statements() as db_timer:
+            commit_started_at = None
+            try:
+                yield
+                commit_started_at = time.monotonic()
+                with span("db.commit"):
+                    db.session.commit()
+
+            except Exception:
+                db.session.rollback()
+                raise
+
+            finally:
+                commit_seconds = time.monotonic() - commit_started_at if commit_started_at else 0
+                record_unit_of_work(stage, db_timer.statements, db_timer.seconds + commit_seconds)
+                stage_span.set(subject=subject, db_statements=db_timer.statements)
+                self.logger.info(
+                    "Unit of work finished",
+                    stage=stage,
+                    subject=subject,
+                    db_statements=db_timer.statements,
+                    db_ms=round(db_timer.seconds * 1000, 1),
+                    commit_ms=round(commit_seconds * 1000, 1),
+                )
 
-    def _set_pull_request_status(
+    def _describe_pull_request_status(
         self, pull_request: PullRequest, status: StatusEnum, required: Union[bool, int] = False
     ):
-        self.app.logger.debug(f"Updating pull request status: {pull_request}, {status}, {required}")
         if pull_request.trello_cards:
             if required:
                 description = TICKET_APPROVED_BY if status == StatusEnum.SUCCESS else AWAITING_PRODUCT_REVIEW
@@ -55,90 +105,185 @@ class Updater:
         else:
             description = "Unknown status"
 
-        response = self.github_client.set_pull_request_status(
+        return status, description
+
+    def _record_pull_request_status(self, pull_request: PullRequest, status: StatusEnum, description):
+        enqueue_commit_status(
+            repo_id=pull_request.repo_id,
+            sha=pull_request.head_sha,
             statuses_url=pull_request.statuses_url,
-            status=status.value,
-            description=description,
             context=self.app.config["APP_NAME"],
+            state=status.value,
+            description=description,
         )
 
-        if response.status_code != 201:
-            self.app.logger.error(response, response.text)
+    def _set_pull_request_status(
+        self, pull_request: PullRequest, status: StatusEnum, required: Union[bool, int] = False
+    ):
+        self.logger.debug("Updating pull request status", pull_request=pull_request, status=status, required=required)
+        status, description = self._describe_pull_request_status(pull_request, status, required=required)
+        self._record_pull_request_status(pull_request, status, description)
+
+    def _fetch_trello_card_data(self, card_ids, ignore_invalid=False):
+        """
+        Returns `{card_id: data}` for `card_ids`, fetching cards not yet seen by this Updater several at a time so each
+        card costs one API call at most. With `ignore_invalid`, cards Trello won't give us are logged and left out.
+
+        Fetched data is also kept under the card's short link and full ID, as a card can be referred to by either.
+        """
+        for card_id, data, error in map_concurrently(
+            self.app,
+            lambda card_id: self.trello_client.get_card(card_id, as_json=True),
+            {card_id for card_id in card_ids if card_id not in self._trello_card_data},
+            self.app.config["UPSTREAM_REQUEST_CONCURRENCY"],
+        ):
+            if ignore_invalid and isinstance(error, (TrelloInvalidRequest, TrelloResourceMissing)):
+                self.logger.warning("Ignoring invalid card", card_id=card_id, error=error)
+                continue
+
+            elif error:
+                raise error
+
+            for key in (card_id, data["shortLink"], data["id"]):
+                self._trello_card_data[key] = data
+
+        return {card_id: self._trello_card_data[card_id] for card_id in card_ids if card_id in self._trello_card_data}
+
+    def _hydrate_trello_cards(self, trello_cards):
+        """Hydrates `trello_cards` from data already fetched by `_fetch_trello_card_data`, without calling Trello."""
+        for trello_card in trello_cards:
+            trello_card.hydrate(data=self._trello_card_data[trello_card.id])
+
+    def _fetch_pull_request_data(self, pull_requests):
+        """Fetches tracked `pull_requests` from GitHub a few at a time, yielding `(pull_request, data, error)`."""
+        pull_requests_by_id = {pull_request.id: pull_request for pull_request in pull_requests}
+        lookups = {
+            pull_request.id: dict(
+                repo_id=pull_request.repo.id,
+                repo_fullname=pull_request.repo.fullname,
+                pull_request_id=pull_request.number,
+            )
+            for pull_request in pull_requests
+        }
+
+        for pull_request_id, data, error in map_concurrently(
+            self.app,
+            lambda pull_request_id: self.github_client.get_pull_request(as_json=True, **lookups[pull_request_id]),
+            lookups.keys(),
+            self.app.config["UPSTREAM_REQUEST_CONCURRENCY"],
+        ):
+            yield pull_requests_by_id[pull_request_id], data, error
 
     def _update_tracked_trello_cards(self, pull_request, new_trello_cards):
-        self.app.logger.debug(f"Existing cards: {pull_request.trello_cards}")
+        """
+        Upserts `new_trello_cards` and makes them the only cards linked to `pull_request`, dropping our checklist items
+        from any cards it no longer links to.
+
+        Returns how many cards were linked beforehand, and the `(checklist_id, checkitem_id)`s dropped. Those still need
+        deleting from Trello once the transaction has committed.
+        """
+        existing_card_ids = PullRequestTrelloCard.get_card_ids(pull_request.id)
+        self.logger.debug("Existing cards", card_ids=existing_card_ids)
 
         new_trello_card_ids = {card.id for card in new_trello_cards}
+        removed_card_ids = existing_card_ids - new_trello_card_ids
+
+        removed_checkitems = []
+        if removed_card_ids:
+            removed_checkitems = (
+                db.session.query(TrelloCheckitem.checklist_id, TrelloCheckitem.id)
+                .join(TrelloChecklist, TrelloChecklist.id == TrelloCheckitem.checklist_id)
+                .filter(
+                    TrelloChecklist.card_id.in_(removed_card_ids), TrelloCheckitem.pull_request_id == pull_request.id
+                )
+                .all()
+            )
 
-        for trello_card in pull_request.trello_cards:
-            if trello_card.id not in new_trello_card_ids:
-                if trello_card.trello_checklist:
-                    trello_checkitem = TrelloCheckitem.query.filter(
-                        TrelloCheckitem.checklist == trello_card.trello_checklist,
-                        TrelloCheckitem.pull_request == pull_request,
-                    ).one_or_none()
+            if removed_checkitems:
+                db.session.execute(
+                    TrelloCheckitem.__table__.delete().where(
+                        TrelloCheckitem.id.in_([checkitem_id for _, checkitem_id in removed_checkitems])
+                    )
+                )
 
-                    if trello_checkitem:
-                        self.trello_client.delete_checkitem(
-                            checklist_id=trello_card.trello_checklist.id, checkitem_id=trello_checkitem.id
-                        )
+        if new_trello_cards:
+            db.session.execute(upsert_statement(TrelloCard, new_trello_cards, update_columns=["board_id"]))
 
-                db.session.delete(trello_card)
+        PullRequestTrelloCard.replace_links(pull_request.id, new_trello_card_ids)
 
-        pull_request.trello_cards = new_trello_cards
+        # The links were written behind the ORM's back, so make it reload them next time they're needed.
+        db.session.expire(pull_request, ["trello_cards"])
 
-        db.session.add(pull_request)
-        db.session.commit()
+        return len(existing_card_ids), removed_checkitems
+
+    def _delete_trello_checkitems(self, checkitems):
+        for checklist_id, checkitem_id in checkitems:
+            try:
+                self.trello_client.delete_checkitem(checklist_id=checklist_id, checkitem_id=checkitem_id)
+
+            except TrelloResourceMissing:
+                self.logger.debug("Checkitem already deleted from Trello", checkitem_id=checkitem_id)
+
+    def _get_tracked_checklists(self, pull_request, trello_cards):
+        """
+        Returns `{card_id: checklist_id}` and `{checklist_id: checkitem_id}` for the checklist rows we already have.
+        """
+        if not trello_cards:
+            return {}, {}
+
+        checklist_ids = dict(
+            db.session.query(TrelloChecklist.card_id, TrelloChecklist.id)
+            .filter(TrelloChecklist.card_id.in_([trello_card.id for trello_card in trello_cards]))
+            .all()
+        )
+        if not checklist_ids:
+            return {}, {}
+
+        checkitem_ids = dict(
+            db.session.query(TrelloCheckitem.checklist_id, TrelloCheckitem.id)
+            .filter(
+                TrelloCheckitem.checklist_id.in_(checklist_ids.values()),
+                TrelloCheckitem.pull_request_id == pull_request.id,
+            )
+            .all()
+        )
+
+        return checklist_ids, checkitem_ids
 
-    def _update_trello_checklists(self, pull_request):
-        trello_cards = pull_request.trello_cards
-        self.app.logger.debug(f"Updating trello checklists for {pull_request}")
-        self.app.logger.debug(f"These cards involvd: {trello_cards}")
+    def _update_trello_checklists(self, pull_request, trello_cards, checklist_ids, checkitem_ids):
+        """
+        Makes sure each card has our checklist, with an item for `pull_request` in the right state.
 
-        for i, trello_card in enumerate(trello_cards):
-            self.app.logger.debug(f"trello card #{i}: {trello_card}")
-            trello_card.hydrate(trello_client=self.trello_client)
+        Takes the rows we already have from `_get_tracked_checklists`, so no transaction is held open while Trello is
+        called, then writes back any new IDs in a short transaction of its own.
+        """
+        self.logger.debug("Updating Trello checklists", pull_request=pull_request, trello_cards=trello_cards)
+        if not trello_cards:
+            return
 
-            trello_checklist = trello_card.trello_checklist
-            if trello_checklist:
+        trello_checklists, trello_checkitems = [], []
+        missing_checklist_ids, missing_checkitem_ids = set(), set()
+        for trello_card in trello_cards:
+            trello_checklist = None
+            if trello_card.id in checklist_ids:
                 try:
-                    trello_checklist.hydrate(trello_client=self.trello_client)
+                    trello_checklist = self.trello_client.get_checklist(checklist_ids[trello_card.id])
 
                 except TrelloResourceMissing:
-                    print("resource is missing, yep checklist")
-                    if trello_checklist:
-                        db.session.delete(trello_checklist)
-                        db.session.flush()
-                        trello_checklist = None
+                    self.logger.debug("Checklist has been deleted from Trello", trello_card=trello_card)
+                    missing_checklist_ids.add(checklist_ids[trello_card.id])
 
             if not trello_checklist:
                 trello_checklist = self.trello_client.create_checklist(
                     real_card_id=trello_card.real_id, checklist_name=self.app.config["FEATURE_CHECKLIST_NAME"]
                 )
 
-            found_trello_checkitem = None
-            for trello_checkitem in trello_checklist.trello_checkitems:
-                if (
-                    trello_checkitem.checklist_id == trello_checklist.id
-                    and trello_checkitem.pull_request_id == pull_request.id
-                ):
-                    found_trello_checkitem = trello_checkitem
-                    break
-
-            trello_checkitem = found_trello_checkitem
-            if trello_checkitem:
-                try:
-                    trello_checkitem.hydrate(trello_client=self.trello_client)
-
-                except TrelloResourceMissing:
-                    print("resource is missing, yep checkitem")
-                    if trello_checkitem:
-                        print("deleting")
-                        trello_checklist.trello_checkitems.remove(trello_checkitem)
-                        db.session.add(trello_checklist)
-                        db.session.delete(trello_checkitem)
-                        db.session.flush()
-                        trello_checkitem = None
+            # The checklist comes with its items, so there's no need to fetch ours separately.
+            checkitem_id = checkitem_ids.get(trello_checklist.id)
+            trello_checkitem = next((item for item in trello_checklist.checkitems if item.id == checkitem_id), None)
+            if checkitem_id and not trello_checkitem:
+                self.logger.debug("Checkitem has been deleted from Trello", pull_request=pull_request)
+                missing_checkitem_ids.add(checkitem_id)
 
             if not trello_checkitem:
                 trello_checkitem = self.trello_client.create_checkitem(
@@ -157,111 +302,263 @@ class Updater:
 
             trello_checklist.card_id = trello_card.id
             trello_checkitem.pull_request_id = pull_request.id
-            db.session.add(trello_checklist)
-            db.session.add(trello_checkitem)
+            trello_checklists.append(trello_checklist)
+            trello_checkitems.append(trello_checkitem)
+
+        with self._unit_of_work(
+            "sync_pull_request.save_trello_checklists", f"Trello checklists for pull request {pull_request.id}"
+        ):
+            if missing_checkitem_ids:
+                db.session.execute(
+                    TrelloCheckitem.__table__.delete().where(TrelloCheckitem.id.in_(missing_checkitem_ids))
+                )
 
-        db.session.commit()
+            if missing_checklist_ids:
+                db.session.execute(
+                    TrelloChecklist.__table__.delete().where(TrelloChecklist.id.in_(missing_checklist_ids))
+                )
 
-    def _update_pull_request_status(self, pull_request, before_update_pr_card_count):
-        self.app.logger.debug(f"Updating for {pull_request}")
+            db.session.execute(upsert_statement(TrelloChecklist, trello_checklists))
+            db.session.execute(upsert_statement(TrelloCheckitem, trello_checkitems))
+
+    def _evaluate_pull_request_status(self, pull_request, before_update_pr_card_count):
+        """
+        Works out a pull request's status from its cards. Only the database is used, so the cards' data must already
+        have been fetched (see `_fetch_trello_card_data`) before the caller's transaction started; linked cards Trello
+        wouldn't give us are left out.
+        """
+        self.logger.debug("Evaluating status", pull_request=pull_request)
         if pull_request.trello_cards:
+            trello_cards = [card for card in pull_request.trello_cards if card.id in self._trello_card_data]
+            self._hydrate_trello_cards(trello_cards)
+
+            # Sign-off list for each board that has a sign-off check, looked up for all cards at once.
+            signoff_list_ids = dict(
+                db.session.query(ProductSignoff.trello_board_id, ProductSignoff.trello_list_id)
+                .filter(ProductSignoff.trello_board_id.in_({card.board.id for card in trello_cards}))
+                .all()
+            )
+
             signed_off_count, required_signoffs_count = 0, 0
-            for trello_card in pull_request.trello_cards:
-                # TODO: Fix hydration here - O(n^2) API calls in worst case.
-                trello_card.hydrate(trello_client=self.trello_client)
-                if TrelloBoard.query.get(trello_card.board.id):
+            for trello_card in trello_cards:
+                if trello_card.board.id in signoff_list_ids:
                     required_signoffs_count += 1
 
-                    if TrelloList.query.get(trello_card.list.id):
+                    if trello_card.list.id == signoff_list_ids[trello_card.board.id]:
                         signed_off_count += 1
 
-            self.app.logger.debug(f"Required: {required_signoffs_count}, actual: {signed_off_count}")
+            self.logger.debug("Sign-offs", required=required_signoffs_count, actual=signed_off_count)
             if signed_off_count < required_signoffs_count:
-                self._set_pull_request_status(pull_request, StatusEnum.PENDING, required=required_signoffs_count)
-            else:
-                self._set_pull_request_status(pull_request, StatusEnum.SUCCESS, required=required_signoffs_count)
+                return StatusEnum.PENDING, required_signoffs_count
+
+            return StatusEnum.SUCCESS, required_signoffs_count
 
         elif before_update_pr_card_count > 0:
-            self._set_pull_request_status(pull_request, StatusEnum.SUCCESS)
+            return StatusEnum.SUCCESS, False
 
-        else:
-            self._set_pull_request_status(pull_request, StatusEnum.UNNECESSARY)
+        return StatusEnum.UNNECESSARY, False
+
+    def _update_pull_request_status(self, pull_request, before_update_pr_card_count):
+        status, required = self._evaluate_pull_request_status(pull_request, before_update_pr_card_count)
+        self._set_pull_request_status(pull_request, status, required=required)
 
     def sync_pull_request(self, data):
-        self.app.logger.debug(f"Incoming pull request: {data}")
+        """
+        Brings a pull request's cards and status up to date, as one transaction.
+
+        Cards are fetched before the transaction starts. Trello writes happen only after it has committed, so they never
+        reflect links that were rolled back; the commit status goes via the outbox in the same transaction.
+        """
+        # Not attached to the session, so still usable once the transaction has committed.
         pull_request = PullRequest.from_json(data=data)
-        self.app.logger.debug(f"Pull request: {pull_request}")
-        trello_cards = get_trello_cards_from_text(trello_client=self.trello_client, text=pull_request.body)
-        self.app.logger.debug(f"Trello cards: {trello_cards}")
+        self.logger.debug("Incoming pull request", pull_request=pull_request, data=data)
+
+        with span("extract_trello_card_ids"):
+            card_ids = get_trello_card_ids_from_text(pull_request.body)
+
+        with updater_stage("sync_pull_request.fetch_trello_cards"):
+            trello_card_data = self._fetch_trello_card_data(card_ids, ignore_invalid=True)
+        # A card linked by both its short link and its full ID comes back once for each.
+        unique_card_data = {card_data["shortLink"]: card_data for card_data in trello_card_data.values()}
+        trello_cards = [TrelloCard.from_json(card_data) for card_data in unique_card_data.values()]
+        self.logger.debug("Trello cards", trello_cards=trello_cards)
+
+        checklist_feature_enabled = self.user.checklist_feature_enabled
+        with self._unit_of_work("sync_pull_request.transaction", f"Pull request {pull_request.id}"):
+            with span("upsert_pull_request"):
+                tracked_pull_request = PullRequest.upsert_from_json(data=data)
+
+            with span("update_tracked_trello_cards"):
+                before_update_pr_card_count, removed_checkitems = self._update_tracked_trello_cards(
+                    tracked_pull_request, new_trello_cards=trello_cards
+                )
+            self.logger.debug("Linked cards before update", count=before_update_pr_card_count)
+
+            with span("update_pull_request_status"):
+                self._update_pull_request_status(
+                    tracked_pull_request, before_update_pr_card_count=before_update_pr_card_count
+                )
+
+            if checklist_feature_enabled:
+                with span("get_tracked_checklists"):
+                    checklist_ids, checkitem_ids = self._get_tracked_checklists(pull_request, trello_cards)
+
+        with updater_stage("sync_pull_request.delete_trello_checkitems"):
+            self._delete_trello_checkitems(removed_checkitems)
+
+        if checklist_feature_enabled:
+            with updater_stage("sync_pull_request.update_trello_checklists"):
+                self._update_trello_checklists(pull_request, trello_cards, checklist_ids, checkitem_ids)
+
+    def _create_repository_webhook(self, repo_id, callback_url, hook_secret):
+        hook = self.github_client.create_webhook(
+            repo_id=repo_id, callback_url=callback_url, secret=hook_secret, events=["pull_request"], active=True
+        )
+
+        if "id" not in hook:
+            raise GithubResourceMissing(hook.get("message", hook))
+
+        return hook
 
-        before_update_pr_card_count = len(pull_request.trello_cards)
-        self.app.logger.debug(f"before_update_pr_card_count: {before_update_pr_card_count}")
+    def _delete_repository_webhook(self, repo_id, hook_id):
+        response = self.github_client.delete_webhook(repo_id=repo_id, hook_id=hook_id)
 
-        self._update_tracked_trello_cards(pull_request=pull_request, new_trello_cards=trello_cards)
-        self._update_pull_request_status(pull_request, before_update_pr_card_count=before_update_pr_card_count)
+        if response.status_code == 404:
+            raise GithubResourceMissing(response.text)
 
-        if self.user.checklist_feature_enabled:
-            self._update_trello_checklists(pull_request)
+        response.raise_for_status()
+
+    def sync_repositories(self, chosen_repo_ids, available_repos=None):
+        """
+        Creates webhooks for newly chosen repositories and removes them from repositories no longer chosen.
+
+        `available_repos` should be `GithubRepoData` already listed from GitHub (e.g. from the repo catalog); their data
+        is reused rather than re-fetching each new repository. Upstream calls run concurrently. Failures to create or
+        delete a hook are flashed per repository, leaving that repository as it was while the others carry on; a hook
+        that is already gone or can no longer be reached with the user's token is logged and its repository removed
+        anyway.
+
+        Returns the IDs of the repositories that were newly connected.
+        """
+        available_repos_by_id = {repo.id: repo for repo in available_repos or []}
+        max_workers = self.app.config["GITHUB_WEBHOOK_CONCURRENCY"]
 
-    def sync_repositories(self, chosen_repo_ids):
-        print(chosen_repo_ids)
         existing_repo_ids = {
             repo.id for repo in GithubRepo.query.filter(GithubRepo.integration == self.user.github_integration).all()
         }
-        print(existing_repo_ids)
 
         repos_to_deintegrate = GithubRepo.query.filter(GithubRepo.id.in_(existing_repo_ids - chosen_repo_ids)).all()
 
-        for repo in repos_to_deintegrate:
-            try:
-                self.github_client.delete_webhook(repo.id, repo.hook_id)
-            except (GithubResourceMissing, GithubUnauthorized) as e:
-                self.app.logger.warn(f"Unable to delete hook for {repo}: {e}")
+        repos_to_deintegrate_by_id = {repo.id: repo for repo in repos_to_deintegrate}
+        hook_ids = {repo.id: repo.hook_id for repo in repos_to_deintegrate}
+        for repo_id, _, error in map_concurrently(
+            self.app,
+            lambda repo_id: self._delete_repository_webhook(repo_id, hook_ids[repo_id]),
+            hook_ids.keys(),
+            max_workers,
+        ):
+            repo = repos_to_deintegrate_by_id[repo_id]
+            if isinstance(error, (GithubResourceMissing, GithubUnauthorized)):
+                self.logger.warning("Unable to delete hook", repo=repo, error=error)
+
+            elif error:
+                self.logger.error("Unable to delete hook", repo=repo, error=error)
+                flash(
+                    f"This powerup could not be disconnected from the ‘{repo.fullname}’ repository. Please try again.",
+                    "error",
+                )
+                continue
 
             db.session.delete(repo)
             flash(f"This powerup is no longer monitoring the ‘{repo.fullname}’ repository.", "warning")
 
-        for repo in chosen_repo_ids - existing_repo_ids:
-            print("creating webhook for ", repo)
+        connected_repo_ids = set()
+        hook_settings = {}
+        for repo_id in chosen_repo_ids - existing_repo_ids:
             hook_unique_slug = str(uuid.uuid4())
-            hook_secret = token_urlsafe()
-            hook = self.github_client.create_webhook(
-                repo_id=repo,
-                callback_url=url_for(
-                    ".github_callback", _external=True, unique_slug=hook_unique_slug
-                ),  # should be done by the client really
-                secret=hook_secret,
-                events=["pull_request"],
-                active=True,
-            )
-            print(hook)
-            repo = GithubRepo(
-                id=repo,
-                hook_id=hook["id"],
+            hook_settings[repo_id] = dict(
                 hook_unique_slug=hook_unique_slug,
-                hook_secret=hook_secret,
-                integration=self.user.github_integration,
+                hook_secret=token_urlsafe(),
+                callback_url=url_for(".github_callback", _external=True, unique_slug=hook_unique_slug),
             )
-            repo.hydrate(github_client=self.github_client)
+
+        for repo_id, hook, error in map_concurrently(
+            self.app,
+            lambda repo_id: self._create_repository_webhook(
+                repo_id,
+                callback_url=hook_settings[repo_id]["callback_url"],
+                hook_secret=hook_settings[repo_id]["hook_secret"],
+            ),
+            hook_settings.keys(),
+            max_workers,
+        ):
+            repo = available_repos_by_id.get(repo_id)
+            if error:
+                self.logger.error("Unable to create hook", repo=repo or repo_id, error=error)
+                flash(
+                    f"This powerup could not be connected to the ‘{repo.fullname if repo else repo_id}’ repository. "
+                    "Please try again.",
+                    "error",
+                )
+                continue
+
+            repo = (
+                GithubRepo.from_data(repo)
+                if repo is not None
+                else GithubRepo(id=repo_id).hydrate(github_client=self.github_client)
+            )
+
+            repo.hook_id = hook["id"]
+            repo.hook_unique_slug = hook_settings[repo_id]["hook_unique_slug"]
+            repo.hook_secret = hook_settings[repo_id]["hook_secret"]
+            repo.integration = self.user.github_integration
 
             db.session.add(repo)
+            connected_repo_ids.add(repo_id)
             flash(f"This powerup has been connected the ‘{repo.fullname}’ repository.", "info")
 
         db.session.commit()
 
+        return connected_repo_ids
+
+    def reconcile_repository(self, github_repo):
+        """
+        Re-syncs every pull request on `github_repo` updated since it was last reconciled, repairing any drift left by
+        missed webhooks. A repository that has never been reconciled has all of its open pull requests backfilled.
+
+        Returns the number of pull requests synced.
+        """
+        started_at = datetime.utcnow()
+        synced_count = 0
+
+        for data in self.github_client.get_pull_requests(github_repo.id, updated_since=github_repo.reconciled_at):
+            if not data["head"]["repo"] or data["head"]["repo"]["id"] != github_repo.id:
+                self.logger.debug(
+                    "Skipping pull request from outside repo", pull_request_id=data["id"], repo=github_repo
+                )
+                continue
+
+            self.sync_pull_request(data=data)
+            synced_count += 1
+
+        github_repo.reconciled_at = started_at - RECONCILE_CURSOR_OVERLAP
+        db.session.add(github_repo)
+        db.session.commit()
+
+        return synced_count
+
     def transfer_repository(self, chosen_repo_id):
         print(f"{self.user} transferring repo {chosen_repo_id} to their account")
         github_repo = GithubRepo.query.get(chosen_repo_id)
 
-        sparkpost.transmissions.send(
-            recipients=[github_repo.integration.user.email],
+        enqueue_email(
+            recipient=github_repo.integration.user.email,
             html=render_template(
                 "email/repo-transferred.html",
                 start_page_url=url_for(".start_page", _external=True),
                 repo_fullname=github_repo.fullname,
                 new_owner_email_address=self.user.email,
             ),
-            from_email=self.app.config["MAIL_DEFAULT_SENDER"],
             subject=f"Repository transferred in {self.app.config['APP_NAME']}",
         )
 
@@ -275,12 +572,63 @@ class Updater:
         )
 
     def sync_trello_card(self, trello_card):
-        self.app.logger.debug(f"Starting sync_trello_card for {trello_card}")
+        self.logger.debug("Starting sync_trello_card", trello_card=trello_card)
 
-        if not trello_card.pull_requests:
-            self.app.logger.debug("No pull requests - skipping")
+        pull_requests = trello_card.pull_requests
+        if not pull_requests:
+            self.logger.debug("No pull requests - skipping")
             return
 
-        for pull_request in trello_card.pull_requests:
-            pull_request.hydrate(github_client=self.github_client)
-            self._update_pull_request_status(pull_request, before_update_pr_card_count=len(pull_request.trello_cards))
+        # Everything GitHub and Trello have to say is fetched up front, so no transaction is held open waiting on them.
+        with updater_stage("sync_trello_card.fetch_pull_requests"):
+            for pull_request, data, error in self._fetch_pull_request_data(pull_requests):
+                if error:
+                    raise error
+
+                pull_request.hydrate(data=data)
+
+        with updater_stage("sync_trello_card.fetch_trello_cards"):
+            self._fetch_trello_card_data(
+                {linked_card.id for pull_request in pull_requests for linked_card in pull_request.trello_cards}
+            )
+
+        with self._unit_of_work("sync_trello_card.transaction", f"Trello card {trello_card.id}"):
+            for pull_request in pull_requests:
+                with span("update_pull_request_status", pull_request_id=pull_request.id):
+                    self._update_pull_request_status(
+                        pull_request, before_update_pr_card_count=len(pull_request.trello_cards)
+                    )
+
+    def recompute_pull_request_statuses(self, pull_requests):
+        """
+        Re-evaluates and reposts the status of each open pull request, e.g. after a sign-off check has been added or
+        removed. Upstream calls are made a few at a time and every linked card is only fetched once; a card that has
+        since been deleted or can't be seen with the user's token is skipped rather than failing its pull requests.
+
+        Returns the number of statuses recorded.
+        """
+        open_pull_requests = []
+        for pull_request, data, error in self._fetch_pull_request_data(pull_requests):
+            if error:
+                self.logger.warning("Unable to fetch pull request", pull_request_id=pull_request.id, error=error)
+                continue
+
+            if pull_request.hydrate(data=data).state == "open":
+                open_pull_requests.append(pull_request)
+
+        self._fetch_trello_card_data(
+            {trello_card.id for pull_request in open_pull_requests for trello_card in pull_request.trello_cards},
+            ignore_invalid=True,
+        )
+
+        with self._unit_of_work(
+            "recompute_pull_request_statuses.transaction",
+            f"Recomputing {len(open_pull_requests)} pull request statuses",
+        ):
+            for pull_request in open_pull_requests:
+                status, required = self._evaluate_pull_request_status(
+                    pull_request, before_update_pr_card_count=len(pull_request.trello_cards)
+                )
+                self._set_pull_request_status(pull_request, status, required=required)
+
+        return len(open_pull_requests)
@@ -1,10 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import os
 import re
+import threading
+import time
 
-from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
-from app.errors import TrelloInvalidRequest, TrelloResourceMissing
 from app.github import GithubClient
+from app.metrics import current_event, event_context
+from app.tracing import continue_trace, current_span
 from app.trello import TrelloClient
 
 
@@ -32,31 +38,26 @@ def coerce_int_or_error(key, value):
 
 def get_github_client(app, user):
     return GithubClient(
-        client_id=app.config["GITHUB_CLIENT_ID"], client_secret=app.config["GITHUB_CLIENT_SECRET"], user=user
+        client_id=app.config["GITHUB_CLIENT_ID"],
+        client_secret=app.config["GITHUB_CLIENT_SECRET"],
+        user=user,
+        api_root=app.config["GITHUB_API_ROOT"],
+        transport=app.extensions["upstream_transport"],
     )
 
 
 def get_trello_client(app, user):
-    return TrelloClient(key=app.config["TRELLO_API_KEY"], user=user)
+    return TrelloClient(
+        key=app.config["TRELLO_API_KEY"],
+        user=user,
+        api_root=app.config["TRELLO_API_ROOT"],
+        transport=app.extensions["upstream_transport"],
+    )
 
 
-def get_trello_cards_from_text(trello_client, text):
+def get_trello_card_ids_from_text(text):
     urls = re.findall(r"(?:https?://)?(?:www.)?trello.com/c/\w+\b", text)
-    card_ids = {os.path.basename(url) for url in urls}
-
-    trello_cards = []
-    for card_id in card_ids:
-        try:
-            trello_card = trello_client.get_card(card_id)
-
-        except (TrelloInvalidRequest, TrelloResourceMissing):
-            current_app.logger.warn(f"Ignoring invalid card {card_id}")
-            continue
-
-        trello_cards.append(trello_card)
-
-    current_app.logger.debug(f"Found trello cards: {trello_cards}")
-    return trello_cards
+    return {os.path.basename(url) for url in urls}
 
 
 def get_github_token_status(app, user):
@@ -73,3 +74,70 @@ def get_trello_token_status(app, user):
         return "valid" if trello_client.is_token_valid() else "invalid"
 
     return None
+
+
+def map_concurrently(app, func, items, max_workers):
+    """
+    Runs `func` over `items` on a bounded thread pool, each call inside its own app context.
+
+    Yields `(item, result, error)` tuples in completion order so callers can report failures per item rather than
+    aborting on the first one. Each call gets its own DB session, so ORM objects must not be shared with `func`.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    # Worker threads have no app context of their own, so resolve the `current_app` proxy while we still can.
+    app = getattr(app, "_get_current_object", lambda: app)()
+    event, parent_span = current_event(), current_span()
+
+    def _call(item):
+        with app.app_context(), event_context(event), continue_trace(parent_span):
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = {executor.submit(_call, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+
+            except Exception as e:
+                yield futures[future], None, e
+
+
+class DBTimer:
+    """Running totals for the statements executed inside a `time_db_statements` block."""
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+_db_timers = threading.local()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_started_at", []).append(time.monotonic())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.monotonic() - conn.info["statement_started_at"].pop()
+
+    for timer in getattr(_db_timers, "active", []):
+        timer.statements += 1
+        timer.seconds += elapsed
+
+
+@contextmanager
+def time_db_statements():
+    """Counts the statements run by this thread inside the block, and how long they took. Blocks may be nested."""
+    timer = DBTimer()
+    _db_timers.active = getattr(_db_timers, "active", []) + [timer]
+
+    try:
+        yield timer
+
+    finally:
+        _db_timers.active.remove(timer)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from functools import wraps
 import hashlib
 import hmac
@@ -11,9 +12,11 @@ from flask import (
     current_app,
     flash,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
+    send_file,
     session,
     url_for,
 )
@@ -26,8 +29,16 @@ from sqlalchemy import or_
 
 from notifications_python_client.notifications import NotificationsAPIClient
 
-from app import db, mail, sparkpost
-from app.auth import login_user, logout_user, create_login_token
+from app import db, mail
+from app.auth import end_all_sessions, login_user, logout_user, create_login_token
+from app.catalogs import (
+    evict_board_catalog,
+    get_board_catalog,
+    get_catalog_board,
+    get_repo_catalog,
+    get_repo_owners,
+    search_repo_catalog,
+)
 from app.errors import (
     GithubUnauthorized,
     HookAlreadyExists,
@@ -35,6 +46,7 @@ from app.errors import (
     TrelloResourceMissing,
     GithubResourceMissing,
 )
+from app.dtos import GithubRepoData, TrelloBoardData
 from app.forms import (
     AuthorizeTrelloForm,
     ChooseGithubRepoForm,
@@ -48,17 +60,25 @@ from app.forms import (
     TransferGithubRepoForm,
 )
 from app.github import GithubClient
+from app.jobs import start_background_job, reconcile_repositories, recompute_board_statuses
+from app.logs import get_logger
+from app.metrics import event_context, generate_metrics, outbox_metric_families
 from app.models import (
     GithubRepo,
     LoginToken,
     TrelloBoard,
     TrelloCard,
     TrelloList,
+    TrelloObjectId,
     User,
     GithubIntegration,
     TrelloIntegration,
     ProductSignoff,
 )
+from app.outbox import enqueue_email, get_commit_status_outbox_metrics, get_email_outbox_metrics
+from app.payload_samples import get_payload_samples, sample_payload
+from app.profiling import get_profile_path, get_profiles
+from app.tracing import trace
 from app.trello import TrelloClient
 from app.updater import Updater
 from app.utils import get_github_client, get_trello_client, get_github_token_status, get_trello_token_status
@@ -105,6 +125,29 @@ def require_missing_or_invalid_github_token(func):
     return wrapper
 
 
+def require_bearer_token(config_key, allow_unset=False):
+    """
+    Requires `Authorization: Bearer <token>` matching the `config_key` setting. If that isn't set, requests are refused,
+    or, with `allow_unset`, let through everywhere but production.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            token = current_app.config[config_key]
+            if not token and allow_unset and current_app.config["FLASK_ENV"] != "production":
+                return func(*args, **kwargs)
+
+            if not token or not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+                abort(401)
+
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 def redirect_authenticated_user_to_dashboard(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -133,11 +176,8 @@ def login():
             "email/login-link.html", login_link=url_for(".login_with_payload", payload=payload, _external=True)
         )
 
-        sparkpost.transmissions.send(
-            recipients=[login_form.email.data],
-            html=message_body,
-            from_email=current_app.config["MAIL_DEFAULT_SENDER"],
-            subject=f"Login to {current_app.config['APP_NAME']}",
+        enqueue_email(
+            recipient=login_form.email.data, html=message_body, subject=f"Login to {current_app.config['APP_NAME']}"
         )
 
         # message = Message(
@@ -202,8 +242,7 @@ def dashboard():
 
     product_signoffs = []
     if trello_status == "valid":
-        trello_client = get_trello_client(current_app, current_user)
-        trello_board_ids = [board.id for board in trello_client.get_boards()]
+        trello_board_ids = [board["id"] for board in get_board_catalog(current_user)]
 
         product_signoffs = ProductSignoff.query.filter(
             ProductSignoff.trello_board.has(TrelloBoard.id.in_(trello_board_ids))
@@ -234,6 +273,9 @@ def account():
 def delete_account():
     delete_account_form = DeleteAccountForm()
     if delete_account_form.validate_on_submit():
+        # Ends the user's other sessions straight away, rather than once the revocations below have finished.
+        end_all_sessions(db, current_user)
+
         github_status = get_github_token_status(current_app, current_user)
         if github_status == "valid":
             github_client = get_github_client(current_app, current_user)
@@ -291,12 +333,10 @@ def integrate_github():
 
 @main_blueprint.route("/github/integration/callback", methods=["POST"])
 def github_callback():
+    received_at = datetime.utcnow()
     if request.headers["X-GitHub-Event"] == "ping":
         return jsonify(status="OK"), 200
 
-    if current_app.config["DEBUG_PAYLOADS"]:
-        current_app.logger.info(f"Incoming github payload: {request.json}")
-
     # if "unique_slug" not in request.args or "pull_request" not in request.json:  # TODO: should be abstracted somehow
     #     current_app.logger.info("Missing ‘unique_slug’ in query params or ‘pull_request’ in payload")
     #     return jsonify(status="OK"), 200
@@ -304,9 +344,17 @@ def github_callback():
     payload = request.json["pull_request"]
     repo_id = payload["head"]["repo"]["id"]
 
-    github_repo = GithubRepo.query.get(repo_id)
+    github_repo = GithubRepo.get_with_owner(repo_id)
+    sample_payload(
+        current_app,
+        "github",
+        "webhook",
+        request.path,
+        lambda: request.get_data(as_text=True),
+        user_id=github_repo.integration_id if github_repo else None,
+    )
     if not github_repo:
-        current_app.logger.info("No github_repo found in database")
+        get_logger(current_app).info("No github_repo found in database", repo_id=repo_id)
         return jsonify(status="GONE"), 410
 
     # if github_repo.hook_unique_slug != request.args["unique_slug"]:
@@ -320,8 +368,15 @@ def github_callback():
     #     current_app.logger.info("X-Hub-Signature verification failed")
     #     return jsonify(status="OK"), 200
 
-    updater = Updater(current_app, db, github_repo.integration.user)
-    updater.sync_pull_request(data=payload)
+    with event_context("github_pull_request", received_at=received_at), trace(
+        current_app,
+        "github_pull_request",
+        delivery_id=request.headers.get("X-GitHub-Delivery"),
+        repo_id=repo_id,
+        pull_request_id=payload["id"],
+    ):
+        updater = Updater(current_app, db, github_repo.integration.user)
+        updater.sync_pull_request(data=payload)
 
     return jsonify(status="OK"), 200
 
@@ -364,30 +419,38 @@ def authorize_github_complete():
 @register_breadcrumb(main_blueprint, ".github_choose_repos", "Choose repositories")
 @login_required
 def github_choose_repos():
-    github_client = get_github_client(current_app, current_user)
-    available_repos = github_client.get_repos()
-    print("available_repos", available_repos)
-    editable_repos = [
-        repo
-        for repo in available_repos
-        if (not repo.integration) or repo.integration == current_user.github_integration
-    ]
-    editable_repo_ids = {repo.id for repo in editable_repos}
-    print("editable_repos", editable_repos)
-    owned_by_another_repos = [
-        repo for repo in available_repos if repo.integration and repo.integration != current_user.github_integration
-    ]
-    owned_by_another_repo_ids = {repo.id for repo in owned_by_another_repos}
-    print("owned_by_another_repos", owned_by_another_repos)
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = current_app.config["REPO_PICKER_PAGE_SIZE"]
+    user_id = current_user.id
+
+    catalog = get_repo_catalog(current_user, refresh="refresh" in request.args)
+    repo_owners = get_repo_owners([repo["id"] for repo in catalog])
+    connected_repo_ids = {repo_id for repo_id, owner_id in repo_owners.items() if owner_id == user_id}
+    owned_by_another_count = len(repo_owners) - len(connected_repo_ids)
+
+    editable_repos = [repo for repo in catalog if repo_owners.get(repo["id"], user_id) == user_id]
+    page_repos, match_count = search_repo_catalog(editable_repos, query, page, page_size)
+    page_repos = [GithubRepoData.from_json(repo) for repo in page_repos]
 
-    repo_form = ChooseGithubRepoForm(editable_repos)
+    repo_form = ChooseGithubRepoForm(page_repos)
+
+    if request.method == "POST":
+        # Only the repositories the user was shown can change: the catalog (and so the page) may have moved on since,
+        # and a connected repository missing from the form mustn't read as unticked.
+        displayed_repo_ids = repo_form.get_displayed_repo_ids()
+        form_repos = [GithubRepoData.from_json(repo) for repo in editable_repos if repo["id"] in displayed_repo_ids]
+        repo_form = ChooseGithubRepoForm(form_repos)
 
     if repo_form.validate_on_submit():
-        github_client = get_github_client(current_app, current_user)
-        chosen_repo_ids = editable_repo_ids.intersection(set(repo_form.repo_choice.data)) - owned_by_another_repo_ids
+        form_repo_ids = {repo.id for repo in form_repos}
+        chosen_repo_ids = (connected_repo_ids - form_repo_ids) | (form_repo_ids & set(repo_form.repo_choice.data))
 
         updater = Updater(current_app, db, current_user)
-        updater.sync_repositories(chosen_repo_ids)
+        newly_connected_repo_ids = updater.sync_repositories(chosen_repo_ids, available_repos=form_repos)
+
+        if newly_connected_repo_ids:
+            start_background_job(current_app, reconcile_repositories, repo_ids=newly_connected_repo_ids)
 
         return redirect(url_for(".dashboard"))
 
@@ -395,11 +458,18 @@ def github_choose_repos():
         for error in repo_form.errors.items():
             flash(error, "warning")
 
-    existing_repos = GithubRepo.query.filter(GithubRepo.id.in_([repo.id for repo in editable_repos])).all()
-    repo_form.repo_choice.data = [repo.id for repo in existing_repos]
+    repo_form = ChooseGithubRepoForm(page_repos, formdata=None)
+    repo_form.repo_choice.data = [repo.id for repo in page_repos if repo.id in connected_repo_ids]
+    repo_form.displayed_repo_ids.data = ",".join(str(repo.id) for repo in page_repos)
 
     return render_template(
-        "integration/choose-repos.html", repo_form=repo_form, owned_by_another_repos=owned_by_another_repos
+        "integration/choose-repos.html",
+        repo_form=repo_form,
+        owned_by_another_count=owned_by_another_count,
+        query=query,
+        page=page,
+        page_count=max((match_count + page_size - 1) // page_size, 1),
+        match_count=match_count,
     )
 
 
@@ -409,16 +479,20 @@ def github_choose_repos():
 )
 @login_required
 def github_transfer_existing_repos():
-    github_client = get_github_client(current_app, current_user)
-    available_repos = github_client.get_repos()
-    repos_owned_by_another = [
-        repo for repo in available_repos if repo.integration and repo.integration != current_user.github_integration
-    ]
+    catalog = get_repo_catalog(current_user)
+    repos_owned_by_another = (
+        GithubRepo.query.filter(
+            GithubRepo.id.in_([repo["id"] for repo in catalog]), GithubRepo.integration_id != current_user.id
+        )
+        .order_by(GithubRepo.fullname)
+        .all()
+        if catalog
+        else []
+    )
 
     repo_form = TransferGithubRepoForm(repos_owned_by_another)
 
     if repo_form.validate_on_submit():
-        github_client = get_github_client(current_app, current_user)
         chosen_repo_id = repo_form.repo_choice.data
 
         updater = Updater(current_app, db, current_user)
@@ -470,20 +544,25 @@ def integrate_trello_head():
 
 @main_blueprint.route("/trello/integration", methods=["POST"])
 def trello_callback():
+    received_at = datetime.utcnow()
     data = json.loads(request.get_data(as_text=True))
 
-    if current_app.config["DEBUG_PAYLOADS"]:
-        current_app.logger.debug(f"Incoming trello payload: {data}")
-
     if data.get("action", {}).get("type") == "updateCard":
-        trello_card = TrelloCard.from_json(data["action"]["data"]["card"])
-        current_app.logger.debug(f"updateCard on {trello_card}")
+        trello_card = TrelloCard.query.get(data["action"]["data"]["card"]["shortLink"])
+        get_logger(current_app).debug("updateCard", trello_card=trello_card)
         if trello_card and trello_card.pull_requests:
-            updater = Updater(current_app, db, trello_card.pull_requests[0].repo.integration.user)
-            updater.sync_trello_card(trello_card)
+            user = trello_card.pull_requests[0].repo.integration.user
+            sample_payload(
+                current_app, "trello", "webhook", request.path, lambda: request.get_data(as_text=True), user_id=user.id
+            )
+            with event_context("trello_update_card", received_at=received_at), trace(
+                current_app, "trello_update_card", delivery_id=data["action"].get("id"), card_id=trello_card.id
+            ):
+                updater = Updater(current_app, db, user)
+                updater.sync_trello_card(trello_card)
 
     else:
-        current_app.logger.debug("Ignoring payload: not an `updateCard`")
+        get_logger(current_app).debug("Ignoring payload: not an `updateCard`")
 
     return jsonify(status="OK"), 200
 
@@ -543,6 +622,7 @@ def revoke_trello():
 
     db.session.delete(current_user.trello_integration)
     db.session.commit()
+    evict_board_catalog(current_user.id)
 
     flash("Trello authorisation token revoked successfully.")
 
@@ -553,8 +633,7 @@ def revoke_trello():
 @register_breadcrumb(main_blueprint, ".trello_product_signoff", "Product sign-off checks")
 @login_required
 def trello_product_signoff():
-    trello_client = get_trello_client(current_app, current_user)
-    all_trello_boards_json = trello_client.get_boards(with_lists=True, as_json=True)
+    all_trello_boards_json = get_board_catalog(current_user)
     all_trello_boards_by_id = {board_json["id"]: board_json for board_json in all_trello_boards_json}
 
     existing_product_signoff_checks = ProductSignoff.query.filter(
@@ -571,12 +650,26 @@ def trello_product_signoff():
     )
 
 
+def _hydrate_product_signoff(product_signoff):
+    """Fills in board/list details from the user's cached board catalog, only asking Trello if they aren't in it."""
+    board_json = get_catalog_board(current_user, product_signoff.trello_board_id)
+    if board_json and any(list_json["id"] == product_signoff.trello_list_id for list_json in board_json["lists"]):
+        product_signoff.hydrate_from_board_json(board_json)
+
+    else:
+        product_signoff.hydrate(get_trello_client(current_app, current_user))
+
+
 def get_board_name(*args, **kwargs):
     signoff_id = request.view_args["signoff_id"]
     product_signoff = ProductSignoff.query.filter(ProductSignoff.id == signoff_id).one()
-    trello_client = get_trello_client(current_app, current_user)
-    board = trello_client.get_board(product_signoff.trello_board_id)
-    return [{"text": board.name, "url": url_for(".trello_manage_product_signoff", signoff_id=signoff_id)}]
+    _hydrate_product_signoff(product_signoff)
+    return [
+        {
+            "text": product_signoff.trello_board.name,
+            "url": url_for(".trello_manage_product_signoff", signoff_id=signoff_id),
+        }
+    ]
 
 
 @main_blueprint.route("/trello/product-signoff/<signoff_id>")
@@ -585,7 +678,6 @@ def get_board_name(*args, **kwargs):
 )
 @login_required
 def trello_manage_product_signoff(signoff_id):
-    trello_client = get_trello_client(current_app, current_user)
     product_signoff = ProductSignoff.query.filter(ProductSignoff.id == signoff_id).one_or_none()
     if not product_signoff:
         flash("No such board")
@@ -595,7 +687,7 @@ def trello_manage_product_signoff(signoff_id):
         flash("That product signoff check is owned by another person")
         return redirect(url_for(".trello_product_signoff")), 403
 
-    product_signoff.hydrate(trello_client)
+    _hydrate_product_signoff(product_signoff)
 
     return render_template("features/signoff/manage-product-signoff.html", product_signoff=product_signoff)
 
@@ -619,7 +711,7 @@ def trello_delete_signoff_check(signoff_id):
         flash("That product signoff check is owned by another person")
         return redirect(url_for(".trello_product_signoff")), 403
 
-    product_signoff.hydrate(trello_client)
+    _hydrate_product_signoff(product_signoff)
 
     if delete_product_signoff_form.validate_on_submit():
         try:
@@ -632,8 +724,12 @@ def trello_delete_signoff_check(signoff_id):
             f"You have deleted the product sign-off check on the ‘{product_signoff.trello_board.name}’ board.",
             "warning",
         )
+        trello_board_id = product_signoff.trello_board_id
         db.session.delete(product_signoff)
         db.session.commit()
+        evict_board_catalog(current_user.id)
+
+        start_background_job(current_app, recompute_board_statuses, board_id=trello_board_id)
 
         return redirect(url_for(".trello_product_signoff"))
 
@@ -652,8 +748,7 @@ def trello_delete_signoff_check(signoff_id):
 @register_breadcrumb(main_blueprint, ".trello_product_signoff.trello_choose_board", "Choose Trello board")
 @login_required
 def trello_choose_board():
-    trello_client = get_trello_client(current_app, current_user)
-    all_trello_boards = trello_client.get_boards(with_lists=True)
+    all_trello_boards = [TrelloBoardData.from_json(board_json) for board_json in get_board_catalog(current_user)]
     all_trello_boards_by_id = {board.id: board for board in all_trello_boards}
 
     existing_product_signoff_checks = ProductSignoff.query.filter(
@@ -684,12 +779,21 @@ def trello_choose_list():
         flash("Please select a Trello board.")
         return redirect(".trello_choose_board")
 
+    if not TrelloObjectId.is_valid(board_id):
+        abort(404)
+
     if ProductSignoff.query.filter(ProductSignoff.trello_board.has(TrelloBoard.id == board_id)).count():
         flash("Product sign-off checks are already enabled for that board.", "warning")
         return redirect(url_for(".trello_product_signoff"))
 
+    board_json = get_catalog_board(current_user, board_id)
+    if not board_json:
+        flash("Please select a Trello board.")
+        return redirect(url_for(".trello_choose_board"))
+
     trello_client = get_trello_client(current_app, current_user)
-    trello_lists = trello_client.get_lists(board_id=request.args["board_id"])
+    board_data = TrelloBoardData.from_json(board_json)
+    trello_lists = [list_data for list_data in board_data.lists if not list_data.closed]
 
     list_form = ChooseTrelloListForm(trello_lists)
 
@@ -703,12 +807,15 @@ def trello_choose_list():
         except HookAlreadyExists:
             trello_hook = trello_client.get_webhook(object_id=list_id)
 
-        trello_board = TrelloBoard.from_json(trello_client.get_board(board_id, as_json=True))
-        trello_list = TrelloList.from_json(trello_client.get_list(list_id, as_json=True))
+        trello_board = TrelloBoard.from_data(board_data)
+        trello_list = TrelloList.from_data(next(list_data for list_data in trello_lists if list_data.id == list_id))
         trello_list.hook_id = trello_hook["id"]
         product_signoff = ProductSignoff(user=current_user, trello_board=trello_board, trello_list=trello_list)
         db.session.add(product_signoff)
         db.session.commit()
+        evict_board_catalog(current_user.id)
+
+        start_background_job(current_app, recompute_board_statuses, board_id=trello_board.id)
 
         flash((f"Product sign-off checks added to the “{trello_board.name}” board."), "info")
         return redirect(url_for(".dashboard"))
@@ -747,3 +854,46 @@ def feature_checklists():
     return render_template(
         "features/checklists/checklists.html", toggle_checklist_feature_form=toggle_checklist_feature_form
     )
+
+
+@main_blueprint.route("/metrics")
+@require_bearer_token("METRICS_TOKEN", allow_unset=True)
+def metrics():
+    outbox_metrics = {"email": get_email_outbox_metrics(), "commit_status": get_commit_status_outbox_metrics()}
+    body, content_type = generate_metrics(outbox_metric_families(outbox_metrics))
+    response = make_response(body)
+    response.headers["Content-Type"] = content_type
+
+    return response
+
+
+@main_blueprint.route("/admin/payload-samples")
+@require_bearer_token("ADMIN_TOKEN")
+def payload_samples():
+    """This worker's sampled upstream payloads, newest first. Filter with `upstream`, `endpoint` and `user_id`."""
+    samples = get_payload_samples(
+        current_app,
+        upstream=request.args.get("upstream"),
+        endpoint=request.args.get("endpoint"),
+        user_id=request.args.get("user_id", type=int),
+    )
+
+    return jsonify(samples=samples)
+
+
+@main_blueprint.route("/admin/profiles")
+@require_bearer_token("ADMIN_TOKEN")
+def profiles():
+    """Summaries of the request profiles saved on this machine, newest first."""
+    return jsonify(profiles=get_profiles(current_app))
+
+
+@main_blueprint.route("/admin/profiles/<profile_id>")
+@require_bearer_token("ADMIN_TOKEN")
+def download_profile(profile_id):
+    """A profile's folded stacks (sampling) or pstats file (deterministic)."""
+    path = get_profile_path(current_app, profile_id)
+    if not path:
+        abort(404)
+
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True)
@@ -0,0 +1,83 @@
+"""
+Compares building ORM instances against `app.dtos` value objects for a `get_boards(with_lists=True)` payload.
+
+Reports the time to build every board and list and the peak memory they take up. Needs the app's environment (as for
+any `flask` command) because it imports the models, but doesn't touch the database:
+
+    python benchmarks/api_objects.py --boards 200 --lists 15
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.dtos import TrelloBoardData  # noqa: E402
+from app.models import TrelloBoard, TrelloList  # noqa: E402
+
+
+def make_payload(board_count, list_count):
+    return [
+        {
+            "id": f"{board:024x}",
+            "name": f"Board {board}",
+            "lists": [
+                {"id": f"{board * 1000 + list_:024x}", "name": f"List {list_}", "idBoard": f"{board:024x}"}
+                for list_ in range(list_count)
+            ],
+        }
+        for board in range(board_count)
+    ]
+
+
+def build_orm_objects(payload):
+    """What the sign-off pages used to build: a board instance per board and a list instance per list."""
+    boards = []
+    for board_json in payload:
+        board = TrelloBoard.from_json({"id": board_json["id"], "name": board_json["name"]})
+        board.lists = [TrelloList.from_json(list_json) for list_json in board_json["lists"]]
+        boards.append(board)
+
+    return boards
+
+
+def build_value_objects(payload):
+    return [TrelloBoardData.from_json(board_json) for board_json in payload]
+
+
+def measure(build, payload, repeats):
+    timings = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        build(payload)
+        timings.append(time.perf_counter() - started_at)
+
+    gc.collect()
+    tracemalloc.start()
+    objects = build(payload)  # noqa: F841 - kept alive so it's counted
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boards", type=int, default=200)
+    parser.add_argument("--lists", type=int, default=15)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = make_payload(args.boards, args.lists)
+    print(f"{args.boards} boards x {args.lists} lists")
+    print(f"{'objects':<10}{'best time':>14}{'peak memory':>16}")
+    for name, build in (("orm", build_orm_objects), ("value", build_value_objects)):
+        seconds, peak = measure(build, payload, args.repeats)
+        print(f"{name:<10}{seconds * 1000:>11.1f} ms{peak / 1024:>13.0f} kB")
+
+
+if __name__ == "__main__":
+    main()
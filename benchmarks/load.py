@@ -0,0 +1,267 @@
+"""
+Replays GitHub `pull_request` or Trello `updateCard` deliveries against the app running under gunicorn (talking to the
+local GitHub and Trello stubs from `tests/doubles/stubs.py`), sweeping concurrency for each gunicorn worker count.
+
+Each step reports throughput, p50/p99 latency, error rate and the peak number of DB connections (and how many were
+active). For each worker count it also reports the saturation point: the step after which more concurrency stopped
+raising throughput by `--saturation-gain`. Divide an expected webhook rate by that throughput to size the web dynos.
+
+    BENCHMARK_DATABASE_URL=postgresql://localhost/signoff_benchmark \\
+        python benchmarks/load.py pr_with_10_cards --workers 1 2 4 --concurrency 1 2 4 8 16 --latency-ms 80
+
+Each step sends `--events` deliveries from `--concurrency` clients, back to back or paced to `--rate` events/sec.
+Pull request deliveries are spread over `--pull-requests` pull requests. The stubs and clients share this process, so
+at high concurrency check that it isn't the bottleneck itself.
+"""
+import argparse
+from collections import Counter
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Sets up the app's environment on import, so must come before any other app imports.
+from benchmarks.webhooks import (  # noqa: E402
+    SCENARIOS,
+    PullRequestWithCards,
+    create_stubbed_app,
+    drop_tables,
+    percentile,
+)
+import requests  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from app import db  # noqa: E402
+from tests.doubles import payloads  # noqa: E402
+from tests.doubles.stubs import GithubStub, TrelloStub  # noqa: E402
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, port, github_stub, trello_stub):
+    env = dict(os.environ, GITHUB_API_ROOT=github_stub.url, TRELLO_API_ROOT=trello_stub.url)
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn_config.py",
+            "-b",
+            f"127.0.0.1:{port}",
+            "-w",
+            str(workers),
+            "--timeout",
+            "120",
+            "app.factory:create_app()",
+        ],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+
+        try:
+            requests.head(f"http://127.0.0.1:{port}/trello/integration", timeout=1)
+            return process
+
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("gunicorn didn't start within 60s")
+
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class ConnectionSampler(threading.Thread):
+    """Polls `pg_stat_activity` for the benchmark database, keeping the peak total and active connection counts."""
+
+    def __init__(self, database_url, interval=0.2):
+        super().__init__(name="connection-sampler", daemon=True)
+        self.engine = create_engine(database_url)
+        self.interval = interval
+        self.peak_total, self.peak_active = 0, 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        with self.engine.connect() as connection:
+            while not self._stopped.is_set():
+                states = dict(
+                    connection.execute(
+                        text(
+                            "SELECT state, count(*) FROM pg_stat_activity "
+                            "WHERE datname = current_database() AND pid <> pg_backend_pid() GROUP BY state"
+                        )
+                    ).fetchall()
+                )
+                self.peak_total = max(self.peak_total, sum(states.values()))
+                self.peak_active = max(self.peak_active, states.get("active", 0))
+                self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.engine.dispose()
+
+
+class Deliveries:
+    """Hands out webhook requests to the client threads, spreading pull request deliveries over several PRs."""
+
+    def __init__(self, scenario, pull_request_count):
+        self.scenario = scenario
+        self.pull_request_count = pull_request_count
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            index, self._index = self._index, self._index + 1
+            path, body, headers = self.scenario.request(index)
+
+        if isinstance(self.scenario, PullRequestWithCards):
+            pull_request = payloads.github_pull_request(
+                self.scenario.repo,
+                1 + index % self.pull_request_count,
+                self.scenario.pull_request["body"],
+                self.scenario.github_stub.url,
+            )
+            body = payloads.github_pull_request_event(pull_request, action=body["action"])
+
+        return path, body, headers
+
+
+def run_step(base_url, deliveries, events, concurrency, rate):
+    """Sends `events` deliveries from `concurrency` threads, returning latencies, outcome counts and elapsed time."""
+    latencies, outcomes = [], Counter()
+    results_lock = threading.Lock()
+    remaining = iter(range(events))
+    started_at = time.monotonic()
+
+    def client():
+        for sent in remaining:
+            if rate:
+                time.sleep(max(started_at + sent / rate - time.monotonic(), 0))
+
+            path, body, headers = deliveries.next()
+            request_started_at = time.monotonic()
+            try:
+                outcome = requests.post(base_url + path, json=body, headers=headers, timeout=120).status_code
+
+            except requests.exceptions.RequestException as e:
+                outcome = type(e).__name__
+
+            with results_lock:
+                latencies.append(time.monotonic() - request_started_at)
+                outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=client, name=f"load-client-{n}") for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sorted(latencies), outcomes, time.monotonic() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="gunicorn worker counts to sweep")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="client counts to sweep")
+    parser.add_argument("--events", type=int, default=200, help="deliveries per step")
+    parser.add_argument("--rate", type=float, help="target events/sec per step (default: as fast as possible)")
+    parser.add_argument("--pull-requests", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50, help="added to every upstream response")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of upstream calls answered with a 502")
+    parser.add_argument("--saturation-gain", type=float, default=0.1)
+    args = parser.parse_args()
+
+    stub_options = dict(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate)
+    github_stub, trello_stub = GithubStub(**stub_options).start(), TrelloStub(**stub_options).start()
+    app = create_stubbed_app(github_stub, trello_stub)
+
+    try:
+        scenario = SCENARIOS[args.scenario](github_stub, trello_stub)
+        with app.app_context():
+            scenario.seed(checklists=False)
+            db.session.remove()
+            db.engine.dispose()  # so only gunicorn's connections are counted
+        deliveries = Deliveries(scenario, args.pull_requests)
+
+        print(
+            f"{'workers':>7} {'clients':>7} {'events/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'db conns':>9}"
+        )
+        saturation = {}
+        for workers in args.workers:
+            port = free_port()
+            process = start_gunicorn(workers, port, github_stub, trello_stub)
+            try:
+                run_step(f"http://127.0.0.1:{port}", deliveries, workers * 2, workers, None)  # warm up every worker
+
+                best = None
+                for concurrency in args.concurrency:
+                    sampler = ConnectionSampler(os.environ["DATABASE_URL"])
+                    sampler.start()
+                    latencies, outcomes, elapsed = run_step(
+                        f"http://127.0.0.1:{port}", deliveries, args.events, concurrency, args.rate
+                    )
+                    sampler.stop()
+
+                    throughput = len(latencies) / elapsed
+                    errors = sum(count for outcome, count in outcomes.items() if outcome != 200) / len(latencies)
+                    print(
+                        f"{workers:>7} {concurrency:>7} {throughput:>9.1f} {percentile(latencies, 0.5) * 1000:>8.0f} "
+                        f"{percentile(latencies, 0.99) * 1000:>8.0f} {errors:>6.1%} "
+                        f"{sampler.peak_total:>4}/{sampler.peak_active:<4}"
+                    )
+                    if best is None or throughput > best[1] * (1 + args.saturation_gain):
+                        best = (concurrency, throughput)
+                    else:
+                        saturation.setdefault(workers, best)
+
+                saturation.setdefault(workers, None)
+
+            finally:
+                stop_gunicorn(process)
+
+        print("\n(db conns: peak total/peak active)")
+        for workers, point in saturation.items():
+            if point:
+                print(f"{workers} workers: saturated at {point[1]:.1f} events/s with {point[0]} clients")
+            else:
+                print(f"{workers} workers: still scaling at {args.concurrency[-1]} clients; try more")
+
+    finally:
+        drop_tables(app)
+        github_stub.stop()
+        trello_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
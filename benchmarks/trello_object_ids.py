@@ -0,0 +1,79 @@
+"""
+Compares storing Trello object IDs as 24-character hex `text` against 12-byte `bytea` (see `TrelloObjectId`).
+
+For each representation it builds a keyed table and a referencing table with the same random IDs, then reports the
+size of the primary key index and the time to join the two on that key. Everything is created as temporary tables, so
+it's safe to point at a development database:
+
+    DATABASE_URL=postgresql://localhost/product_signoff python benchmarks/trello_object_ids.py --rows 200000
+"""
+import argparse
+import os
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+
+
+# Random 24-character hex IDs, identical for both representations.
+HEX_IDS = "substring(md5(i::text) || md5((i * 7)::text), 1, 24)"
+
+REPRESENTATIONS = {"text": ("text", HEX_IDS), "bytea": ("bytea", f"decode({HEX_IDS}, 'hex')")}
+
+
+def build_tables(connection, name, column_type, id_expression, rows):
+    connection.execute(text(f"CREATE TEMPORARY TABLE bench_list_{name} (id {column_type} PRIMARY KEY)"))
+    connection.execute(
+        text(
+            f"CREATE TEMPORARY TABLE bench_signoff_{name} "
+            f"(id serial PRIMARY KEY, list_id {column_type} NOT NULL REFERENCES bench_list_{name} (id))"
+        )
+    )
+    connection.execute(
+        text(f"INSERT INTO bench_list_{name} SELECT {id_expression} FROM generate_series(1, :rows) AS i"), rows=rows
+    )
+    connection.execute(
+        text(f"INSERT INTO bench_signoff_{name} (list_id) SELECT {id_expression} FROM generate_series(1, :rows) AS i"),
+        rows=rows,
+    )
+    connection.execute(text(f"CREATE INDEX ON bench_signoff_{name} (list_id)"))
+    connection.execute(text(f"ANALYZE bench_list_{name}"))
+    connection.execute(text(f"ANALYZE bench_signoff_{name}"))
+
+
+def index_size(connection, name):
+    return connection.execute(text(f"SELECT pg_relation_size('bench_list_{name}_pkey')")).scalar()
+
+
+def time_join(connection, name, repeats):
+    timings = []
+    for _ in range(repeats):
+        started_at = time.monotonic()
+        connection.execute(
+            text(
+                f"SELECT count(*) FROM bench_signoff_{name} s JOIN bench_list_{name} l ON l.id = s.list_id "
+                f"WHERE s.id % 10 = 0"
+            )
+        ).scalar()
+        timings.append(time.monotonic() - started_at)
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ.get("DATABASE_URL", "postgresql://localhost/product_signoff"))
+    with engine.connect() as connection:
+        print(f"{'type':<8}{'pk index size':>16}{'median join':>16}")
+        for name, (column_type, id_expression) in REPRESENTATIONS.items():
+            build_tables(connection, name, column_type, id_expression, args.rows)
+            size, join_seconds = index_size(connection, name), time_join(connection, name, args.repeats)
+            print(f"{name:<8}{size / 1024:>13.0f} kB{join_seconds * 1000:>13.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
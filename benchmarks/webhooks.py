@@ -0,0 +1,156 @@
+"""
+Drives `github_callback` and `trello_callback` with realistic webhook payloads against local GitHub and Trello stubs
+(see `tests/doubles/stubs.py`), and reports events/sec, p50/p99 latency and upstream calls per event.
+
+Scenarios:
+* pr_with_1_card / pr_with_10_cards: a pull request whose body links 1 or 10 Trello cards is edited repeatedly.
+* card_with_100_prs: a Trello card linked from 100 pull requests is moved in and out of the sign-off list.
+
+The app's tables are created in, and dropped from, `BENCHMARK_DATABASE_URL`, so point it at a throwaway database:
+
+    createdb signoff_benchmark
+    BENCHMARK_DATABASE_URL=postgresql://localhost/signoff_benchmark \\
+        python benchmarks/webhooks.py pr_with_10_cards --events 200 --latency-ms 80 --jitter-ms 20
+
+Settings the app requires but the benchmark never uses (OAuth and mail credentials) get placeholder values.
+"""
+import argparse
+from collections import Counter
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if "BENCHMARK_DATABASE_URL" not in os.environ:
+    sys.exit("Set BENCHMARK_DATABASE_URL to a throwaway database: its tables are dropped when the benchmark finishes.")
+
+os.environ["DATABASE_URL"] = os.environ["BENCHMARK_DATABASE_URL"]
+for key in (
+    "SECRET_KEY",
+    "MAIL_DOMAIN",
+    "SPARKPOST_SMTP_HOST",
+    "SPARKPOST_SMTP_PORT",
+    "SPARKPOST_SMTP_USERNAME",
+    "SPARKPOST_SMTP_PASSWORD",
+    "SPARKPOST_API_KEY",
+    "TRELLO_API_KEY",
+    "TRELLO_API_SECRET",
+    "GITHUB_CLIENT_ID",
+    "GITHUB_CLIENT_SECRET",
+):
+    os.environ.setdefault(key, "benchmark")
+
+from app import db  # noqa: E402
+from app.factory import create_app  # noqa: E402
+from app.outbox import dispatch_commit_statuses  # noqa: E402
+from tests.doubles.scenarios import CardWithPullRequests, PullRequestWithCards  # noqa: E402
+from tests.doubles.stubs import GithubStub, TrelloStub  # noqa: E402
+
+
+SCENARIOS = {
+    "pr_with_1_card": lambda github_stub, trello_stub: PullRequestWithCards(github_stub, trello_stub, 1),
+    "pr_with_10_cards": lambda github_stub, trello_stub: PullRequestWithCards(github_stub, trello_stub, 10),
+    "card_with_100_prs": lambda github_stub, trello_stub: CardWithPullRequests(github_stub, trello_stub, 100),
+}
+
+
+def create_stubbed_app(github_stub, trello_stub):
+    """The app, talking to the stubs, with freshly created tables."""
+    app = create_app()
+    app.config["GITHUB_API_ROOT"] = github_stub.url
+    app.config["TRELLO_API_ROOT"] = trello_stub.url
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    return app
+
+
+def drop_tables(app):
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def run(app, scenario, events, dispatch):
+    """Sends `events` webhooks one after another, returning each one's latency and the response status counts."""
+    client = app.test_client()
+    latencies, statuses = [], Counter()
+    for index in range(events):
+        path, body, headers = scenario.request(index)
+
+        started_at = time.perf_counter()
+        response = client.post(path, json=body, headers=headers)
+        if dispatch:
+            with app.app_context():
+                while dispatch_commit_statuses(app) != (0, 0):
+                    pass
+        latencies.append(time.perf_counter() - started_at)
+
+        statuses[response.status_code] += 1
+
+    return latencies, statuses
+
+
+def report(name, latencies, statuses, stubs):
+    latencies = sorted(latencies)
+    calls = Counter()
+    for stub in stubs:
+        calls.update({(stub.NAME, method, endpoint): count for (method, endpoint), count in stub.calls.items()})
+
+    print(f"{name}: {len(latencies)} events, responses {dict(statuses)}")
+    print(f"  {len(latencies) / sum(latencies):.1f} events/s")
+    print(f"  p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"  {sum(calls.values()) / len(latencies):.2f} upstream calls/event")
+    for (upstream, method, endpoint), count in sorted(calls.items()):
+        print(f"    {count / len(latencies):>8.2f}  {upstream} {method} {endpoint}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5, help="events sent before measuring")
+    parser.add_argument("--latency-ms", type=float, default=50, help="added to every upstream response")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of upstream calls answered with a 502")
+    parser.add_argument("--rate-limit", type=int, help="upstream calls allowed per stub before it rate-limits")
+    parser.add_argument("--checklists", action="store_true", help="enable the checklist feature for the user")
+    parser.add_argument("--dispatch", action="store_true", help="include posting the queued commit statuses")
+    args = parser.parse_args()
+
+    stub_options = dict(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+    )
+    github_stub, trello_stub = GithubStub(**stub_options).start(), TrelloStub(**stub_options).start()
+
+    app = create_stubbed_app(github_stub, trello_stub)
+    try:
+        scenario = SCENARIOS[args.scenario](github_stub, trello_stub)
+        with app.app_context():
+            scenario.seed(args.checklists)
+
+        run(app, scenario, args.warmup, args.dispatch)
+        github_stub.reset_calls()
+        trello_stub.reset_calls()
+
+        latencies, statuses = run(app, scenario, args.events, args.dispatch)
+        report(args.scenario, latencies, statuses, (github_stub, trello_stub))
+
+    finally:
+        drop_tables(app)
+        github_stub.stop()
+        trello_stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+gunicorn settings for the web process.
+
+Each worker is a separate process, so Prometheus metrics are written to files in `prometheus_multiproc_dir` and
+aggregated by `/metrics` (see `app.metrics`). The directory is emptied when gunicorn starts so samples from a previous
+run aren't reported, and a worker's live gauges are dropped when it exits.
+"""
+import os
+import shutil
+import tempfile
+
+# prometheus_client picks between single- and multi-process metric values when it's first imported, so this must be set
+# before anything imports it.
+os.environ.setdefault("prometheus_multiproc_dir", os.path.join(tempfile.gettempdir(), "github-signoff-metrics"))
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    metrics_dir = os.environ["prometheus_multiproc_dir"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,27 @@
+"""Record which webhook triggered each outbound commit status, and when it arrived
+
+Revision ID: 10
+Revises: 9
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "10"
+down_revision = "9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Both stay null for statuses not written in response to a webhook (e.g. recomputes and reconciles).
+    op.add_column("outbound_commit_status", sa.Column("triggered_by", sa.Text(), nullable=True))
+    op.add_column("outbound_commit_status", sa.Column("triggered_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("outbound_commit_status", "triggered_at")
+    op.drop_column("outbound_commit_status", "triggered_by")
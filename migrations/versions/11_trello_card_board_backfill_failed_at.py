@@ -0,0 +1,25 @@
+"""Mark cards whose board couldn't be backfilled
+
+Revision ID: 11
+Revises: 10
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "11"
+down_revision = "10"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nullable without a default, so only the catalog changes: trello_card isn't rewritten.
+    op.add_column("trello_card", sa.Column("board_backfill_failed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("trello_card", "board_backfill_failed_at")
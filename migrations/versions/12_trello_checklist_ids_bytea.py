@@ -0,0 +1,174 @@
+"""Store the Trello object IDs of the large tables as 12-byte bytea, online
+
+Revision ID: 12
+Revises: 11
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "12"
+down_revision = "11"
+branch_labels = None
+depends_on = None
+
+
+# The columns left as text by migration 8, as these tables grow with webhook traffic: trello_checkitem has a row per
+# pull request per card. Changing their type in place would rewrite each table under an ACCESS EXCLUSIVE lock, so each
+# column gets a bytea twin instead, which a trigger keeps in step with the running app's writes while existing rows are
+# copied over in small batches. The twins are then swapped in by a short transaction that only changes the catalog.
+COLUMNS = {
+    "trello_card": ["board_id"],
+    "trello_checklist": ["id"],
+    "trello_checkitem": ["id", "checklist_id"],
+}
+
+BATCH_SIZE = 5000
+
+
+def _twin(column):
+    return f"{column}_bytea"
+
+
+def _sync_function(table):
+    return f"{table}_sync_bytea_ids"
+
+
+def upgrade():
+    # A card's board is only ever recorded from Trello, but one that isn't a Trello object ID is left null (for
+    # `flask backfill-card-boards` to look up again) rather than failing the migration. Checklist and checkitem IDs that
+    # aren't fail it at the NOT NULL checks, before anything is swapped.
+    op.execute(
+        """
+        CREATE FUNCTION trello_object_id(value text) RETURNS bytea IMMUTABLE LANGUAGE sql AS $$
+            SELECT CASE WHEN value ~ '^[0-9a-fA-F]{24}$' THEN decode(value, 'hex') END
+        $$
+        """
+    )
+
+    # 1. Expand: nullable columns without a default only change the catalog.
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.add_column(table, sa.Column(_twin(column), postgresql.BYTEA(), nullable=True))
+
+        assignments = "; ".join(f"NEW.{_twin(column)} := trello_object_id(NEW.{column})" for column in columns)
+        op.execute(
+            f"""
+            CREATE FUNCTION {_sync_function(table)}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                {assignments};
+                RETURN NEW;
+            END
+            $$
+            """
+        )
+        op.execute(
+            f"""
+            CREATE TRIGGER {_sync_function(table)} BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {_sync_function(table)}()
+            """
+        )
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+
+        # 2. Backfill the rows written before the trigger existed, a batch at a time so no transaction holds row locks
+        # for long. Keyed on each table's (text) primary key, in the database's own ordering of it.
+        for table, columns in COLUMNS.items():
+            assignments = ", ".join(f"{_twin(column)} = trello_object_id({table}.{column})" for column in columns)
+            last_id = ""
+            while last_id is not None:
+                last_id = connection.execute(
+                    sa.text(
+                        f"""
+                        WITH batch AS (SELECT id FROM {table} WHERE id > :last_id ORDER BY id LIMIT :batch_size),
+                        updated AS (
+                            UPDATE {table} SET {assignments} FROM batch WHERE {table}.id = batch.id
+                            RETURNING {table}.id
+                        )
+                        SELECT max(id) FROM updated
+                        """
+                    ),
+                    last_id=last_id,
+                    batch_size=BATCH_SIZE,
+                ).scalar()
+
+        # 3. Build the twins' indexes and NOT NULL checks without blocking writes. A validated CHECK lets SET NOT NULL
+        # skip its table scan.
+        op.create_index(
+            "trello_checklist_id_bytea_key", "trello_checklist", ["id_bytea"], unique=True, postgresql_concurrently=True
+        )
+        op.create_index(
+            "trello_checkitem_id_bytea_key", "trello_checkitem", ["id_bytea"], unique=True, postgresql_concurrently=True
+        )
+        op.create_index(
+            "uix_checklist_id_bytea_pull_request_id",
+            "trello_checkitem",
+            ["checklist_id_bytea", "pull_request_id"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_trello_card_board_id_bytea", "trello_card", ["board_id_bytea"], postgresql_concurrently=True
+        )
+        for table, column in [
+            ("trello_checklist", "id"),
+            ("trello_checkitem", "id"),
+            ("trello_checkitem", "checklist_id"),
+        ]:
+            op.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_{_twin(column)}_not_null "
+                f"CHECK ({_twin(column)} IS NOT NULL) NOT VALID"
+            )
+            op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{_twin(column)}_not_null")
+
+    # 4. Swap, in one transaction that only changes the catalog: the old columns' constraints and indexes go with them,
+    # and the twins' indexes are promoted in their place.
+    op.drop_constraint("fk_trello_checkitem_trello_checklist_id", "trello_checkitem", type_="foreignkey")
+    for table, columns in COLUMNS.items():
+        op.execute(f"DROP TRIGGER {_sync_function(table)} ON {table}")
+        op.execute(f"DROP FUNCTION {_sync_function(table)}()")
+        for column in columns:
+            op.drop_column(table, column)
+            op.alter_column(table, _twin(column), new_column_name=column)
+    op.execute("DROP FUNCTION trello_object_id(text)")
+
+    for table, column in [("trello_checklist", "id"), ("trello_checkitem", "id"), ("trello_checkitem", "checklist_id")]:
+        op.alter_column(table, column, nullable=False)
+        op.drop_constraint(f"{table}_{_twin(column)}_not_null", table, type_="check")
+
+    for table in ("trello_checklist", "trello_checkitem"):
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY USING INDEX {table}_id_bytea_key")
+    op.execute(
+        "ALTER TABLE trello_checkitem ADD CONSTRAINT uix_checklist_id_pull_request_id "
+        "UNIQUE USING INDEX uix_checklist_id_bytea_pull_request_id"
+    )
+    op.execute("ALTER INDEX ix_trello_card_board_id_bytea RENAME TO ix_trello_card_board_id")
+    op.execute(
+        "ALTER TABLE trello_checkitem ADD CONSTRAINT fk_trello_checkitem_trello_checklist_id "
+        "FOREIGN KEY (checklist_id) REFERENCES trello_checklist (id) ON DELETE CASCADE NOT VALID"
+    )
+
+    # 5. Check the existing rows against the foreign key, which doesn't block writes.
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE trello_checkitem VALIDATE CONSTRAINT fk_trello_checkitem_trello_checklist_id")
+
+
+def downgrade():
+    # Rewrites the tables in place, under an ACCESS EXCLUSIVE lock.
+    op.drop_constraint("fk_trello_checkitem_trello_checklist_id", "trello_checkitem", type_="foreignkey")
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.alter_column(table, column, type_=sa.Text(), postgresql_using=f"encode({column}, 'hex')")
+    op.create_foreign_key(
+        "fk_trello_checkitem_trello_checklist_id",
+        "trello_checkitem",
+        "trello_checklist",
+        ["checklist_id"],
+        ["id"],
+        ondelete="cascade",
+    )
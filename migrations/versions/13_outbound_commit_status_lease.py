@@ -0,0 +1,24 @@
+"""Lease commit statuses apart from when they're due
+
+Revision ID: 13
+Revises: 12
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "13"
+down_revision = "12"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("outbound_commit_status", sa.Column("leased_until", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("outbound_commit_status", "leased_until")
@@ -0,0 +1,24 @@
+"""Add reconciliation cursor to github_repo
+
+Revision ID: 2
+Revises: 1
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2"
+down_revision = "1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("github_repo", sa.Column("reconciled_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("github_repo", "reconciled_at")
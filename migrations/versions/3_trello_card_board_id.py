@@ -0,0 +1,28 @@
+"""Persist the board each trello_card is on
+
+Revision ID: 3
+Revises: 2
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3"
+down_revision = "2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing cards are backfilled as they are next hydrated (on any pull request or card event), or by
+    # `flask backfill-card-boards`.
+    op.add_column("trello_card", sa.Column("board_id", sa.Text(), nullable=True))
+    op.create_index(op.f("ix_trello_card_board_id"), "trello_card", ["board_id"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_trello_card_board_id"), table_name="trello_card")
+    op.drop_column("trello_card", "board_id")
@@ -0,0 +1,53 @@
+"""Add outbound_commit_status outbox table
+
+Revision ID: 5
+Revises: 4
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5"
+down_revision = "4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "outbound_commit_status",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("repo_id", sa.Integer(), nullable=False),
+        sa.Column("sha", sa.Text(), nullable=False),
+        sa.Column("context", sa.Text(), nullable=False),
+        sa.Column("statuses_url", sa.Text(), nullable=False),
+        sa.Column("state", sa.Text(), nullable=False),
+        sa.Column("description", sa.Text(), nullable=False),
+        sa.Column("target_url", sa.Text(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("send_after", sa.DateTime(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["repo_id"], ["github_repo.id"], name="fk_outbound_commit_status_github_repo_id", ondelete="cascade"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("repo_id", "sha", "context", name="uix_outbound_commit_status_repo_id_sha_context"),
+    )
+    op.create_index(
+        "ix_outbound_commit_status_unsent_send_after",
+        "outbound_commit_status",
+        ["send_after"],
+        unique=False,
+        postgresql_where=sa.text("sent_at IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_outbound_commit_status_unsent_send_after", table_name="outbound_commit_status")
+    op.drop_table("outbound_commit_status")
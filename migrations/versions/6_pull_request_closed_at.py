@@ -0,0 +1,27 @@
+"""Record when pull requests were closed
+
+Revision ID: 6
+Revises: 5
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "6"
+down_revision = "5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing closed pull requests pick this up (and become eligible for purging) the next time they are synced.
+    op.add_column("pull_request", sa.Column("closed_at", sa.DateTime(), nullable=True))
+    op.create_index(op.f("ix_pull_request_closed_at"), "pull_request", ["closed_at"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_pull_request_closed_at"), table_name="pull_request")
+    op.drop_column("pull_request", "closed_at")
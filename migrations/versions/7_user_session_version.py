@@ -0,0 +1,24 @@
+"""Add session_version to user
+
+Revision ID: 7
+Revises: 6
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7"
+down_revision = "6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("user", sa.Column("session_version", sa.Integer(), server_default="0", nullable=False))
+
+
+def downgrade():
+    op.drop_column("user", "session_version")
@@ -0,0 +1,58 @@
+"""Store Trello object IDs as 12-byte bytea
+
+Revision ID: 8
+Revises: 7
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "8"
+down_revision = "7"
+branch_labels = None
+depends_on = None
+
+
+# Columns holding Trello's 24-character hex object IDs. Only the tables written when a sign-off check is set up are
+# converted: boards and lists are stored only for sign-off checks, so these hold a row or two per check.
+#
+# trello_checkitem (a row per pull request per card), the trello_checklist IDs it references and trello_card.board_id
+# (a row per linked card) grow with webhook traffic, and an in-place type change rewrites the whole table under an
+# ACCESS EXCLUSIVE lock, so they stay as text. trello_card.id is a short link, not an object ID, so is text anyway.
+TRELLO_OBJECT_ID_COLUMNS = [
+    ("trello_board", "id"),
+    ("trello_list", "id"),
+    ("product_signoff", "trello_board_id"),
+    ("product_signoff", "trello_list_id"),
+]
+
+# (name, source table, referent table, local column) - all `ondelete="cascade"`.
+FOREIGN_KEYS = [
+    ("fk_product_signoff_trello_board_id", "product_signoff", "trello_board", "trello_board_id"),
+    ("fk_product_signoff_trello_list_id", "product_signoff", "trello_list", "trello_list_id"),
+]
+
+
+def _convert_columns(type_, using):
+    # Both sides of a foreign key have to change type together, so the constraints are dropped and then rebuilt.
+    for name, source, _, _ in FOREIGN_KEYS:
+        op.drop_constraint(name, source, type_="foreignkey")
+
+    for table, column in TRELLO_OBJECT_ID_COLUMNS:
+        op.alter_column(table, column, type_=type_, postgresql_using=using.format(column=column))
+
+    for name, source, referent, local_column in FOREIGN_KEYS:
+        op.create_foreign_key(name, source, referent, [local_column], ["id"], ondelete="cascade")
+
+
+def upgrade():
+    # These tables hold a row or two per sign-off check (see above), so rewriting them in place is quick.
+    _convert_columns(postgresql.BYTEA(), "decode({column}, 'hex')")
+
+
+def downgrade():
+    _convert_columns(sa.Text(), "encode({column}, 'hex')")
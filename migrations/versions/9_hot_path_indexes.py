@@ -0,0 +1,36 @@
+"""Index the foreign keys used on webhook and dashboard hot paths
+
+Revision ID: 9
+Revises: 8
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9"
+down_revision = "8"
+branch_labels = None
+depends_on = None
+
+
+# (table, column) - each gets a plain `ix_<table>_<column>` index.
+INDEXES = [
+    ("github_repo", "integration_id"),
+    ("pull_request_trello_card", "pull_request_id"),
+    ("trello_checkitem", "pull_request_id"),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, but doesn't block writes while it builds.
+    with op.get_context().autocommit_block():
+        for table, column in INDEXES:
+            op.create_index(op.f(f"ix_{table}_{column}"), table, [column], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, column in INDEXES:
+            op.drop_index(op.f(f"ix_{table}_{column}"), table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+# `app.config` reads these on import. Everything but the database gets a placeholder; the database's tables are created
+# and dropped around each test that uses them, so point TEST_DATABASE_URL at a throwaway database.
+os.environ["FLASK_ENV"] = "test"
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL", "postgresql://localhost/signoff_test")
+# Login links are encrypted with it, so it must be a Fernet key.
+os.environ.setdefault("SECRET_KEY", "c2lnbm9mZi10ZXN0cy1ub3QtYS1zZWNyZXQta2V5ISE=")
+for key in (
+    "MAIL_DOMAIN",
+    "SPARKPOST_SMTP_HOST",
+    "SPARKPOST_SMTP_PORT",
+    "SPARKPOST_SMTP_USERNAME",
+    "SPARKPOST_SMTP_PASSWORD",
+    "SPARKPOST_API_KEY",
+    "TRELLO_API_KEY",
+    "TRELLO_API_SECRET",
+    "GITHUB_CLIENT_ID",
+    "GITHUB_CLIENT_SECRET",
+):
+    os.environ.setdefault(key, "test")
+
+from app import db as _db  # noqa: E402
+from app.auth import create_login_token  # noqa: E402
+from app.factory import create_app  # noqa: E402
+from tests.doubles.scenarios import Scenario  # noqa: E402
+from tests.doubles.stubs import GithubStub, StubTransport, TrelloStub  # noqa: E402
+
+
+@pytest.fixture
+def github_stub():
+    return GithubStub()
+
+
+@pytest.fixture
+def trello_stub():
+    return TrelloStub()
+
+
+@pytest.fixture
+def app(github_stub, trello_stub):
+    """The app, with GitHub and Trello answered by the stubs (which count every call)."""
+    app = create_app()
+    app.config.update(SERVER_NAME="signoff.test", SQLALCHEMY_ECHO=False, WTF_CSRF_ENABLED=False)
+    app.extensions["upstream_transport"] = StubTransport(github_stub, trello_stub)
+
+    return app
+
+
+@pytest.fixture
+def db(app):
+    """
+    The app's tables, freshly created. No app context is left pushed, as requests would share it (along with its
+    session and `g`), so seed and check the database inside `app.app_context()`.
+    """
+    with app.app_context():
+        _db.drop_all()
+        _db.create_all()
+
+    yield _db
+
+    with app.app_context():
+        _db.session.remove()
+        _db.drop_all()
+        _db.get_engine(app).dispose()
+
+
+@pytest.fixture
+def seed_scenario(app, db, github_stub, trello_stub):
+    """
+    Seeds a scenario from `tests.doubles.scenarios` (built with any extra arguments, e.g. how many cards) in the
+    database and stubs, and returns it. The base `Scenario` is a user with a connected repository and sign-off board.
+    """
+
+    def _seed_scenario(scenario_class=Scenario, *args, checklists=False):
+        scenario = scenario_class(github_stub, trello_stub, *args)
+        with app.app_context():
+            scenario.seed(checklists=checklists)
+
+        return scenario
+
+    return _seed_scenario
+
+
+@pytest.fixture
+def log_in(app, db):
+    """Logs a test client in as the user with an email address, through the login link as a user would."""
+
+    def _log_in(client, email):
+        with app.app_context():
+            payload = create_login_token(app, db, email)
+            db.session.commit()
+
+        response = client.post(f"/login/{payload}")
+        assert response.status_code == 302, response.get_data(as_text=True)
+
+        return client
+
+    return _log_in
@@ -0,0 +1,3 @@
+"""
+Test doubles for GitHub and Trello: stub APIs, the payloads they serve and seeded scenarios. Benchmarks use them too.
+"""
@@ -0,0 +1,125 @@
+"""
+Builders for GitHub and Trello payloads, shaped like what the real APIs and webhooks send (trimmed to the fields we
+read, plus enough of the rest to keep parsing costs realistic).
+"""
+from datetime import datetime, timedelta
+import uuid
+
+from app.constants import GITHUB_DATETIME_FORMAT
+
+
+CREATED_AT = datetime(2018, 10, 1, 9, 30)
+
+
+def _timestamp(offset_minutes=0):
+    return (CREATED_AT + timedelta(minutes=offset_minutes)).strftime(GITHUB_DATETIME_FORMAT)
+
+
+def github_repo(repo_id, fullname, api_root):
+    owner, name = fullname.split("/")
+    return {
+        "id": repo_id,
+        "name": name,
+        "full_name": fullname,
+        "private": False,
+        "owner": {"login": owner, "id": repo_id * 10, "type": "Organization"},
+        "html_url": f"https://github.com/{fullname}",
+        "url": f"{api_root}/repos/{fullname}",
+        "default_branch": "master",
+        "permissions": {"admin": True, "push": True, "pull": True},
+    }
+
+
+def github_pull_request(repo, number, body, api_root, state="open"):
+    sha = f"{repo['id']:08x}{number:032x}"
+    return {
+        "id": repo["id"] * 100000 + number,
+        "number": number,
+        "state": state,
+        "title": f"Benchmark pull request #{number}",
+        "body": body,
+        "user": {"login": "benchmark-bot", "id": 1},
+        "html_url": f"https://github.com/{repo['full_name']}/pull/{number}",
+        "url": f"{api_root}/repos/{repo['full_name']}/pulls/{number}",
+        "statuses_url": f"{api_root}/repos/{repo['full_name']}/statuses/{sha}",
+        "created_at": _timestamp(),
+        "updated_at": _timestamp(number),
+        "closed_at": _timestamp(number) if state == "closed" else None,
+        "merged_at": None,
+        "head": {"label": f"benchmark:branch-{number}", "ref": f"branch-{number}", "sha": sha, "repo": repo},
+        "base": {"label": "benchmark:master", "ref": "master", "sha": "0" * 40, "repo": repo},
+    }
+
+
+def github_pull_request_event(pull_request, action="edited"):
+    """A `pull_request` webhook delivery body."""
+    return {
+        "action": action,
+        "number": pull_request["number"],
+        "pull_request": pull_request,
+        "repository": pull_request["head"]["repo"],
+        "sender": {"login": "benchmark-bot", "id": 1},
+    }
+
+
+def github_ping_event(repo, hook_id=1):
+    """A `ping` webhook delivery body, as GitHub sends when a hook is created."""
+    return {
+        "zen": "Keep it logically awesome.",
+        "hook_id": hook_id,
+        "repository": repo,
+        "sender": {"login": "benchmark-bot", "id": 1},
+    }
+
+
+def github_webhook_headers(event="pull_request"):
+    return {"X-GitHub-Event": event, "X-GitHub-Delivery": str(uuid.uuid4()), "Content-Type": "application/json"}
+
+
+def trello_board(index):
+    return {"id": f"{0xB0A4D:08x}{index:016x}", "name": f"Benchmark board {index}"}
+
+
+def trello_list(board, index):
+    return {"id": f"{0x7157:08x}{index:016x}", "name": f"Benchmark list {index}", "idBoard": board["id"]}
+
+
+def trello_card(index, board, trello_list):
+    """A card as returned by `GET /cards/{id}` with the board, list and card fields we ask for."""
+    return {
+        "id": f"{0xCA4D:08x}{index:016x}",
+        "shortLink": f"bench{index:04d}",
+        "name": f"Benchmark card {index}",
+        "board": {"id": board["id"], "name": board["name"]},
+        "list": {"id": trello_list["id"], "name": trello_list["name"], "idBoard": board["id"]},
+    }
+
+
+def trello_card_url(card):
+    return f"https://trello.com/c/{card['shortLink']}/{card['name'].lower().replace(' ', '-')}"
+
+
+def trello_update_card_action(card, list_before, list_after, action_index=0):
+    """An `updateCard` webhook delivery body for a card moved between lists."""
+    return {
+        "model": {"id": card["board"]["id"], "name": card["board"]["name"]},
+        "action": {
+            "id": f"{0xAC7:08x}{action_index:016x}",
+            "idMemberCreator": "0" * 24,
+            "type": "updateCard",
+            "date": _timestamp(action_index),
+            "data": {
+                "card": {
+                    "id": card["id"],
+                    "shortLink": card["shortLink"],
+                    "name": card["name"],
+                    "idList": list_after["id"],
+                },
+                "board": card["board"],
+                "listBefore": {"id": list_before["id"], "name": list_before["name"]},
+                "listAfter": {"id": list_after["id"], "name": list_after["name"]},
+                "old": {"idList": list_before["id"]},
+            },
+            "memberCreator": {"id": "0" * 24, "username": "benchmark-pm", "fullName": "Benchmark PM"},
+        },
+    }
@@ -0,0 +1,123 @@
+"""
+Seeded users, repositories and cards with the webhook deliveries that exercise them, shared by the benchmarks and the
+tests. Seeding needs an app context; the stubs get the GitHub and Trello side of each scenario.
+"""
+from app import db
+from app.models import (
+    GithubIntegration,
+    GithubRepo,
+    ProductSignoff,
+    PullRequest,
+    PullRequestTrelloCard,
+    TrelloBoard,
+    TrelloCard,
+    TrelloIntegration,
+    TrelloList,
+    User,
+)
+from tests.doubles import payloads
+
+
+REPO_ID = 1001
+REPO_FULLNAME = "benchmark/signoff"
+
+
+class Scenario:
+    """
+    Seeds the database and stubs, then builds the `(path, json, headers)` webhook request for each event.
+
+    On its own: a user with a connected repository and sign-off board, and nothing to sync yet.
+    """
+
+    def __init__(self, github_stub, trello_stub):
+        self.github_stub = github_stub
+        self.trello_stub = trello_stub
+        self.board = payloads.trello_board(1)
+        self.in_review_list = payloads.trello_list(self.board, 1)
+        self.signoff_list = payloads.trello_list(self.board, 2)
+        self.repo = payloads.github_repo(REPO_ID, REPO_FULLNAME, github_stub.url)
+
+    def seed(self, checklists):
+        user = User(email="benchmark@example.com", active=True, checklist_feature_enabled=checklists)
+        user.github_integration = GithubIntegration(oauth_state="benchmark", oauth_token="benchmark")
+        user.trello_integration = TrelloIntegration(oauth_token="benchmark")
+        db.session.add(user)
+        db.session.flush()
+        self.user_id = user.id
+
+        db.session.add(GithubRepo(id=REPO_ID, fullname=REPO_FULLNAME, integration_id=user.id, hook_id="1"))
+        db.session.add(
+            ProductSignoff(
+                user_id=user.id,
+                trello_board=TrelloBoard(id=self.board["id"]),
+                trello_list=TrelloList(id=self.signoff_list["id"]),
+            )
+        )
+        self.github_stub.add_repo(self.repo)
+        db.session.commit()
+
+    def request(self, index):
+        """GitHub's `ping`, the only delivery a repository without pull requests gets."""
+        return (
+            "/github/integration/callback",
+            payloads.github_ping_event(self.repo),
+            payloads.github_webhook_headers(event="ping"),
+        )
+
+
+class PullRequestWithCards(Scenario):
+    def __init__(self, github_stub, trello_stub, card_count):
+        super().__init__(github_stub, trello_stub)
+        self.link_cards([payloads.trello_card(index, self.board, self.in_review_list) for index in range(card_count)])
+
+    def link_cards(self, cards):
+        """Rewrites the pull request's body to link exactly `cards`."""
+        self.cards = cards
+        body = "Product sign-off:\n" + "\n".join(f"* {payloads.trello_card_url(card)}" for card in cards)
+        self.pull_request = payloads.github_pull_request(self.repo, 1, body, self.github_stub.url)
+        for card in cards:
+            self.trello_stub.add_card(card)
+        self.github_stub.add_pull_request(REPO_FULLNAME, self.pull_request)
+
+    def request(self, index):
+        return (
+            "/github/integration/callback",
+            payloads.github_pull_request_event(self.pull_request, action="opened" if index == 0 else "edited"),
+            payloads.github_webhook_headers(),
+        )
+
+
+class CardWithPullRequests(Scenario):
+    def __init__(self, github_stub, trello_stub, pull_request_count):
+        super().__init__(github_stub, trello_stub)
+        self.card = payloads.trello_card(0, self.board, self.in_review_list)
+        body = f"Product sign-off: {payloads.trello_card_url(self.card)}"
+        self.pull_requests = [
+            payloads.github_pull_request(self.repo, number, body, github_stub.url)
+            for number in range(1, pull_request_count + 1)
+        ]
+
+    def seed(self, checklists):
+        super().seed(checklists)
+        self.trello_stub.add_card(self.card)
+        db.session.add(TrelloCard(id=self.card["shortLink"], board_id=self.board["id"]))
+        for data in self.pull_requests:
+            self.github_stub.add_pull_request(REPO_FULLNAME, data)
+            db.session.add(PullRequest(id=data["id"], number=data["number"], repo_id=REPO_ID))
+        db.session.flush()
+
+        db.session.add_all(
+            PullRequestTrelloCard(card_id=self.card["shortLink"], pull_request_id=data["id"])
+            for data in self.pull_requests
+        )
+        db.session.commit()
+
+    def request(self, index):
+        # Alternate the card between lists, so statuses flip between pending and success.
+        list_before, list_after = (self.in_review_list, self.signoff_list)[:: 1 if index % 2 == 0 else -1]
+        self.card["list"] = {"id": list_after["id"], "name": list_after["name"], "idBoard": self.board["id"]}
+        return (
+            "/trello/integration",
+            payloads.trello_update_card_action(self.card, list_before, list_after, action_index=index),
+            {},
+        )
@@ -0,0 +1,391 @@
+"""
+Local HTTP servers standing in for the GitHub and Trello APIs, for the tests and benchmarks.
+
+Each stub serves the endpoints our clients call from an in-memory fixture store, with configurable latency, a random
+error rate and a request quota after which it answers as the real API does when rate-limited. Every request is counted
+per endpoint template, so tests can check (and benchmarks report) upstream calls per event.
+
+Point the app at them with `GITHUB_API_ROOT=<github_stub.url>` and `TRELLO_API_ROOT=<trello_stub.url>`. Tests skip the
+servers: a `StubTransport` hands the clients' requests straight to the stubs instead.
+"""
+from collections import Counter
+import hashlib
+from http.client import responses as HTTP_REASONS
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import random
+import re
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from app.metrics import endpoint_template
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubUpstream:
+    """
+    Base stub: subclasses list `ROUTES` as `(method, path regex, handler method name)`. Handlers take the regex match
+    groups and the parsed request `(query, body)` and return `(status, json_body)`, or `(status, json_body, headers)`.
+    A request whose `If-None-Match` matches the `ETag` a handler answers with gets a 304 instead, as GitHub sends.
+    """
+
+    NAME = None
+    API_ROOT = None
+    PATH_PREFIX = ""
+    ROUTES = []
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, rate_limit_reset=60):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_reset = rate_limit_reset
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._routes = [(method, re.compile(f"^{pattern}$"), name) for method, pattern, name in self.ROUTES]
+        self._server = None
+
+    @property
+    def url(self):
+        """The server's URL once started; until then the real API's, which is what a `StubTransport` answers for."""
+        if not self._server:
+            return self.API_ROOT
+
+        host, port = self._server.server_address
+        return f"http://{host}:{port}{self.PATH_PREFIX}"
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload, headers = stub.handle(self.command, self.path, body, self.headers)
+                data = json.dumps(payload).encode("utf8")
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, name=f"{self.NAME}-stub", daemon=True).start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method, raw_path, body, headers=None):
+        url = urlparse(raw_path)
+        path = url.path[len(self.PATH_PREFIX) :] if url.path.startswith(self.PATH_PREFIX) else url.path
+        with self._lock:
+            self.calls[(method, endpoint_template(self.NAME, url.path))] += 1
+            call_count = sum(self.calls.values())
+
+        if self.latency or self.jitter:
+            time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+        if self.rate_limit is not None and call_count > self.rate_limit:
+            return self.rate_limited()
+
+        if self.error_rate and random.random() < self.error_rate:
+            return 502, {"message": "Stubbed upstream error"}, {}
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        request_body = json.loads(body) if body else {}
+        for route_method, pattern, name in self._routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                status, payload, *extra_headers = getattr(self, name)(*match.groups(), query=query, body=request_body)
+                response_headers = {**self.headers(call_count), **(extra_headers[0] if extra_headers else {})}
+                if "ETag" in response_headers and response_headers["ETag"] == (headers or {}).get("If-None-Match"):
+                    return 304, None, response_headers
+
+                return status, payload, response_headers
+
+        return 404, {"message": f"No stub for {method} {path}"}, {}
+
+    def headers(self, call_count):
+        return {}
+
+    def rate_limited(self):
+        """The response once `rate_limit` requests have been made. Subclasses answer as their API does."""
+        return 429, {"message": "Rate limit exceeded"}, {}
+
+
+class GithubStub(StubUpstream):
+    """
+    Lists are paginated as GitHub does, with a `Link` header to the next page. Pages hold the `per_page` asked for, or
+    at most `page_size` items if that's set, so tests can paginate a handful of items.
+    """
+
+    NAME = "github"
+    API_ROOT = "https://api.github.com"
+    ROUTES = [
+        ("GET", r"/user/repos", "get_user_repos"),
+        ("GET", r"/repos/([^/]+/[^/]+)/pulls/(\d+)", "get_pull_request"),
+        ("GET", r"/repositories/(\d+)", "get_repo"),
+        ("GET", r"/repositories/(\d+)/pulls", "get_pull_requests"),
+        ("POST", r"/repos/([^/]+/[^/]+)/statuses/(\w+)", "create_status"),
+        ("POST", r"/repositories/(\d+)/hooks", "create_hook"),
+        ("DELETE", r"/repositories/(\d+)/hooks/(\d+)", "delete_hook"),
+        ("GET", r"/applications/[^/]+/tokens/[^/]+", "check_token"),
+    ]
+
+    def __init__(self, page_size=None, **kwargs):
+        super().__init__(**kwargs)
+        self.page_size = page_size
+        self.repos = {}
+        self.pull_requests = {}
+        self.statuses = []
+        self.hooks = {}
+        self._next_hook_id = 0
+
+    def _page(self, path, items, query):
+        """Returns the page of `items` that `query` asks for, and the headers linking to the next."""
+        per_page = self.page_size or int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        headers = {}
+        if len(items) > page * per_page:
+            headers["Link"] = f'<{self.url}{path}?{urlencode({**query, "page": page + 1})}>; rel="next"'
+
+        return items[(page - 1) * per_page : page * per_page], headers
+
+    def add_repo(self, repo):
+        self.repos[repo["id"]] = repo
+
+    def add_pull_request(self, repo_fullname, pull_request):
+        self.pull_requests[(repo_fullname, pull_request["number"])] = pull_request
+
+    def add_hook(self, repo_id, hook_id, delete_status=204):
+        """Adds a hook, which answers being deleted with `delete_status` (and is only removed if that's a success)."""
+        self.hooks[(repo_id, str(hook_id))] = delete_status
+
+    def get_user_repos(self, query, body):
+        repos, headers = self._page("/user/repos", sorted(self.repos.values(), key=lambda repo: repo["id"]), query)
+        headers["ETag"] = '"{}"'.format(hashlib.sha1(json.dumps(repos, sort_keys=True).encode("utf8")).hexdigest())
+
+        return 200, repos, headers
+
+    def get_pull_request(self, repo_fullname, number, query, body):
+        pull_request = self.pull_requests.get((repo_fullname, int(number)))
+        return (200, pull_request) if pull_request else (404, {"message": "Not Found"})
+
+    def get_repo(self, repo_id, query, body):
+        repo = self.repos.get(int(repo_id))
+        return (200, repo) if repo else (404, {"message": "Not Found"})
+
+    def get_pull_requests(self, repo_id, query, body):
+        repo = self.repos.get(int(repo_id))
+        if not repo:
+            return 404, {"message": "Not Found"}
+
+        pull_requests = [
+            pr
+            for (fullname, _), pr in self.pull_requests.items()
+            if fullname == repo["full_name"] and query.get("state", "open") in ("all", pr["state"])
+        ]
+        if query.get("sort") == "updated":
+            pull_requests.sort(key=lambda pr: pr["updated_at"], reverse=query.get("direction", "desc") == "desc")
+
+        pull_requests, headers = self._page(f"/repositories/{repo_id}/pulls", pull_requests, query)
+        return 200, pull_requests, headers
+
+    def create_status(self, repo_fullname, sha, query, body):
+        self.statuses.append((repo_fullname, sha, body))
+        return 201, {"state": body.get("state"), "context": body.get("context")}
+
+    def create_hook(self, repo_id, query, body):
+        if int(repo_id) not in self.repos:
+            return 404, {"message": "Not Found"}
+
+        with self._lock:
+            self._next_hook_id += 1
+            hook_id = self._next_hook_id
+        self.add_hook(int(repo_id), hook_id)
+
+        return 201, {"id": hook_id, "events": body.get("events"), "active": body.get("active"), "config": {}}
+
+    def delete_hook(self, repo_id, hook_id, query, body):
+        status = self.hooks.get((int(repo_id), hook_id), 404)
+        if status >= 400:
+            return status, {"message": "Not Found" if status == 404 else "Stubbed upstream error"}
+
+        del self.hooks[(int(repo_id), hook_id)]
+        return status, None
+
+    def check_token(self, query, body):
+        return 200, {"token": "stub"}
+
+    def headers(self, call_count):
+        if self.rate_limit is None:
+            return {}
+
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(max(self.rate_limit - call_count, 0)),
+            "X-RateLimit-Reset": str(int(time.time()) + self.rate_limit_reset),
+        }
+
+    def rate_limited(self):
+        return 403, {"message": "API rate limit exceeded"}, self.headers(self.rate_limit + 1)
+
+
+class TrelloStub(StubUpstream):
+    NAME = "trello"
+    API_ROOT = "https://api.trello.com/1"
+    PATH_PREFIX = "/1"
+    ROUTES = [
+        ("GET", r"/cards/(\w+)", "get_card"),
+        ("GET", r"/checklists/(\w+)", "get_checklist"),
+        ("POST", r"/checklists", "create_checklist"),
+        ("POST", r"/checklists/(\w+)/checkItems", "create_checkitem"),
+        ("PUT", r"/cards/(\w+)/checkItem/(\w+)", "update_checkitem"),
+        ("DELETE", r"/checklists/(\w+)/checkItems/(\w+)", "delete_checkitem"),
+        ("GET", r"/tokens/[^/]+", "check_token"),
+        ("GET", r"/members/me/boards", "get_boards"),
+        ("POST", r"/webhooks", "create_webhook"),
+        ("DELETE", r"/webhooks/(\w+)", "delete_webhook"),
+    ]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.boards = []
+        self.cards = {}
+        self.checklists = {}
+        self.webhooks = {}
+        self._next_id = 0
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return f"{0xBEEF000000000000:016x}{self._next_id:08x}"
+
+    def add_board(self, board, lists):
+        self.boards.append({**board, "lists": lists})
+
+    def add_card(self, card):
+        # Trello answers to a card's short link or its full ID.
+        self.cards[card["shortLink"]] = self.cards[card["id"]] = card
+
+    def get_card(self, card_id, query, body):
+        card = self.cards.get(card_id)
+        return (200, card) if card else (404, "The requested resource was not found.")
+
+    def get_checklist(self, checklist_id, query, body):
+        checklist = self.checklists.get(checklist_id)
+        return (200, checklist) if checklist else (404, "The requested resource was not found.")
+
+    def create_checklist(self, query, body):
+        checklist = {"id": self._new_id(), "name": query.get("name"), "idCard": query.get("idCard"), "checkItems": []}
+        self.checklists[checklist["id"]] = checklist
+        return 200, checklist
+
+    def create_checkitem(self, checklist_id, query, body):
+        checklist = self.checklists.get(checklist_id)
+        if not checklist:
+            return 404, "The requested resource was not found."
+
+        checkitem = {
+            "id": self._new_id(),
+            "name": query.get("name"),
+            "idChecklist": checklist_id,
+            "state": "complete" if query.get("checked") == "true" else "incomplete",
+        }
+        checklist["checkItems"].append(checkitem)
+        return 200, checkitem
+
+    def update_checkitem(self, card_id, checkitem_id, query, body):
+        for checklist in self.checklists.values():
+            for checkitem in checklist["checkItems"]:
+                if checkitem["id"] == checkitem_id:
+                    checkitem["state"] = query.get("state", checkitem["state"])
+                    return 200, checkitem
+
+        return 404, "The requested resource was not found."
+
+    def delete_checkitem(self, checklist_id, checkitem_id, query, body):
+        checklist = self.checklists.get(checklist_id)
+        if checklist:
+            checklist["checkItems"] = [item for item in checklist["checkItems"] if item["id"] != checkitem_id]
+
+        return 200, {}
+
+    def check_token(self, query, body):
+        return 200, {"id": "stub"}
+
+    def get_boards(self, query, body):
+        if query.get("lists") == "all":
+            return 200, self.boards
+
+        return 200, [{key: value for key, value in board.items() if key != "lists"} for board in self.boards]
+
+    def create_webhook(self, query, body):
+        webhook = {"id": self._new_id(), "idModel": query.get("idModel"), "callbackURL": query.get("callbackURL")}
+        self.webhooks[webhook["id"]] = webhook
+        return 200, webhook
+
+    def delete_webhook(self, webhook_id, query, body):
+        return (200, {}) if self.webhooks.pop(webhook_id, None) else (404, "The requested resource was not found.")
+
+    def rate_limited(self):
+        return 429, {"message": "API_TOKEN_LIMIT_EXCEEDED"}, {}
+
+
+class StubTransport:
+    """
+    An upstream transport (see `app.transport`) answering from stubs that haven't been started, in-process and without
+    sockets, for tests. Each request goes to the stub whose `url` has the same host, so leave the app's API roots as
+    they are; calls are still counted by the stubs.
+    """
+
+    def __init__(self, *stubs):
+        self._stubs = {urlparse(stub.url).netloc: stub for stub in stubs}
+
+    def request(self, method, url, secrets=(), **kwargs):
+        parsed = urlparse(url)
+        query = urlencode(parse_qsl(parsed.query) + list((kwargs.get("params") or {}).items()))
+        body = json.dumps(kwargs["json"]).encode("utf8") if kwargs.get("json") is not None else b""
+        status, payload, headers = self._stubs[parsed.netloc].handle(
+            method.upper(), f"{parsed.path}?{query}", body, CaseInsensitiveDict(kwargs.get("headers") or {})
+        )
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = HTTP_REASONS.get(status, "")
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json", **headers})
+        response.encoding = "utf8"
+        response.url = url
+        response._content = json.dumps(payload).encode("utf8")
+
+        return response
@@ -0,0 +1,51 @@
+from flask import Flask
+import pytest
+
+from app.views import require_bearer_token
+
+
+def make_client(admin_token, allow_unset=False, env="development"):
+    app = Flask(__name__)
+    app.config.update(ADMIN_TOKEN=admin_token, FLASK_ENV=env)
+
+    @app.route("/admin")
+    @require_bearer_token("ADMIN_TOKEN", allow_unset=allow_unset)
+    def admin():
+        return "OK"
+
+    return app.test_client()
+
+
+def test_matching_bearer_token_is_let_through():
+    response = make_client("admin-token").get("/admin", headers={"Authorization": "Bearer admin-token"})
+
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"Authorization": "Bearer wrong-token"}, {"Authorization": "admin-token"}, {"Authorization": "Bearer "}],
+)
+def test_missing_or_wrong_bearer_token_is_refused(headers):
+    assert make_client("admin-token").get("/admin", headers=headers).status_code == 401
+
+
+@pytest.mark.parametrize("admin_token", [None, ""])
+def test_everything_is_refused_when_the_token_is_not_configured(admin_token):
+    client = make_client(admin_token)
+
+    assert client.get("/admin").status_code == 401
+    assert client.get("/admin", headers={"Authorization": "Bearer "}).status_code == 401
+    assert client.get("/admin", headers={"Authorization": "Bearer None"}).status_code == 401
+
+
+def test_unconfigured_token_lets_everything_through_with_allow_unset():
+    assert make_client(None, allow_unset=True).get("/admin").status_code == 200
+
+
+def test_unconfigured_token_is_still_refused_in_production_with_allow_unset():
+    assert make_client(None, allow_unset=True, env="production").get("/admin").status_code == 401
+
+
+def test_configured_token_is_still_required_with_allow_unset():
+    assert make_client("admin-token", allow_unset=True).get("/admin").status_code == 401
@@ -0,0 +1,125 @@
+"""
+The GitHub and Trello calls made by common flows, checked against a per-endpoint budget so changes that multiply
+upstream calls (e.g. re-fetching a card for every pull request linked to it) fail. An endpoint missing from a budget
+mustn't be called at all; raise a budget only deliberately.
+"""
+from collections import Counter
+
+import pytest
+
+from app.outbox import dispatch_commit_statuses
+from tests.doubles import payloads
+from tests.doubles.scenarios import CardWithPullRequests, PullRequestWithCards
+
+
+CARD = ("trello", "GET", "/cards/{id}")
+PULL_REQUEST = ("github", "GET", "/repos/{owner}/{repo}/pulls/{id}")
+
+
+def upstream_calls(*stubs):
+    calls = Counter()
+    for stub in stubs:
+        calls.update({(stub.NAME, method, endpoint): count for (method, endpoint), count in stub.calls.items()})
+
+    return calls
+
+
+def over_budget(calls, budget):
+    return {key: f"{count}/{budget.get(key, 0)}" for key, count in calls.items() if count > budget.get(key, 0)}
+
+
+def post_webhook(client, path, body, headers):
+    response = client.post(path, json=body, headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+
+@pytest.fixture
+def measure(github_stub, trello_stub):
+    """Runs a flow with the stubs' call counts reset beforehand, returning the calls it made."""
+
+    def _measure(flow):
+        github_stub.reset_calls()
+        trello_stub.reset_calls()
+        flow()
+
+        return upstream_calls(github_stub, trello_stub)
+
+    return _measure
+
+
+@pytest.mark.parametrize(
+    "checklists, budget",
+    [
+        # One fetch per linked card, and the commit status is queued rather than posted.
+        (False, {CARD: 10}),
+        (
+            True,
+            {CARD: 10, ("trello", "POST", "/checklists"): 10, ("trello", "POST", "/checklists/{id}/checkItems"): 10},
+        ),
+    ],
+)
+def test_open_pull_request(app, seed_scenario, measure, checklists, budget):
+    scenario = seed_scenario(PullRequestWithCards, 10, checklists=checklists)
+
+    calls = measure(lambda: post_webhook(app.test_client(), *scenario.request(0)))
+
+    assert over_budget(calls, budget) == {}
+
+
+def test_edit_pull_request_body(app, seed_scenario, measure):
+    scenario = seed_scenario(PullRequestWithCards, 10)
+    post_webhook(app.test_client(), *scenario.request(0))
+
+    # Keeps 5 of the cards and links 2 more: only the 7 cards now linked are fetched.
+    new_cards = [payloads.trello_card(index, scenario.board, scenario.in_review_list) for index in (10, 11)]
+    scenario.link_cards(scenario.cards[5:] + new_cards)
+    calls = measure(lambda: post_webhook(app.test_client(), *scenario.request(1)))
+
+    assert over_budget(calls, {CARD: 7}) == {}
+
+
+def test_move_card(app, seed_scenario, measure):
+    scenario = seed_scenario(CardWithPullRequests, 100)
+
+    # Each pull request linking the card is fetched once, and the card itself only once.
+    calls = measure(lambda: post_webhook(app.test_client(), *scenario.request(0)))
+
+    assert over_budget(calls, {CARD: 1, PULL_REQUEST: 100}) == {}
+
+
+def test_post_commit_statuses(app, github_stub, seed_scenario, measure):
+    scenario = seed_scenario(CardWithPullRequests, 100)
+    post_webhook(app.test_client(), *scenario.request(0))
+
+    def dispatch():
+        with app.app_context():
+            while dispatch_commit_statuses(app) != (0, 0):
+                pass
+
+    calls = measure(dispatch)
+
+    assert over_budget(calls, {("github", "POST", "/repos/{owner}/{repo}/statuses/{sha}"): 100}) == {}
+    assert len(github_stub.statuses) == 100
+
+
+def test_load_dashboard(app, trello_stub, seed_scenario, measure, log_in):
+    scenario = seed_scenario()
+    trello_stub.add_board(scenario.board, [scenario.in_review_list, scenario.signoff_list])
+    client = log_in(app.test_client(), "benchmark@example.com")
+
+    def load_dashboard():
+        assert client.get("/dashboard").status_code == 200
+
+    calls = measure(load_dashboard)
+
+    assert (
+        over_budget(
+            calls,
+            {
+                ("github", "GET", "/applications/{client_id}/tokens/{token}"): 1,
+                ("trello", "GET", "/tokens/{token}"): 1,
+                ("trello", "GET", "/members/me/boards"): 1,
+            },
+        )
+        == {}
+    )
@@ -1,5 +1,4 @@
 """
 TESTS TO WRITE:
 * Github and trello tokens validated at the dashboard
-* 
 """
@@ -0,0 +1,51 @@
+import pytest
+
+from app.dtos import GithubRepoData, TrelloBoardData, TrelloListData
+from tests.doubles import payloads
+
+
+def board_json(index=1):
+    board = payloads.trello_board(index)
+    return {**board, "lists": [payloads.trello_list(board, 1), {**payloads.trello_list(board, 2), "closed": True}]}
+
+
+def test_trello_board_is_built_from_json_with_its_lists():
+    board = TrelloBoardData.from_json(board_json())
+
+    assert (board.id, board.name) == (payloads.trello_board(1)["id"], "Benchmark board 1")
+    assert [(trello_list.name, trello_list.board_id, trello_list.closed) for trello_list in board.lists] == [
+        ("Benchmark list 1", board.id, False),
+        ("Benchmark list 2", board.id, True),
+    ]
+
+
+def test_github_repo_is_built_from_json():
+    repo = GithubRepoData.from_json(payloads.github_repo(1001, "owner/repo", "https://api.github.com"))
+
+    assert (repo.id, repo.fullname) == (1001, "owner/repo")
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        TrelloBoardData.from_json(board_json()),
+        TrelloListData.from_json(board_json()["lists"][0]),
+        GithubRepoData(id=1001, fullname="owner/repo"),
+    ],
+)
+def test_value_objects_are_read_only(value):
+    with pytest.raises(AttributeError):
+        value.name = "Renamed"
+    with pytest.raises(AttributeError):
+        value.extra = "Not a field"
+    with pytest.raises(AttributeError):
+        del value.id
+
+
+def test_value_objects_are_equal_when_their_type_and_values_are():
+    board = TrelloBoardData.from_json(board_json())
+
+    assert board == TrelloBoardData.from_json(board_json())
+    assert len({board, TrelloBoardData.from_json(board_json())}) == 1
+    assert board != TrelloBoardData.from_json(board_json(2))
+    assert TrelloListData(id="1", name="1", board_id="1", closed=False) != GithubRepoData(id="1", fullname="1")
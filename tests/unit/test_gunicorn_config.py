@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+
+def test_metrics_are_multiprocess_under_the_gunicorn_config():
+    # In a fresh interpreter, as prometheus_client only picks its value class on first import.
+    env = {key: value for key, value in os.environ.items() if key != "prometheus_multiproc_dir"}
+    value_class = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import gunicorn_config; from prometheus_client import values; print(values.ValueClass.__name__)",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        env=env,
+        universal_newlines=True,
+    )
+
+    assert value_class.strip() == "MmapedValue"
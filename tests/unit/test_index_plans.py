@@ -0,0 +1,107 @@
+"""
+The hot-path lookups by foreign key use the indexes added for them (migration 9) rather than scanning the whole table:
+repositories by `integration_id`, card links by `pull_request_id` and checkitems by `pull_request_id`.
+
+The app's own queries are run through `EXPLAIN (FORMAT JSON)` against tables seeded (and `ANALYZE`d) with enough rows
+that the planner prefers an index on its own merits; `enable_seqscan` is left alone.
+"""
+import pytest
+from sqlalchemy import text
+
+from app.models import GithubRepo, PullRequestTrelloCard, TrelloCheckitem
+
+
+USERS = 500
+
+# Per user: 10 repositories with 10 pull requests each, every pull request linking 2 of the user's 50 cards, each card
+# with our checklist and an item per linked pull request. Trello object IDs are made from the row's number.
+SEED_STATEMENTS = [
+    """
+    INSERT INTO "user" (id, email, active, checklist_feature_enabled)
+    SELECT u, 'user-' || u || '@example.com', true, true FROM generate_series(1, :users) AS u
+    """,
+    """
+    INSERT INTO github_integration (user_id, oauth_state, oauth_token)
+    SELECT u, 'state', 'token-' || u FROM generate_series(1, :users) AS u
+    """,
+    """
+    INSERT INTO github_repo (id, fullname, integration_id, hook_id)
+    SELECT r, 'owner/repo-' || r, (r - 1) / 10 + 1, r::text FROM generate_series(1, :users * 10) AS r
+    """,
+    """
+    INSERT INTO pull_request (id, number, repo_id)
+    SELECT p, (p - 1) % 10 + 1, (p - 1) / 10 + 1 FROM generate_series(1, :users * 100) AS p
+    """,
+    """
+    INSERT INTO trello_card (id, board_id)
+    SELECT 'card' || c, decode(lpad(to_hex((c - 1) / 50 + 1), 24, '0'), 'hex') FROM generate_series(1, :users * 50) AS c
+    """,
+    """
+    INSERT INTO pull_request_trello_card (card_id, pull_request_id)
+    SELECT 'card' || ((p - 1) / 100 * 50 + (p * 2 + n) % 50 + 1), p
+    FROM generate_series(1, :users * 100) AS p, generate_series(0, 1) AS n
+    """,
+    """
+    INSERT INTO trello_checklist (id, card_id)
+    SELECT decode(lpad(to_hex(c), 24, '0'), 'hex'), 'card' || c FROM generate_series(1, :users * 50) AS c
+    """,
+    """
+    INSERT INTO trello_checkitem (id, checklist_id, pull_request_id)
+    SELECT decode(lpad(to_hex(link.pull_request_id), 12, '0') || lpad(substr(link.card_id, 5), 12, '0'), 'hex'),
+        decode(lpad(to_hex(substr(link.card_id, 5)::int), 24, '0'), 'hex'), link.pull_request_id
+    FROM pull_request_trello_card AS link
+    """,
+]
+
+# (table that mustn't be scanned, the app's query against it). IDs are from the middle of the seeded ranges.
+LOOKUPS = {
+    "repos_by_owner": ("github_repo", lambda db: GithubRepo.query.filter(GithubRepo.integration_id == USERS // 2)),
+    "card_links_by_pull_request": (
+        "pull_request_trello_card",
+        lambda db: db.session.query(PullRequestTrelloCard.card_id).filter(
+            PullRequestTrelloCard.pull_request_id == USERS * 50
+        ),
+    ),
+    "checkitems_by_pull_request": (
+        "trello_checkitem",
+        lambda db: db.session.query(TrelloCheckitem.checklist_id, TrelloCheckitem.id).filter(
+            TrelloCheckitem.pull_request_id == USERS * 50
+        ),
+    ),
+}
+
+
+@pytest.fixture
+def seeded(app, db):
+    with app.app_context():
+        for statement in SEED_STATEMENTS:
+            db.session.execute(text(statement), {"users": USERS})
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+        yield db
+
+
+def explain(db, query):
+    """The plan for `query`, as the JSON `EXPLAIN` returns."""
+    sql = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    return db.session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()[0]["Plan"]
+
+
+def scans(plan):
+    """Yields `(node type, relation)` for every node of a plan that reads a table."""
+    if "Relation Name" in plan:
+        yield plan["Node Type"], plan["Relation Name"]
+
+    for subplan in plan.get("Plans", []):
+        yield from scans(subplan)
+
+
+@pytest.mark.parametrize("lookup", LOOKUPS)
+def test_lookup_uses_an_index(seeded, lookup):
+    table, query = LOOKUPS[lookup]
+
+    table_scans = [node_type for node_type, relation in scans(explain(seeded, query(seeded))) if relation == table]
+
+    assert table_scans
+    assert "Seq Scan" not in table_scans
@@ -2,3 +2,240 @@
 TESTS TO WRITE:
 * Github and trello tokens validated on submission
 """
+import re
+import threading
+
+from flask import get_flashed_messages
+from prometheus_client import REGISTRY
+import pytest
+from werkzeug.local import LocalProxy
+
+from app import catalogs, views
+from app.catalogs import get_board_catalog, get_repo_catalog
+from app.metrics import event_context
+from app.models import GithubIntegration, GithubRepo, ProductSignoff, TrelloIntegration, User
+from app.updater import Updater
+from tests.doubles import payloads
+from tests.doubles.scenarios import REPO_FULLNAME, REPO_ID
+
+
+def add_repos(github_stub, repo_ids, admin=True):
+    for repo_id in repo_ids:
+        repo = payloads.github_repo(repo_id, f"benchmark/app-{repo_id}", github_stub.url)
+        repo["permissions"]["admin"] = admin
+        github_stub.add_repo(repo)
+
+
+def shown_repos(response):
+    """`{repo_id: ticked}` for the repositories a choose-repos page offers, and the IDs in its hidden field."""
+    html = response.get_data(as_text=True)
+    checkboxes = re.findall(r'<input ([^>]*name="repo_choice"[^>]*) value="(\d+)">', html)
+    [displayed_repo_ids] = re.findall(r'name="displayed_repo_ids" type="hidden" value="([\d,]*)"', html)
+
+    return {int(repo_id): "checked" in attributes for attributes, repo_id in checkboxes}, displayed_repo_ids
+
+
+def add_board(trello_stub, index):
+    """Adds board `index` (1 being the scenario's board) with its two lists to the stub. Returns the board and lists."""
+    board = payloads.trello_board(index)
+    lists = [payloads.trello_list(board, index * 2 - 1), payloads.trello_list(board, index * 2)]
+    trello_stub.add_board(board, lists)
+
+    return board, lists
+
+
+def repo_catalog_calls(status):
+    labels = {"upstream": "github", "method": "GET", "endpoint": "/user/repos", "status": status, "event": "catalog"}
+    return REGISTRY.get_sample_value("upstream_request_seconds_count", labels) or 0
+
+
+def test_github_ping_is_acknowledged(app, github_stub, trello_stub, seed_scenario):
+    scenario = seed_scenario()
+
+    path, body, headers = scenario.request(0)
+    response = app.test_client().post(path, json=body, headers=headers)
+
+    assert response.status_code == 200
+    assert github_stub.total_calls == trello_stub.total_calls == 0
+
+
+def test_sync_repositories_keeps_repositories_whose_hook_couldnt_be_deleted(app, db, github_stub, seed_scenario):
+    scenario = seed_scenario()
+    with app.app_context():
+        db.session.add_all(
+            GithubRepo(
+                id=repo_id, fullname=f"{REPO_FULLNAME}-{repo_id}", integration_id=scenario.user_id, hook_id=str(repo_id)
+            )
+            for repo_id in (1, 2)
+        )
+        db.session.commit()
+
+    # The seeded repository's hook deletes; the second's is already gone, and GitHub errors deleting the third's.
+    github_stub.add_hook(REPO_ID, 1)
+    github_stub.add_hook(2, 2, delete_status=500)
+
+    with app.test_request_context():
+        Updater(app, db, User.query.one()).sync_repositories(chosen_repo_ids=set())
+        messages = get_flashed_messages(with_categories=True)
+
+    with app.app_context():
+        assert [repo.id for repo in GithubRepo.query.all()] == [2]
+    assert (
+        "error",
+        f"This powerup could not be disconnected from the ‘{REPO_FULLNAME}-2’ repository. Please try again.",
+    ) in messages
+    assert len([category for category, _ in messages if category == "warning"]) == 2
+
+
+def test_sync_repositories_works_for_the_current_user(app, db, github_stub, seed_scenario):
+    seed_scenario()
+    github_stub.add_hook(REPO_ID, 1)
+
+    with app.test_request_context():
+        user = User.query.one()
+        # Like `current_user`, only the request's own thread sees the user.
+        request_thread = threading.get_ident()
+        current_user = LocalProxy(lambda: user if threading.get_ident() == request_thread else None)
+
+        Updater(app, db, current_user).sync_repositories(chosen_repo_ids=set())
+        messages = get_flashed_messages(with_categories=True)
+
+    with app.app_context():
+        assert GithubRepo.query.all() == []
+    assert messages == [("warning", f"This powerup is no longer monitoring the ‘{REPO_FULLNAME}’ repository.")]
+
+
+def test_choose_repos_pages_through_matching_editable_repos(app, db, github_stub, seed_scenario, log_in, monkeypatch):
+    app.config["REPO_PICKER_PAGE_SIZE"] = 2
+    scenario = seed_scenario()
+    with app.app_context():
+        other_user = User(email="other@example.com", active=True)
+        other_user.github_integration = GithubIntegration(oauth_state="other", oauth_token="other")
+        db.session.add(other_user)
+        db.session.flush()
+        db.session.add_all(
+            [
+                GithubRepo(id=2, fullname="benchmark/app-2", integration_id=scenario.user_id, hook_id="2"),
+                GithubRepo(id=6, fullname="benchmark/app-6", integration_id=other_user.id, hook_id="6"),
+            ]
+        )
+        db.session.commit()
+    # Repositories 1-5 match the search; 6 is connected by someone else and 7 isn't administered by the user.
+    add_repos(github_stub, range(1, 7))
+    add_repos(github_stub, [7], admin=False)
+    monkeypatch.setattr(views, "start_background_job", lambda *args, **kwargs: None)
+    client = log_in(app.test_client(), "benchmark@example.com")
+
+    first_page = client.get("/github/choose-repos?q=APP")
+    assert shown_repos(first_page) == ({1: False, 2: True}, "1,2")
+    assert "Page 1 of 3" in first_page.get_data(as_text=True)
+    assert shown_repos(client.get("/github/choose-repos?q=app&page=3")) == ({5: False}, "5")
+
+    # Repository 2 (and the seeded one) aren't on the page submitted, so stay connected though they aren't ticked.
+    response = client.post("/github/choose-repos?q=app&page=2", data={"displayed_repo_ids": "3,4", "repo_choice": [3]})
+
+    assert response.status_code == 302
+    with app.app_context():
+        connected_repos = GithubRepo.query.filter(GithubRepo.integration_id == scenario.user_id)
+        assert {repo.id for repo in connected_repos} == {REPO_ID, 2, 3}
+    assert (3, "1") in github_stub.hooks
+
+
+def test_repo_catalog_reuses_pages_github_says_are_unchanged(app, db, github_stub, seed_scenario):
+    github_stub.page_size = 2
+    seed_scenario()
+    add_repos(github_stub, [1, 2])
+
+    def catalog(refresh=False):
+        with app.test_request_context(), event_context("catalog"):
+            return [repo["id"] for repo in get_repo_catalog(User.query.one(), refresh=refresh)]
+
+    calls_before = repo_catalog_calls("200"), repo_catalog_calls("304")
+    assert catalog() == [1, 2, REPO_ID]
+    assert catalog() == [1, 2, REPO_ID]
+    assert (repo_catalog_calls("200"), repo_catalog_calls("304")) == (calls_before[0] + 2, calls_before[1])
+
+    # Only the second page has changed, so only it is downloaded again.
+    add_repos(github_stub, [3])
+    assert catalog(refresh=True) == [1, 2, 3, REPO_ID]
+    assert (repo_catalog_calls("200"), repo_catalog_calls("304")) == (calls_before[0] + 3, calls_before[1] + 1)
+
+    # A new token can see different repositories, so nothing is reused.
+    with app.app_context():
+        GithubIntegration.query.update({"oauth_token": "new-token"})
+        db.session.commit()
+    assert catalog() == [1, 2, 3, REPO_ID]
+    assert (repo_catalog_calls("200"), repo_catalog_calls("304")) == (calls_before[0] + 5, calls_before[1] + 1)
+
+
+def test_board_catalog_is_fetched_once_per_click_through_and_evicted_by_sign_off_changes(
+    app, trello_stub, seed_scenario, log_in, monkeypatch
+):
+    scenario = seed_scenario()
+    add_board(trello_stub, 1)
+    board, [_, signoff_list] = add_board(trello_stub, 2)
+    monkeypatch.setattr(views, "start_background_job", lambda *args, **kwargs: None)
+    client = log_in(app.test_client(), "benchmark@example.com")
+
+    def board_fetches():
+        return trello_stub.calls["GET", "/members/me/boards"]
+
+    for path in ("/trello/product-signoff", "/trello/choose-board", f"/signoff/choose-list?board_id={board['id']}"):
+        assert client.get(path).status_code == 200
+    assert board_fetches() == 1
+
+    response = client.post(f"/signoff/choose-list?board_id={board['id']}", data={"list_choice": signoff_list["id"]})
+    assert response.status_code == 302
+    assert client.get("/trello/choose-board").status_code == 200
+    assert board_fetches() == 2
+
+    with app.app_context():
+        signoff_id = ProductSignoff.query.filter(ProductSignoff.trello_board_id == scenario.board["id"]).one().id
+    assert client.post(f"/trello/product-signoff/{signoff_id}/delete").status_code == 302
+    assert client.get("/trello/choose-board").status_code == 200
+    assert board_fetches() == 3
+
+
+@pytest.mark.parametrize("path", ["/trello/product-signoff", "/trello/choose-board"])
+def test_board_pickers_send_users_without_a_trello_integration_to_the_dashboard(
+    app, db, trello_stub, seed_scenario, log_in, path
+):
+    seed_scenario()
+    with app.app_context():
+        TrelloIntegration.query.delete()
+        db.session.commit()
+    client = log_in(app.test_client(), "benchmark@example.com")
+
+    response = client.get(path)
+
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/dashboard")
+    assert trello_stub.total_calls == 0
+
+
+def test_stale_board_catalog_is_served_while_one_background_refresh_runs(app, trello_stub, seed_scenario, monkeypatch):
+    app.config.update(BOARD_CATALOG_TTL=0, BOARD_CATALOG_MAX_STALENESS=600)
+    scenario = seed_scenario()
+    add_board(trello_stub, 1)
+    refreshes = []
+    monkeypatch.setattr(catalogs, "start_background_job", lambda *args, **kwargs: refreshes.append((args, kwargs)))
+
+    def board_ids():
+        with app.test_request_context():
+            return [board["id"] for board in get_board_catalog(User.query.one())]
+
+    assert board_ids() == [scenario.board["id"]]
+    new_board, _ = add_board(trello_stub, 2)
+
+    # Stale from the start, so served from the cache while a refresh is started; only one is started at a time.
+    assert board_ids() == [scenario.board["id"]]
+    assert board_ids() == [scenario.board["id"]]
+    assert trello_stub.calls["GET", "/members/me/boards"] == 1
+    [((_, refresh), kwargs)] = refreshes
+
+    with app.app_context():
+        refresh(app, **kwargs)
+    app.config["BOARD_CATALOG_TTL"] = 600
+
+    assert board_ids() == [scenario.board["id"], new_board["id"]]
+    assert trello_stub.calls["GET", "/members/me/boards"] == 2
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+
+from app import jobs
+from app.constants import GITHUB_DATETIME_FORMAT
+from app.jobs import (
+    _delete_unlinked_cards,
+    backfill_card_boards,
+    backfill_pull_request_closed_at,
+    purge_stale_data,
+    recompute_board_statuses,
+    reconcile_repositories,
+)
+from app.models import GithubRepo, PullRequest, PullRequestTrelloCard, TrelloCard
+from tests.doubles import payloads
+from app.updater import RECONCILE_CURSOR_OVERLAP
+from tests.doubles.payloads import CREATED_AT
+from tests.doubles.scenarios import REPO_FULLNAME, REPO_ID, CardWithPullRequests, PullRequestWithCards
+
+
+def test_recompute_skips_cards_trello_wont_give_us(app, trello_stub, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 2)
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    deleted_card = scenario.cards[0]
+    del trello_stub.cards[deleted_card["shortLink"]], trello_stub.cards[deleted_card["id"]]
+
+    with app.app_context():
+        assert recompute_board_statuses(app, scenario.board["id"]) == 1
+
+
+def test_recompute_leaves_backfilling_other_cards_boards_to_the_backfill(app, db, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 1)
+    with app.app_context():
+        db.session.add(TrelloCard(id="unrecorded"))
+        db.session.flush()
+        db.session.add(PullRequestTrelloCard(card_id="unrecorded", pull_request_id=scenario.pull_requests[0]["id"]))
+        db.session.commit()
+
+        recompute_board_statuses(app, scenario.board["id"])
+
+        unrecorded = TrelloCard.query.get("unrecorded")
+        assert (unrecorded.board_id, unrecorded.board_backfill_failed_at) == (None, None)
+
+
+def test_backfill_card_boards_skips_cards_trello_wont_give_us_on_later_runs(app, db, trello_stub, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 1)
+    with app.app_context():
+        TrelloCard.query.update({"board_id": None})
+        db.session.add(TrelloCard(id="deleted"))
+        db.session.flush()
+        db.session.add(PullRequestTrelloCard(card_id="deleted", pull_request_id=scenario.pull_requests[0]["id"]))
+        db.session.commit()
+
+        assert backfill_card_boards(app) == 1
+        assert TrelloCard.query.get("deleted").board_backfill_failed_at is not None
+
+        trello_stub.reset_calls()
+        assert backfill_card_boards(app) == 0
+        assert trello_stub.total_calls == 0
+
+
+def test_pull_requests_closed_before_closed_at_was_tracked_are_purged_once_backfilled(app, github_stub, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 2)
+    closed = payloads.github_pull_request(scenario.repo, 1, "", github_stub.url, state="closed")
+    github_stub.add_pull_request(REPO_FULLNAME, closed)
+    with app.app_context():
+        assert purge_stale_data(app)["pull_request"][0] == 0
+
+        assert backfill_pull_request_closed_at(app) == 1
+        assert PullRequest.query.get(closed["id"]).closed_at == CREATED_AT + timedelta(minutes=1)
+
+        assert purge_stale_data(app)["pull_request"][0] == 1
+        assert [pull_request.number for pull_request in PullRequest.query.all()] == [2]
+
+
+def test_deleting_unlinked_cards_keeps_cards_linked_since_they_were_selected(app, db, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 1)
+    with app.app_context():
+        db.session.add(TrelloCard(id="unlinked"))
+        db.session.commit()
+
+        assert _delete_unlinked_cards([scenario.card["shortLink"], "unlinked"]) == 1
+        db.session.commit()
+
+        assert [card.id for card in TrelloCard.query.all()] == [scenario.card["shortLink"]]
+
+
+def test_reconcile_moves_the_cursor_back_by_the_overlap(app, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 3)
+    with app.app_context():
+        started_at = datetime.utcnow()
+
+        assert reconcile_repositories(app) == 3
+
+        reconciled_at = GithubRepo.query.get(REPO_ID).reconciled_at
+        assert started_at - RECONCILE_CURSOR_OVERLAP <= reconciled_at <= datetime.utcnow() - RECONCILE_CURSOR_OVERLAP
+
+        # As if GitHub listed this pull request late: it was updated just before the last run started.
+        updated_at = started_at - RECONCILE_CURSOR_OVERLAP / 2
+        scenario.pull_requests[0]["updated_at"] = updated_at.strftime(GITHUB_DATETIME_FORMAT)
+
+        assert reconcile_repositories(app) == 1
+
+
+def test_reconcile_stops_paginating_at_the_cursor(app, db, github_stub, seed_scenario):
+    github_stub.page_size = 2
+    seed_scenario(CardWithPullRequests, 6)
+    with app.app_context():
+        # Pull request N was updated N minutes after CREATED_AT, so only #5 and #6 are newer than this.
+        GithubRepo.query.update({"reconciled_at": CREATED_AT + timedelta(minutes=4)})
+        db.session.commit()
+        github_stub.reset_calls()
+
+        assert reconcile_repositories(app) == 2
+
+    # The first page (#6 and #5) and the one holding #4; not the last.
+    assert github_stub.calls["GET", "/repositories/{id}/pulls"] == 2
+
+
+def test_reconcile_waits_for_the_rate_limit_to_reset(app, github_stub, seed_scenario, monkeypatch):
+    seed_scenario(CardWithPullRequests, 2)
+    github_stub.rate_limit, github_stub.rate_limit_reset = 0, 30
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        github_stub.rate_limit = None
+
+    monkeypatch.setattr(jobs.time, "sleep", sleep)
+    with app.app_context():
+        assert reconcile_repositories(app) == 2
+
+    [slept] = sleeps
+    assert 29 <= slept <= 31
+
+
+def test_reconcile_gives_up_on_rate_limits_that_reset_too_late(app, github_stub, seed_scenario, monkeypatch):
+    seed_scenario(CardWithPullRequests, 2)
+    github_stub.rate_limit, github_stub.rate_limit_reset = 0, 2 * app.config["RECONCILE_MAX_RATE_LIMIT_WAIT"]
+    sleeps = []
+    monkeypatch.setattr(jobs.time, "sleep", sleeps.append)
+    with app.app_context():
+        assert reconcile_repositories(app) == 0
+        assert GithubRepo.query.get(REPO_ID).reconciled_at is None
+
+    assert sleeps == []
@@ -2,3 +2,71 @@
 TESTS TO WRITE:
 * Cannot access github/trello authorization pages while valid tokens are linked to the account
 """
+from flask import session
+import pytest
+
+from app.auth import end_all_sessions, load_user
+from app.factory import create_app
+from app.models import User
+
+
+@pytest.fixture
+def user_id(seed_scenario):
+    scenario = seed_scenario()
+
+    return scenario.user_id
+
+
+def load_user_in_session(worker, user_id, session_version):
+    with worker.test_request_context():
+        session.update(token_guid="test", session_version=session_version)
+        return load_user(str(user_id)) is not None
+
+
+def end_sessions(worker, db, user_id):
+    with worker.app_context():
+        end_all_sessions(db, User.query.get(user_id))
+
+
+def test_ending_sessions_evicts_the_cached_principal_straight_away(app, db, user_id):
+    assert load_user_in_session(app, user_id, 0)
+
+    end_sessions(app, db, user_id)
+
+    assert not load_user_in_session(app, user_id, 0)
+    assert load_user_in_session(app, user_id, 1)
+
+
+def expire_principals(worker):
+    """As if `SESSION_PRINCIPAL_CACHE_TTL` seconds had passed on `worker`."""
+    cache = worker.extensions["principal_cache"]
+    cache.expire(cache.timer() + cache.ttl + 1)
+
+
+def test_other_workers_end_sessions_once_their_cached_principal_expires(app, db, user_id):
+    other_worker = create_app()
+    assert load_user_in_session(other_worker, user_id, 0)
+
+    end_sessions(app, db, user_id)
+
+    # Still cached there, so the old session holds for up to SESSION_PRINCIPAL_CACHE_TTL seconds.
+    assert load_user_in_session(other_worker, user_id, 0)
+
+    expire_principals(other_worker)
+
+    assert not load_user_in_session(other_worker, user_id, 0)
+    assert load_user_in_session(other_worker, user_id, 1)
+
+
+def test_other_workers_reject_users_deactivated_elsewhere_once_their_cached_principal_expires(app, db, user_id):
+    other_worker = create_app()
+    assert load_user_in_session(other_worker, user_id, 0)
+
+    with app.app_context():
+        User.query.filter(User.id == user_id).update({"active": False})
+        db.session.commit()
+    assert load_user_in_session(other_worker, user_id, 0)
+
+    expire_principals(other_worker)
+
+    assert not load_user_in_session(other_worker, user_id, 0)
@@ -0,0 +1,84 @@
+import io
+import json
+import logging
+
+import pytest
+
+from app.logs import REDACTED, StructuredFormatter, StructuredLogger, redact
+
+
+def test_redact_replaces_sensitive_keys_at_any_depth():
+    value = {
+        "token": "abc",
+        "Authorization": "Bearer abc",
+        "config": {"url": "https://example.com", "secret": "hook-secret"},
+        "items": [{"oauth_token": "abc", "name": "kept"}],
+    }
+
+    assert redact(value) == {
+        "token": REDACTED,
+        "Authorization": REDACTED,
+        "config": {"url": "https://example.com", "secret": REDACTED},
+        "items": [{"oauth_token": REDACTED, "name": "kept"}],
+    }
+
+
+def test_redact_leaves_other_values_alone():
+    assert redact({"id": 1, "names": ("a", "b")}) == {"id": 1, "names": ["a", "b"]}
+    assert redact("token") == "token"
+
+
+@pytest.fixture
+def log_output(request):
+    output = io.StringIO()
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(StructuredFormatter(json_output=request.param))
+
+    logger = logging.getLogger(f"test_logs.{request.node.name}")
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    return StructuredLogger(logger, secrets=["bound-secret"]), output
+
+
+@pytest.mark.parametrize("log_output", [False, True], indirect=True)
+def test_sensitive_fields_and_bound_secrets_are_redacted(log_output):
+    logger, output = log_output
+
+    logger.info(
+        "Calling https://api.example.com/?token=bound-secret", params={"key": "api-key"}, client_secret="s3cr3t"
+    )
+
+    text = output.getvalue()
+    assert "bound-secret" not in text
+    assert "api-key" not in text
+    assert "s3cr3t" not in text
+    assert text.count(REDACTED) == 3
+
+
+@pytest.mark.parametrize("log_output", [True], indirect=True)
+def test_json_output_is_one_object_per_record(log_output):
+    logger, output = log_output
+
+    logger.bind(user_id=1).info("First", token="abc")
+    logger.info("Second")
+
+    first, second = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert (first["message"], first["user_id"], first["token"]) == ("First", 1, REDACTED)
+    assert second["message"] == "Second"
+
+
+class Unformattable:
+    def __repr__(self):
+        raise AssertionError("A field of a record that isn't emitted was formatted")
+
+
+@pytest.mark.parametrize("log_output", [False, True], indirect=True)
+def test_fields_are_only_formatted_when_their_level_is_enabled(log_output):
+    logger, output = log_output
+    logger.logger.setLevel(logging.INFO)
+
+    logger.debug("Incoming pull request", data=Unformattable())
+
+    assert output.getvalue() == ""
@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+import pytest
+
+from app.jobs import recompute_board_statuses, start_background_job
+from app.metrics import endpoint_template
+from tests.doubles.scenarios import CardWithPullRequests, PullRequestWithCards
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def upstream_call_count(upstream, method, endpoint, event, status="200"):
+    labels = {"upstream": upstream, "method": method, "endpoint": endpoint, "status": status, "event": event}
+    return REGISTRY.get_sample_value("upstream_request_seconds_count", labels) or 0
+
+
+@pytest.mark.parametrize(
+    "upstream, url, template",
+    [
+        ("github", "https://api.github.com/repos/owner/repo/pulls/12", "/repos/{owner}/{repo}/pulls/{id}"),
+        (
+            "github",
+            f"https://api.github.com/repos/owner/repo/statuses/{'a1' * 20}",
+            "/repos/{owner}/{repo}/statuses/{sha}",
+        ),
+        ("github", "https://api.github.com/repositories/1001/hooks/7", "/repositories/{id}/hooks/{id}"),
+        (
+            "github",
+            "https://api.github.com/applications/client/tokens/secret",
+            "/applications/{client_id}/tokens/{token}",
+        ),
+        ("trello", "https://api.trello.com/1/tokens/secret", "/tokens/{token}"),
+        ("trello", "https://api.trello.com/1/cards/abc123?fields=all", "/cards/{id}"),
+        ("trello", "https://api.trello.com/1/cards/abc123/checkItem/def456", "/cards/{id}/checkItem/{id}"),
+        ("trello", "https://api.trello.com/1/checklists/abc123/checkItems", "/checklists/{id}/checkItems"),
+        ("trello", "https://api.trello.com/1/members/me/boards", "/members/me/boards"),
+    ],
+)
+def test_endpoint_template_collapses_ids_shas_and_tokens(upstream, url, template):
+    assert endpoint_template(upstream, url) == template
+
+
+def test_card_fetches_on_other_threads_are_labelled_with_their_webhook(app, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 3)
+    before = upstream_call_count("trello", "GET", "/cards/{id}", "github_pull_request")
+
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    assert upstream_call_count("trello", "GET", "/cards/{id}", "github_pull_request") == before + 3
+
+
+def test_background_job_calls_are_labelled_with_the_job(app, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 2)
+    endpoint = "/repos/{owner}/{repo}/pulls/{id}"
+    before = upstream_call_count("github", "GET", endpoint, "recompute_board_statuses")
+
+    start_background_job(app, recompute_board_statuses, scenario.board["id"]).join(timeout=10)
+
+    assert upstream_call_count("github", "GET", endpoint, "recompute_board_statuses") == before + 2
+
+
+def test_metrics_require_the_metrics_token_when_its_set(app, db):
+    app.config["METRICS_TOKEN"] = "metrics-token"
+    client = app.test_client()
+
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer metrics-token"})
+    assert response.status_code == 200
+    assert "upstream_request_seconds" in response.get_data(as_text=True)
+
+
+def test_metrics_aggregate_samples_from_every_worker(app, db, tmpdir, monkeypatch):
+    env = dict(os.environ, prometheus_multiproc_dir=str(tmpdir))
+    for _ in range(2):
+        # Each a separate process, as gunicorn's workers are.
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-c",
+                "from app.metrics import UPSTREAM_REQUEST_SECONDS; "
+                "UPSTREAM_REQUEST_SECONDS.labels('github', 'GET', '/user', '200', 'worker').observe(0.1)",
+            ],
+            cwd=REPO_ROOT,
+            env=env,
+        )
+
+    monkeypatch.setenv("prometheus_multiproc_dir", str(tmpdir))
+    response = app.test_client().get("/metrics")
+
+    assert response.status_code == 200
+    counts = [
+        sample.value
+        for family in text_string_to_metric_families(response.get_data(as_text=True))
+        for sample in family.samples
+        if sample.name == "upstream_request_seconds_count" and sample.labels["event"] == "worker"
+    ]
+    assert counts == [2]
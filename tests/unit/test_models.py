@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy.exc import StatementError
+
+from app.models import (
+    ProductSignoff,
+    PullRequest,
+    PullRequestTrelloCard,
+    TrelloBoard,
+    TrelloCard,
+    TrelloChecklist,
+    upsert_statement,
+)
+from tests.doubles.scenarios import PullRequestWithCards
+
+
+BOARD_ID = "5f" * 12
+
+
+@pytest.mark.parametrize(
+    "lookup",
+    [
+        lambda: TrelloBoard.query.filter(TrelloBoard.id == "not-a-board"),
+        lambda: TrelloBoard.query.filter(TrelloBoard.id.in_(["not-a-board"])),
+        lambda: TrelloCard.query.filter(TrelloCard.board_id == "not-a-board"),
+        lambda: TrelloChecklist.query.filter(TrelloChecklist.id.in_({"not-a-checklist", None})),
+        lambda: ProductSignoff.query.filter(ProductSignoff.trello_board.has(TrelloBoard.id == "not-a-board")),
+    ],
+)
+def test_looking_up_a_malformed_trello_object_id_finds_nothing(app, db, lookup):
+    with app.app_context():
+        db.session.add(TrelloBoard(id=BOARD_ID))
+        db.session.commit()
+
+        assert lookup().all() == []
+
+
+def test_looking_up_malformed_and_valid_trello_object_ids_finds_the_valid_ones(app, db):
+    with app.app_context():
+        db.session.add(TrelloBoard(id=BOARD_ID))
+        db.session.commit()
+
+        assert [board.id for board in TrelloBoard.query.filter(TrelloBoard.id.in_(["not-a-board", BOARD_ID]))] == [
+            BOARD_ID
+        ]
+
+
+def test_writing_a_malformed_trello_object_id_fails(app, db):
+    with app.app_context():
+        db.session.add(TrelloCard(id="card", board_id="not-a-board"))
+
+        with pytest.raises(StatementError):
+            db.session.commit()
+
+
+def upsert_pull_request_and_cards(db, scenario):
+    """The writes `Updater.sync_pull_request` makes for `scenario`'s pull request, as its transaction does."""
+    pull_request = PullRequest.upsert_from_json(data=scenario.pull_request)
+    trello_cards = [TrelloCard.from_json(card) for card in scenario.cards]
+    db.session.execute(upsert_statement(TrelloCard, trello_cards, update_columns=["board_id"]))
+    PullRequestTrelloCard.replace_links(pull_request.id, {trello_card.id for trello_card in trello_cards})
+
+
+def test_concurrent_upserts_of_the_same_pull_request_and_cards_both_succeed(app, db, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 2)
+    engine = db.get_engine(app)
+    first_written, errors = threading.Event(), []
+
+    def second_delivery():
+        try:
+            with app.app_context():
+                first_written.wait(timeout=10)
+                upsert_pull_request_and_cards(db, scenario)
+                db.session.commit()
+
+        except Exception as e:
+            errors.append(e)
+
+    second_thread = threading.Thread(target=second_delivery)
+    second_thread.start()
+    with app.app_context():
+        upsert_pull_request_and_cards(db, scenario)
+        first_written.set()
+
+        # Only commit once the second delivery is waiting on the rows we've written but not committed.
+        deadline = time.monotonic() + 10
+        while not engine.execute(
+            "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND wait_event_type = 'Lock'"
+        ).scalar():
+            assert time.monotonic() < deadline, "The second delivery never waited on the first"
+            time.sleep(0.01)
+
+        db.session.commit()
+
+    second_thread.join(timeout=10)
+
+    assert errors == []
+    with app.app_context():
+        assert [pull_request.id for pull_request in PullRequest.query.all()] == [scenario.pull_request["id"]]
+        assert {card.id for card in TrelloCard.query.all()} == {card["shortLink"] for card in scenario.cards}
+        assert PullRequestTrelloCard.get_card_ids(scenario.pull_request["id"]) == {
+            card["shortLink"] for card in scenario.cards
+        }
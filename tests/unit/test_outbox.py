@@ -0,0 +1,245 @@
+from datetime import datetime, timedelta
+import threading
+
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+import pytest
+
+from app import outbox
+from app.jobs import recompute_board_statuses, start_background_job
+from app.models import OutboundCommitStatus, OutboundEmail
+from app.outbox import dispatch_commit_statuses, enqueue_email, send_queued_emails
+from tests.doubles.scenarios import CardWithPullRequests, PullRequestWithCards
+
+PHASES = ["total", "processing", "queueing", "upstream"]
+
+
+@pytest.fixture
+def sent_emails(monkeypatch):
+    """The recipients of every email sent through SparkPost. Sends to addresses in `sent_emails.failing` raise."""
+
+    class SentEmails(list):
+        failing = set()
+
+    sent_emails = SentEmails()
+
+    def send(recipients, **kwargs):
+        if sent_emails.failing & set(recipients):
+            raise Exception("SparkPost is down")
+
+        sent_emails.extend(recipients)
+
+    monkeypatch.setattr(outbox.sparkpost.transmissions, "send", send)
+
+    return sent_emails
+
+
+def supersede_commit_statuses(app, db):
+    """As if another webhook changed every commit status (see `enqueue_commit_status`)."""
+    db.get_engine(app).execute(
+        "UPDATE outbound_commit_status "
+        "SET version = version + 1, state = 'success', send_after = now() AT TIME ZONE 'utc'"
+    )
+
+
+def dispatch_elsewhere(app):
+    """Runs a dispatcher on another thread (so with its own session), as another worker process would."""
+    results = []
+
+    def dispatch():
+        with app.app_context():
+            results.append(dispatch_commit_statuses(app))
+
+    thread = threading.Thread(target=dispatch)
+    thread.start()
+    thread.join(timeout=10)
+
+    return results[0]
+
+
+def queue_email(app, db, recipient, **columns):
+    with app.app_context():
+        email = enqueue_email(recipient=recipient, subject="Subject", html="<p>Body</p>")
+        for name, value in columns.items():
+            setattr(email, name, value)
+        db.session.commit()
+
+        return email.id
+
+
+def posted_statuses(outcome, phase="total"):
+    labels = {"event": "github_pull_request", "phase": phase, "outcome": outcome}
+    return REGISTRY.get_sample_value("webhook_to_status_seconds_count", labels) or 0
+
+
+def all_posted_statuses():
+    """Latency observations of every event, phase and outcome."""
+    return sum(
+        sample.value
+        for metric in REGISTRY.collect()
+        for sample in metric.samples
+        if sample.name == "webhook_to_status_seconds_count"
+    )
+
+
+def test_status_queued_from_a_webhook_records_every_latency_phase(app, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 1)
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    with app.app_context():
+        [commit_status] = OutboundCommitStatus.query.all()
+        assert commit_status.triggered_by == "github_pull_request"
+        assert commit_status.triggered_at is not None
+    before = [posted_statuses("current", phase) for phase in PHASES]
+
+    with app.app_context():
+        assert dispatch_commit_statuses(app) == (1, 0)
+
+    assert [posted_statuses("current", phase) for phase in PHASES] == [count + 1 for count in before]
+
+
+def test_statuses_queued_outside_a_webhook_record_no_latency(app, seed_scenario):
+    scenario = seed_scenario(CardWithPullRequests, 2)
+    start_background_job(app, recompute_board_statuses, scenario.board["id"]).join(timeout=10)
+
+    with app.app_context():
+        assert {commit_status.triggered_by for commit_status in OutboundCommitStatus.query.all()} == {None}
+    before = all_posted_statuses()
+
+    with app.app_context():
+        assert dispatch_commit_statuses(app) == (2, 0)
+
+    assert all_posted_statuses() == before
+
+
+def test_status_superseded_while_posted_records_its_latency_apart(app, db, github_stub, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 1)
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    create_status = github_stub.create_status
+
+    def create_status_then_supersede(*args, **kwargs):
+        # As if another webhook changed the status while GitHub was answering.
+        supersede_commit_statuses(app, db)
+        return create_status(*args, **kwargs)
+
+    github_stub.create_status = create_status_then_supersede
+    superseded_before, current_before = posted_statuses("superseded"), posted_statuses("current")
+
+    with app.app_context():
+        assert dispatch_commit_statuses(app) == (1, 0)
+    assert (posted_statuses("superseded"), posted_statuses("current")) == (superseded_before + 1, current_before)
+
+    # The new version is posted next, and counted as current.
+    github_stub.create_status = create_status
+    with app.app_context():
+        assert dispatch_commit_statuses(app) == (1, 0)
+    assert [body["state"] for _, _, body in github_stub.statuses] == ["pending", "success"]
+    assert (posted_statuses("superseded"), posted_statuses("current")) == (superseded_before + 1, current_before + 1)
+
+
+def test_status_superseded_while_posted_waits_for_that_post_whichever_dispatcher_picks_it_up(
+    app, db, github_stub, seed_scenario
+):
+    scenario = seed_scenario(PullRequestWithCards, 1)
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    create_status = github_stub.create_status
+    other_dispatches = []
+
+    def create_status_then_supersede(*args, **kwargs):
+        supersede_commit_statuses(app, db)
+        # Another dispatcher mustn't post the new version while the old one is in flight: it could land first.
+        other_dispatches.append(dispatch_elsewhere(app))
+        return create_status(*args, **kwargs)
+
+    github_stub.create_status = create_status_then_supersede
+    with app.app_context():
+        assert dispatch_commit_statuses(app) == (1, 0)
+    assert other_dispatches == [(0, 0)]
+
+    # Once the old post has returned, any dispatcher may post the new version.
+    github_stub.create_status = create_status
+    assert dispatch_elsewhere(app) == (1, 0)
+    assert [body["state"] for _, _, body in github_stub.statuses] == ["pending", "success"]
+    with app.app_context():
+        [commit_status] = OutboundCommitStatus.query.all()
+        assert (commit_status.state, commit_status.leased_until) == ("success", None)
+        assert commit_status.sent_at is not None
+
+
+def test_due_emails_are_sent_once_and_marked_sent(app, db, sent_emails):
+    email_id = queue_email(app, db, "due@example.com")
+    queue_email(app, db, "later@example.com", send_after=datetime.utcnow() + timedelta(hours=1))
+
+    with app.app_context():
+        assert send_queued_emails(app) == (1, 0)
+        assert OutboundEmail.query.get(email_id).sent_at is not None
+        assert send_queued_emails(app) == (0, 0)
+
+    assert sent_emails == ["due@example.com"]
+
+
+def test_emails_are_leased_before_they_are_sent(app, db, sent_emails, monkeypatch):
+    queue_email(app, db, "due@example.com")
+    send_afters = []
+
+    def send(recipients, **kwargs):
+        # Read on another connection: the lease is committed, so no lock is held while SparkPost answers.
+        send_afters.append(db.get_engine(app).execute("SELECT send_after FROM outbound_email").scalar())
+
+    monkeypatch.setattr(outbox.sparkpost.transmissions, "send", send)
+    started_at = datetime.utcnow()
+    with app.app_context():
+        assert send_queued_emails(app) == (1, 0)
+
+    [send_after] = send_afters
+    assert send_after >= started_at + timedelta(seconds=app.config["EMAIL_OUTBOX_LEASE"])
+
+
+def test_failed_emails_are_retried_with_backoff(app, db, sent_emails):
+    email_id = queue_email(app, db, "due@example.com")
+    sent_emails.failing = {"due@example.com"}
+
+    started_at = datetime.utcnow()
+    with app.app_context():
+        assert send_queued_emails(app) == (0, 1)
+    finished_at = datetime.utcnow()
+
+    backoff = timedelta(seconds=app.config["EMAIL_OUTBOX_RETRY_BACKOFF"] * 2)
+    with app.app_context():
+        email = OutboundEmail.query.get(email_id)
+        assert (email.attempts, email.last_error, email.sent_at) == (1, "SparkPost is down", None)
+        assert started_at + backoff <= email.send_after <= finished_at + backoff
+
+        # Not retried until it's due again.
+        sent_emails.failing = set()
+        assert send_queued_emails(app) == (0, 0)
+        email.send_after = datetime.utcnow()
+        db.session.commit()
+        assert send_queued_emails(app) == (1, 0)
+
+    assert sent_emails == ["due@example.com"]
+
+
+def test_metrics_report_the_depth_of_each_outbox(app, db):
+    queue_email(app, db, "pending@example.com", created_at=datetime.utcnow() - timedelta(minutes=10))
+    queue_email(app, db, "abandoned@example.com", attempts=app.config["EMAIL_OUTBOX_MAX_ATTEMPTS"])
+
+    response = app.test_client().get("/metrics")
+
+    assert response.status_code == 200
+    samples = {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.get_data(as_text=True))
+        for sample in family.samples
+        if sample.name.startswith("outbox_")
+    }
+    assert samples[("outbox_messages", (("outbox", "email"), ("state", "pending")))] == 1
+    assert samples[("outbox_messages", (("outbox", "email"), ("state", "abandoned")))] == 1
+    assert samples[("outbox_messages", (("outbox", "commit_status"), ("state", "pending")))] == 0
+    assert samples[("outbox_oldest_pending_age_seconds", (("outbox", "email"),))] >= 10 * 60
+    assert samples[("outbox_oldest_pending_age_seconds", (("outbox", "commit_status"),))] == 0
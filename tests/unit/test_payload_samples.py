@@ -0,0 +1,71 @@
+from app.logs import REDACTED
+from app.models import GithubIntegration, TrelloIntegration
+from app.payload_samples import get_payload_samples, init_payload_samples, sample_payload
+from tests.doubles.scenarios import PullRequestWithCards
+
+
+def unread_body():
+    raise AssertionError("The body of a payload that isn't kept was read")
+
+
+def sample_card(app, user_id=1, body="{}", **kwargs):
+    """Offers a `GET /cards/{id}` response for sampling."""
+    sample_payload(app, "trello", "response", "/cards/{id}", lambda: body, status=200, user_id=user_id, **kwargs)
+
+
+def test_nothing_is_sampled_by_default(app):
+    sample_payload(app, "trello", "response", "/cards/{id}", unread_body, user_id=1)
+
+    assert get_payload_samples(app) == []
+
+
+def test_only_chosen_endpoints_and_users_are_sampled(app):
+    app.config.update(PAYLOAD_SAMPLE_RATE=1, PAYLOAD_SAMPLE_ENDPOINTS=["/cards/"], PAYLOAD_SAMPLE_USER_IDS={1})
+
+    sample_payload(app, "trello", "response", "/boards/{id}", unread_body, user_id=1)
+    sample_payload(app, "trello", "response", "/cards/{id}", unread_body, user_id=2)
+    sample_card(app, user_id=1)
+
+    assert [(sample["endpoint"], sample["user_id"]) for sample in get_payload_samples(app)] == [("/cards/{id}", 1)]
+
+
+def test_a_full_buffer_drops_its_oldest_sample(app):
+    app.config.update(PAYLOAD_SAMPLE_RATE=1, PAYLOAD_SAMPLE_BUFFER_SIZE=2)
+    init_payload_samples(app)
+
+    for index in range(3):
+        sample_card(app, body=f"sample {index}")
+
+    assert [sample["body"] for sample in get_payload_samples(app)] == ["sample 2", "sample 1"]
+
+
+def test_bodies_are_truncated_and_have_secrets_redacted(app):
+    app.config.update(PAYLOAD_SAMPLE_RATE=1, PAYLOAD_SAMPLE_MAX_LENGTH=32)
+
+    sample_card(app, body="token=user-token " + "x" * 32, secrets=["user-token", None])
+
+    [kept] = get_payload_samples(app)
+    assert kept["body"] == (f"token={REDACTED} " + "x" * 32)[:32]
+    assert kept["truncated"]
+
+
+def test_admin_payload_samples_never_include_tokens(app, db, seed_scenario):
+    app.config.update(PAYLOAD_SAMPLE_RATE=1, ADMIN_TOKEN="admin-token")
+    scenario = seed_scenario(PullRequestWithCards, 1)
+    with app.app_context():
+        GithubIntegration.query.update({"oauth_token": "github-user-token"})
+        TrelloIntegration.query.update({"oauth_token": "trello-user-token"})
+        db.session.commit()
+
+    # As if Trello echoed the credentials it was called with.
+    scenario.cards[0]["desc"] = f"key={app.config['TRELLO_API_KEY']}&token=trello-user-token"
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    response = app.test_client().get("/admin/payload-samples", headers={"Authorization": "Bearer admin-token"})
+
+    assert response.status_code == 200
+    samples = {(sample["upstream"], sample["endpoint"]): sample for sample in response.get_json()["samples"]}
+    assert {("github", "/github/integration/callback"), ("trello", "/cards/{id}")} <= samples.keys()
+    assert f"token={REDACTED}" in samples["trello", "/cards/{id}"]["body"]
+    assert "user-token" not in response.get_data(as_text=True)
@@ -0,0 +1,84 @@
+import time
+
+from flask import Flask
+import pytest
+
+from app import profiling
+from app.factory import create_app
+from app.profiling import _is_valid_token, get_profile_path, make_profile_token
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["ADMIN_TOKEN"] = "admin-token"
+    return app
+
+
+@pytest.fixture
+def profiled_app(tmpdir):
+    app = create_app()
+    app.config.update(ADMIN_TOKEN="admin-token", PROFILE_DIR=str(tmpdir.join("profiles")))
+    return app
+
+
+def profiled_request(app):
+    """Requests the (database-free) list of profiles, asking for it to be profiled. Returns the response."""
+    headers = {"Authorization": "Bearer admin-token", "X-Profile": make_profile_token(app, 60)}
+    return app.test_client().get("/admin/profiles", headers=headers)
+
+
+def test_token_is_valid_until_it_expires(app):
+    assert _is_valid_token(app, make_profile_token(app, 60))
+
+
+def test_expired_token_is_rejected(app):
+    assert not _is_valid_token(app, make_profile_token(app, -1))
+
+
+def test_token_with_extended_expiry_is_rejected(app):
+    expires_at, _, signature = make_profile_token(app, 60).partition(".")
+    assert not _is_valid_token(app, f"{int(expires_at) + 3600}.{signature}")
+
+
+def test_token_signed_with_another_admin_token_is_rejected(app):
+    other_app = Flask(__name__)
+    other_app.config["ADMIN_TOKEN"] = "another-admin-token"
+
+    assert not _is_valid_token(app, make_profile_token(other_app, 60))
+
+
+@pytest.mark.parametrize(
+    "token", ["", "not-a-token", f"{int(time.time()) + 60}", f"{int(time.time()) + 60}.", "-1.abc"]
+)
+def test_malformed_token_is_rejected(app, token):
+    assert not _is_valid_token(app, token)
+
+
+def test_nothing_is_profiled_without_an_admin_token(app):
+    token = make_profile_token(app, 60)
+    app.config["ADMIN_TOKEN"] = None
+
+    assert not _is_valid_token(app, token)
+
+
+def test_a_worker_only_profiles_one_request_at_a_time(profiled_app):
+    # As if another request were being profiled by this worker.
+    with profiling._profile_lock:
+        assert "X-Profile-Id" not in profiled_request(profiled_app).headers
+
+    assert "X-Profile-Id" in profiled_request(profiled_app).headers
+
+
+def test_profiles_can_only_be_fetched_by_their_id(profiled_app, tmpdir):
+    profile_id = profiled_request(profiled_app).headers["X-Profile-Id"]
+    tmpdir.join("secret.prof").write("Not a profile")
+    client = profiled_app.test_client()
+
+    response = client.get(f"/admin/profiles/{profile_id}", headers={"Authorization": "Bearer admin-token"})
+
+    assert response.status_code == 200
+    for not_a_profile_id in ("../secret", "secret", profile_id.upper(), f"{profile_id}.json", f"{profile_id}/"):
+        assert get_profile_path(profiled_app, not_a_profile_id) is None
+    response = client.get("/admin/profiles/..%2Fsecret", headers={"Authorization": "Bearer admin-token"})
+    assert response.status_code == 404
@@ -0,0 +1,113 @@
+"""
+The SQL statements run by the hot endpoints, checked against a budget so changes that add a query per row (e.g. a lazy
+relationship loaded in a loop) fail. Each endpoint is measured at two sizes (login tokens, connected repositories or
+linked cards) and must run the same number of statements at both.
+"""
+from contextlib import contextmanager
+import uuid
+
+from flask import session
+import pytest
+from sqlalchemy import event
+
+from app.auth import load_user
+from app.models import GithubRepo, LoginToken
+from tests.doubles.scenarios import REPO_FULLNAME, PullRequestWithCards
+
+
+SIZES = (1, 10)
+
+
+@contextmanager
+def recorded_statements(app, db):
+    """Collects the SQL of every statement run inside the block, on any connection."""
+    statements = []
+    engine = db.get_engine(app)
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def add_rows(app, db, rows):
+    with app.app_context():
+        db.session.add_all(rows)
+        db.session.commit()
+
+
+def login_tokens(user_id, count):
+    return [LoginToken(guid=str(uuid.uuid4()), user_id=user_id) for _ in range(count)]
+
+
+def call_load_user(app, user_id):
+    with app.test_request_context():
+        session.update(token_guid="test", session_version=0)
+        assert load_user(str(user_id))
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_load_user_runs_one_statement_however_many_login_tokens(app, db, seed_scenario, size):
+    scenario = seed_scenario()
+    add_rows(app, db, login_tokens(scenario.user_id, size))
+
+    # The user joined with both integrations.
+    with recorded_statements(app, db) as statements:
+        call_load_user(app, scenario.user_id)
+
+    assert len(statements) == 1, statements
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_cached_load_user_runs_no_statements(app, db, seed_scenario, size):
+    scenario = seed_scenario()
+    add_rows(app, db, login_tokens(scenario.user_id, size))
+    call_load_user(app, scenario.user_id)
+
+    with recorded_statements(app, db) as statements:
+        call_load_user(app, scenario.user_id)
+
+    assert statements == []
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_dashboard_statements_dont_grow_with_connected_repositories(app, db, trello_stub, seed_scenario, log_in, size):
+    scenario = seed_scenario()
+    add_rows(
+        app,
+        db,
+        [
+            GithubRepo(id=repo_id, fullname=f"{REPO_FULLNAME}-{repo_id}", integration_id=scenario.user_id, hook_id="1")
+            for repo_id in range(1, size)
+        ],
+    )
+    trello_stub.add_board(scenario.board, [scenario.in_review_list, scenario.signoff_list])
+    client = log_in(app.test_client(), "benchmark@example.com")
+    # So the principal and board catalog are cached, as they are for most page loads.
+    assert client.get("/dashboard").status_code == 200
+
+    # The connected repositories and the boards' sign-off checks.
+    with recorded_statements(app, db) as statements:
+        assert client.get("/dashboard").status_code == 200
+
+    assert len(statements) == 2, statements
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_github_callback_statements_dont_grow_with_linked_cards(app, db, seed_scenario, size):
+    scenario = seed_scenario(PullRequestWithCards, size)
+
+    # The repo with its owner and GitHub integration, the owner's Trello integration, then in the transaction: upsert
+    # the pull request, read its linked cards, upsert the cards, replace the links (delete + insert), reload the links,
+    # look up the sign-off lists and queue the commit status.
+    path, body, headers = scenario.request(0)
+    with recorded_statements(app, db) as statements:
+        response = app.test_client().post(path, json=body, headers=headers)
+
+    assert response.status_code == 200
+    assert len(statements) == 10, statements
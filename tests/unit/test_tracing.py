@@ -0,0 +1,68 @@
+import json
+import uuid
+
+import pytest
+
+from app.tracing import current_span, span, trace
+from tests.doubles.scenarios import PullRequestWithCards
+
+
+@pytest.fixture
+def trace_file(app, tmpdir):
+    path = tmpdir.join("traces.jsonl")
+    app.config.update(TRACE_EXPORTER="file", TRACE_FILE_PATH=str(path), TRACE_SLOW_THRESHOLD_MS=0, TRACE_SAMPLE_RATE=0)
+
+    def exported_traces():
+        return [json.loads(line) for line in path.readlines()] if path.exists() else []
+
+    return exported_traces
+
+
+def test_github_callback_trace_joins_card_fetches_made_on_other_threads(app, seed_scenario, trace_file):
+    app.config["UPSTREAM_REQUEST_CONCURRENCY"] = 3
+    scenario = seed_scenario(PullRequestWithCards, 3)
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    [exported] = trace_file()
+    assert exported["name"] == "github_pull_request"
+    assert exported["trace_id"] == uuid.UUID(headers["X-GitHub-Delivery"]).hex
+
+    spans_by_name = {}
+    for recorded in exported["spans"]:
+        spans_by_name.setdefault(recorded["name"], []).append(recorded)
+    [root] = spans_by_name["github_pull_request"]
+    [fetch_stage] = spans_by_name["sync_pull_request.fetch_trello_cards"]
+    card_fetches = spans_by_name["trello GET /cards/{id}"]
+
+    assert root["parent_id"] is None
+    assert fetch_stage["parent_id"] == root["span_id"]
+    assert [card_fetch["parent_id"] for card_fetch in card_fetches] == [fetch_stage["span_id"]] * 3
+    # Every span hangs off another span of the same trace.
+    span_ids = {recorded["span_id"] for recorded in exported["spans"]}
+    assert {recorded["parent_id"] for recorded in exported["spans"]} - span_ids == {None}
+
+
+def test_only_slow_traces_are_exported_when_none_are_sampled(app, trace_file):
+    app.config["TRACE_SLOW_THRESHOLD_MS"] = 60 * 1000
+    with trace(app, "fast"):
+        with span("stage"):
+            pass
+
+    app.config["TRACE_SLOW_THRESHOLD_MS"] = 0
+    with trace(app, "slow"):
+        with span("stage"):
+            pass
+
+    assert [exported["name"] for exported in trace_file()] == ["slow"]
+
+
+def test_spans_do_nothing_without_an_exporter(app, trace_file):
+    app.config["TRACE_EXPORTER"] = None
+    with trace(app, "untraced") as root:
+        root.set(ignored=True)
+        with span("stage") as stage:
+            stage.set(ignored=True)
+            assert current_span() is None
+
+    assert trace_file() == []
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+import requests
+
+from app import transport
+from app.transport import RecordingTransport, ReplayingTransport
+
+
+def make_response(status_code, body, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.encoding = "utf8"
+    response._content = json.dumps(body).encode("utf8")
+    return response
+
+
+@pytest.fixture
+def cassette_path(tmpdir):
+    return str(tmpdir.join("cassette-{pid}.jsonl"))
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    responses = []
+    monkeypatch.setattr(transport.requests, "request", lambda method, url, **kwargs: responses.pop(0))
+    return responses
+
+
+def create_webhook(http, token, client_secret):
+    return http.request(
+        "post",
+        f"https://api.github.com/repos/owner/repo/hooks?access_token={token}",
+        secrets=[token, client_secret],
+        params={"client_secret": client_secret, "per_page": 100},
+        json={"config": {"url": "https://example.com/callback", "secret": "hook-secret"}, "events": ["pull_request"]},
+    )
+
+
+def read_cassette(tmpdir):
+    (path,) = tmpdir.listdir()
+    return path.read()
+
+
+def test_recorded_cassette_contains_no_tokens_or_secrets(tmpdir, cassette_path, upstream):
+    upstream.append(
+        make_response(201, {"id": 1, "token_echo": "user-token"}, {"X-RateLimit-Remaining": "4999", "Set-Cookie": "x"})
+    )
+
+    create_webhook(RecordingTransport(cassette_path), "user-token", "client-secret")
+
+    cassette = read_cassette(tmpdir)
+    for secret in ("user-token", "client-secret", "hook-secret"):
+        assert secret not in cassette
+
+    interaction = json.loads(cassette)
+    assert interaction["status"] == 201
+    assert interaction["headers"] == {"X-RateLimit-Remaining": "4999"}
+    assert json.loads(interaction["body"])["config"] == {"url": "https://example.com/callback", "secret": "<REDACTED>"}
+
+
+def test_replay_matches_requests_made_with_other_credentials(tmpdir, cassette_path, upstream):
+    upstream.extend([make_response(201, {"id": 1}), make_response(201, {"id": 2})])
+    recorder = RecordingTransport(cassette_path)
+    create_webhook(recorder, "user-token", "client-secret")
+    create_webhook(recorder, "user-token", "client-secret")
+
+    replayer = ReplayingTransport(cassette_path)
+    replayed = [create_webhook(replayer, "other-token", "other-secret").json()["id"] for _ in range(3)]
+
+    assert replayed == [1, 2, 1]
+
+
+def test_replaying_an_unrecorded_request_fails_like_a_connection_error(cassette_path):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        ReplayingTransport(cassette_path).request("get", "https://api.github.com/user", secrets=[])
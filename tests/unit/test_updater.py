@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app.models import OutboundCommitStatus, PullRequestTrelloCard, TrelloCard, User, upsert_statement
+from app.updater import Updater
+from tests.doubles.scenarios import PullRequestWithCards
+
+
+@contextmanager
+def counted_commits(app, db):
+    """Counts the transactions committed inside the block, on any connection."""
+    commits = []
+    engine = db.get_engine(app)
+
+    def record(conn):
+        commits.append(conn)
+
+    event.listen(engine, "commit", record)
+    try:
+        yield commits
+
+    finally:
+        event.remove(engine, "commit", record)
+
+
+def sync_pull_request(app, db, scenario):
+    with app.app_context():
+        Updater(app, db, User.query.one()).sync_pull_request(data=scenario.pull_request)
+
+
+def test_upsert_statement_writes_instances_sharing_a_primary_key_once(app, db):
+    with app.app_context():
+        db.session.execute(
+            upsert_statement(
+                TrelloCard,
+                [TrelloCard(id="card", board_id="1" * 24), TrelloCard(id="card", board_id="2" * 24)],
+                update_columns=["board_id"],
+            )
+        )
+        db.session.commit()
+
+        assert [(card.id, card.board_id) for card in TrelloCard.query.all()] == [("card", "2" * 24)]
+
+
+def test_sync_pull_request_linking_a_card_by_short_link_and_full_id(app, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 1)
+
+    card = scenario.cards[0]
+    scenario.pull_request["body"] += f"\n* https://trello.com/c/{card['id']}"
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    with app.app_context():
+        assert [(link.card_id, link.pull_request_id) for link in PullRequestTrelloCard.query.all()] == [
+            (card["shortLink"], scenario.pull_request["id"])
+        ]
+
+
+def test_sync_pull_request_linking_a_card_by_full_id_only(app, seed_scenario):
+    scenario = seed_scenario(PullRequestWithCards, 1)
+    card = scenario.cards[0]
+    scenario.pull_request["body"] = f"Product sign-off: https://trello.com/c/{card['id']}"
+
+    path, body, headers = scenario.request(0)
+    assert app.test_client().post(path, json=body, headers=headers).status_code == 200
+
+    with app.app_context():
+        assert PullRequestTrelloCard.get_card_ids(scenario.pull_request["id"]) == {card["shortLink"]}
+        # The card is still in review, so counts towards the status.
+        assert OutboundCommitStatus.query.one().state == "pending"
+
+
+@pytest.mark.parametrize("checklists, expected_commits", [(False, 1), (True, 2)])
+def test_sync_pull_request_commits_once_per_transaction(app, db, seed_scenario, checklists, expected_commits):
+    scenario = seed_scenario(PullRequestWithCards, 3, checklists=checklists)
+
+    # The pull request and its cards, then (with checklists on) the checklist IDs written back once Trello has them.
+    with counted_commits(app, db) as commits:
+        sync_pull_request(app, db, scenario)
+
+    assert len(commits) == expected_commits
+
+
+def test_sync_pull_request_makes_no_trello_writes_when_its_transaction_rolls_back(
+    app, db, trello_stub, seed_scenario, monkeypatch
+):
+    scenario = seed_scenario(PullRequestWithCards, 2, checklists=True)
+    sync_pull_request(app, db, scenario)
+    linked_card_ids = {card["shortLink"] for card in scenario.cards}
+
+    # Unlinking a card would delete its checkitem, and the other card's checklist is checked again.
+    scenario.link_cards(scenario.cards[:1])
+    monkeypatch.setattr(Updater, "_update_pull_request_status", lambda *args, **kwargs: 1 / 0)
+    trello_stub.reset_calls()
+
+    with pytest.raises(ZeroDivisionError):
+        sync_pull_request(app, db, scenario)
+
+    assert [(method, endpoint) for method, endpoint in trello_stub.calls if method != "GET"] == []
+    assert {endpoint for _, endpoint in trello_stub.calls} == {"/cards/{id}"}
+    with app.app_context():
+        assert PullRequestTrelloCard.get_card_ids(scenario.pull_request["id"]) == linked_card_ids